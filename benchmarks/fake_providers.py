@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Local stand-ins for the IEEE Xplore, Springer Meta and ScienceDirect search APIs.
+
+A FakeProviders server answers searches at /ieeexplore, /springer and
+/science_direct with synthetic responses (see benchmarks.payloads) in
+each provider's format.  Every query has CORPUS results, which are the
+same whichever page size is used to fetch them, so runs can be
+compared.  Faults can be injected: latency, 429 responses, server
+errors, truncated JSON, and the providers' rate-limit error responses.
+Point a plan's sites at it with their `endpoint` key, or run it
+standalone,
+
+    PYTHONPATH=src python -m benchmarks.fake_providers --port 8000 --corpus 5000 --error-rate 0.01
+"""
+
+import sys
+import json
+import time
+import zlib
+import random
+import logging
+import threading
+
+from argparse import ArgumentParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+
+from benchmarks.payloads import synthetic_payload
+
+LOGGER = logging.getLogger('benchmarks.fake_providers')
+
+# Provider -> (method, start parameter, page size parameter, parameters which are not the query).
+PROVIDERS = {'ieeexplore': ('GET', 'start_record', 'max_results', {'apikey', 'format'}),
+             'springer': ('GET', 's', 'p', {'api_key'}),
+             'science_direct': ('PUT', 'offset', 'show', set())}
+
+# Provider -> (status, headers, body) of its rate limit error response.
+RATE_LIMIT_RESPONSES = {'ieeexplore': (403, {'Content-Type': 'text/html', 'X-Error-Detail-Header': 'Account Over Rate Limit'},
+                                       b'<h1>Developer Over Rate</h1>'),
+                        'springer': (403, {'Content-Type': 'text/html', 'X-Error-Detail-Header': 'Account Over Queries Per Second Limit'},
+                                     b'<h1>Developer Over Qps</h1>'),
+                        'science_direct': (429, {'Content-Type': 'application/json', 'X-ELS-Status': 'QUOTA_EXCEEDED - Quota Exceeded'},
+                                           json.dumps({'error-response': {'error_code': 'RATE_LIMIT_EXCEEDED',
+                                                                          'error_message': 'Rate of requests exceeds specified limits'}}).encode('utf-8'))}
+
+
+class Faults:
+    """Fault injection: LATENCY seconds (plus up to JITTER) per response, and the probability of each fault."""
+
+    def __init__(self, latency=0.0, jitter=0.0, throttle_rate=0.0, error_rate=0.0, truncate_rate=0.0,
+                 rate_limit_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rates = [('throttle', throttle_rate),
+                      ('error', error_rate),
+                      ('truncate', truncate_rate),
+                      ('rate_limit', rate_limit_rate)]
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def draw(self):
+        """The delay and fault (or None) of a response."""
+        with self.lock:
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            roll = self.random.random()
+        for (fault, rate) in self.rates:
+            if roll < rate:
+                return (delay, fault)
+            roll -= rate
+        return (delay, None)
+
+
+class Statistics:
+    """Counts of responses by outcome, and the time taken to serve each."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.outcomes = {}
+            self.latencies = []
+            self.records = 0
+
+    def add(self, outcome, latency, records=0):
+        with self.lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            self.latencies.append(latency)
+            self.records += records
+
+    def percentile(self, fraction):
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+    def summary(self):
+        return {'requests': len(self.latencies),
+                'outcomes': dict(self.outcomes),
+                'records': self.records,
+                'p50': self.percentile(0.5),
+                'p99': self.percentile(0.99)}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        LOGGER.debug(format, *args)
+
+    def do_GET(self):
+        self.answer()
+
+    def do_PUT(self):
+        self.answer()
+
+    def send(self, status, headers, body):
+        self.send_response(status)
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def answer(self):
+        began = time.perf_counter()
+        server = self.server
+        url = urlsplit(self.path)
+        provider = url.path.strip('/')
+        if provider not in PROVIDERS:
+            self.send(404, {'Content-Type': 'text/plain'}, b'Unknown provider.')
+            return
+        (method, start_name, size_name, ignored) = PROVIDERS[provider]
+        parameters = dict(parse_qsl(url.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > 0:
+            parameters.update(json.loads(self.rfile.read(length)))
+        if self.command != method:
+            self.send(405, {'Content-Type': 'text/plain'}, b'Method not allowed.')
+            return
+        start = int(parameters.pop(start_name, 1))
+        size = int(parameters.pop(size_name, 10))
+        if server.page_cap is not None:
+            size = min(size, server.page_cap)
+        query = json.dumps({key: value for (key, value) in parameters.items() if key not in ignored}, sort_keys=True)
+
+        (delay, fault) = server.faults.draw()
+        if delay > 0:
+            time.sleep(delay)
+        records = 0
+        if fault == 'throttle':
+            self.send(429, {'Content-Type': 'application/json', 'Retry-After': '1'}, b'{"error": "Too Many Requests"}')
+        elif fault == 'error':
+            self.send(503, {'Content-Type': 'text/html'}, b'<h1>Service Unavailable</h1>')
+        elif fault == 'rate_limit':
+            self.send(*RATE_LIMIT_RESPONSES[provider])
+        else:
+            payload = server.page(provider, query, start, size)
+            body = json.dumps(payload).encode('utf-8')
+            if fault == 'truncate':
+                body = body[:len(body) // 2]
+            else:
+                records = max(0, min(size, server.corpus - start + 1))
+            self.send(200, {'Content-Type': 'application/json'}, body)
+        server.statistics.add(fault or 'ok', time.perf_counter() - began, records)
+
+
+class FakeProviders(ThreadingHTTPServer):
+    """A server standing in for every provider, with CORPUS results per query.
+
+    Results of a query are numbered from a base derived from the query
+    and provider, so different queries find different publications.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), corpus=1000, faults=None, seed=0, page_cap=None):
+        super().__init__(address, Handler)
+        self.corpus = corpus
+        self.page_cap = page_cap
+        self.faults = faults if faults is not None else Faults()
+        self.seed = seed
+        self.statistics = Statistics()
+        self.thread = None
+
+    def base(self, provider, query):
+        return (zlib.crc32(f"{provider}/{query}".encode('utf-8')) % 100000) * 1000000
+
+    def page(self, provider, query, start, size):
+        size = max(0, min(size, self.corpus - start + 1))
+        return synthetic_payload(provider, size, start=start, total=self.corpus,
+                                 seed=self.seed, base=self.base(provider, query))
+
+    def handle_error(self, request, client_address):
+        # Clients killed mid-response (as the soak test does) are expected.
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def endpoint(self, provider):
+        (host, port) = self.server_address[:2]
+        return f"http://{host}:{port}/{provider}"
+
+    def start(self):
+        """Serve in a background thread."""
+        self.thread = threading.Thread(target=self.serve_forever, name='fake-providers', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def add_fault_arguments(parser):
+    """Add fake provider and fault injection options to an argument PARSER."""
+    parser.add_argument('--corpus', type=int, default=1000,
+                        help="number of results of each query")
+    parser.add_argument('--page-cap', type=int, default=None,
+                        help="largest number of records served per page")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds taken to answer each request")
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help="up to this many more seconds taken to answer each request")
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help="fraction of requests answered with 429 Too Many Requests")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="fraction of requests answered with 503 Service Unavailable")
+    parser.add_argument('--truncate-rate', type=float, default=0.0,
+                        help="fraction of responses whose JSON is truncated")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0,
+                        help="fraction of requests answered with the provider's rate limit error")
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def faults_from_arguments(args):
+    return Faults(latency=args.latency, jitter=args.jitter, throttle_rate=args.throttle_rate,
+                  error_rate=args.error_rate, truncate_rate=args.truncate_rate,
+                  rate_limit_rate=args.rate_limit_rate, seed=args.seed)
+
+
+def main():
+    parser = ArgumentParser(description="Serve fake provider search APIs.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeProviders((args.host, args.port), corpus=args.corpus,
+                           faults=faults_from_arguments(args), seed=args.seed, page_cap=args.page_cap)
+    for provider in PROVIDERS:
+        print(f"{provider}: {server.endpoint(provider)}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.statistics.summary()), file=sys.stderr)
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Time how long `qal` takes to import, and `qal-query -L` to run, in fresh interpreters.
+
+Providers are registered lazily, so importing `qal` (and listing the
+libraries) no longer imports the provider modules, nor `requests` and
+`backoff` with them.  The "eager" cases import every provider module
+(and, for `-L`, make every API object) first, as was done before, for
+comparison.  Times are for a whole interpreter run, of which the time
+of `python -c pass` is shown first.  Run from the repository with
+
+    PYTHONPATH=src python -m benchmarks.imports
+"""
+
+import os
+import sys
+import json
+import time
+import statistics
+import subprocess
+
+from argparse import ArgumentParser
+
+EAGER = "import qal, qal.springer, qal.science_direct, qal.ieeexplore; "
+
+LIST = "import sys; sys.argv = ['qal-query', '-L']; from qal.main import main; main()"
+
+CASES = [('python', "pass"),
+         ('import qal', "import qal"),
+         ('import qal (eager)', EAGER),
+         ('import qal.autoquery', "import qal.autoquery"),
+         ('qal-query -L', LIST),
+         ('qal-query -L (eager)', EAGER + "[qal.make_api(name, 'x') for name in qal.provider_names()]; " + LIST)]
+
+
+def time_run(code, repeat):
+    """Run CODE in a fresh interpreter REPEAT times, returning the times taken."""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True,
+                       stdout=subprocess.DEVNULL, env=dict(os.environ))
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark qal import and startup times.")
+    parser.add_argument('--repeat', type=int, default=20,
+                        help="number of runs of each case")
+    parser.add_argument('--output', metavar='FILE.json',
+                        help="also save the results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for (name, code) in CASES:
+        times = time_run(code, args.repeat)
+        results[name] = {'best': min(times), 'median': statistics.median(times)}
+        print(f"{name:<24} best {min(times) * 1e3:8.1f} ms, median {statistics.median(times) * 1e3:8.1f} ms")
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(results, fd, indent=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Compare the memory used by the publication classes with per-instance dictionaries.
+
+Builds a large synthetic corpus of articles and conference papers, with
+author names, venues and years repeated the way they are in real result
+sets, once with copies of the previous, dictionary-based classes and
+once with `qal.types`, and reports the memory allocated for each.
+"""
+
+import gc
+import random
+import tracemalloc
+
+from argparse import ArgumentParser
+
+from qal.types import Article, Conference
+
+
+class LegacyPublication:
+    def __init__(self, identifier, title, authors, year):
+        self.search_terms = {}
+        self.identifier = identifier
+        self.title = title
+        self.authors = authors
+        self.year = year
+
+
+class LegacyArticle(LegacyPublication):
+    def __init__(self, identifier, title, authors, year, journal, volume, issue, abstract=None, pages=None):
+        super().__init__(identifier, title, authors, year)
+        self.journal = journal
+        self.volume = volume
+        self.issue = issue
+        self.abstract = abstract
+        self.pages = pages
+
+
+class LegacyConference(LegacyPublication):
+    def __init__(self, identifier, title, authors, year, book_title, conference, abstract=None, pages=None):
+        super().__init__(identifier, title, authors, year)
+        self.book_title = book_title
+        self.conference = conference
+        self.abstract = abstract
+        self.pages = pages
+
+
+def fresh(string):
+    """A new copy of STRING, as decoding each provider response would give."""
+    return (string + '.')[:-1]
+
+
+def make_records(count, seed=0):
+    """Generate argument tuples for COUNT synthetic publications.
+
+    Every string is a new copy, made as it is generated, so that
+    memory for repeated values is counted unless it is shared.
+    """
+    rng = random.Random(seed)
+    authors = [f"Author {i} Surname{i % 977}" for i in range(max(10, count // 5))]
+    venues = [f"International Conference on Topic {i}" for i in range(max(10, count // 200))]
+    journals = [f"Journal of Topic {i}" for i in range(max(10, count // 500))]
+    for i in range(count):
+        record_authors = [fresh(rng.choice(authors)) for _ in range(rng.randint(1, 6))]
+        year = fresh(str(rng.randint(1990, 2024)))
+        title = f"A study of subject {i}"
+        if i % 2 == 0:
+            yield ('article', (f"10.1000/{i}", title, record_authors, year,
+                               fresh(rng.choice(journals)), fresh(str(rng.randint(1, 40))), None))
+        else:
+            venue = rng.choice(venues)
+            yield ('conference', (f"10.1000/{i}", title, record_authors, year,
+                                  fresh(f"Proceedings of the {venue}"), fresh(venue)))
+
+
+def measure(count, article, conference):
+    gc.collect()
+    tracemalloc.start()
+    corpus = {}
+    for (kind, arguments) in make_records(count):
+        if kind == 'article':
+            corpus[arguments[0]] = article(*arguments)
+        else:
+            corpus[arguments[0]] = conference(*arguments)
+    gc.collect()
+    (current, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark the memory used by publication objects.")
+    parser.add_argument('--records', type=int, default=200000,
+                        help="number of synthetic publications")
+    args = parser.parse_args()
+
+    legacy = measure(args.records, LegacyArticle, LegacyConference)
+    compact = measure(args.records, Article, Conference)
+    print(f"{args.records} records: legacy {legacy / 2**20:8.1f} MiB, "
+          f"slots {compact / 2**20:8.1f} MiB ({100 * (1 - compact / legacy):4.1f}% less)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Sample and synthetic provider responses.
+
+The JSON files in this directory are sample responses in the shape
+returned by each provider's API.  `synthetic_payload` builds responses
+of any size from them, varying identifiers, titles, years and venue
+names, so larger pages can be benchmarked (or served) without making
+requests.
+"""
+
+import copy
+import json
+import functools
+import random
+import os.path as osp
+
+from benchmarks.venues import make_corpus, IEEE_TEMPLATES, SPRINGER_TEMPLATES, TOPICS
+
+PROVIDERS = ['ieeexplore', 'springer', 'science_direct']
+
+WORDS = ["automated", "program", "repair", "learning", "neural", "fault", "localization", "testing",
+         "static", "analysis", "symbolic", "execution", "code", "review", "search", "based",
+         "empirical", "study", "large", "language", "models", "patch", "correctness", "mining"]
+
+
+def load_sample(provider):
+    """The sample response of PROVIDER (one of PROVIDERS)."""
+    with open(osp.join(osp.dirname(__file__), f"{provider}.json"), 'r') as fd:
+        return json.load(fd)
+
+
+def make_title(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(4, 12))]
+    return ' '.join(words).capitalize()
+
+
+def ieeexplore_record(rng, template, number, venue):
+    record = copy.deepcopy(template)
+    record['article_number'] = str(9000000 + number)
+    if 'doi' in record or rng.random() < 0.9:
+        record['doi'] = f"10.1109/SYN.{2000 + number % 25}.{number:08d}"
+    record['title'] = make_title(rng)
+    record['publication_year'] = rng.randint(1990, 2024)
+    record['authors'] = {'authors': [{'full_name': f"Author {rng.randint(1, 5000)}", 'author_order': i + 1}
+                                     for i in range(rng.randint(0, 6))]}
+    if record['content_type'] == 'Conferences':
+        record['publication_title'] = venue
+    return record
+
+
+def springer_record(rng, template, number, venue):
+    record = copy.deepcopy(template)
+    record['doi'] = f"10.1007/syn-{number:08d}"
+    record['identifier'] = f"doi:{record['doi']}"
+    record['title'] = make_title(rng)
+    record['publicationDate'] = f"{rng.randint(1990, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+    record['creators'] = [{'creator': f"Author, {rng.randint(1, 5000)}"} for _ in range(rng.randint(1, 6))]
+    if record['contentType'] == 'Chapter ConferencePaper':
+        record['publicationName'] = venue
+    return record
+
+
+def science_direct_record(rng, template, number, venue):
+    record = copy.deepcopy(template)
+    record['doi'] = f"10.1016/j.syn.{number:08d}"
+    record['title'] = make_title(rng)
+    record['publicationDate'] = f"{rng.randint(1990, 2024)}-01-01"
+    if record['authors'] is not None:
+        record['authors'] = [{'order': i + 1, 'name': f"Author {rng.randint(1, 5000)}"}
+                             for i in range(rng.randint(1, 6))]
+    record['sourceTitle'] = f"Journal of {rng.choice(TOPICS)}"
+    return record
+
+
+# Provider -> (records key, record builder, venue templates).
+SYNTHETIC = {'ieeexplore': ('articles', ieeexplore_record, IEEE_TEMPLATES),
+             'springer': ('records', springer_record, SPRINGER_TEMPLATES),
+             'science_direct': ('results', science_direct_record, IEEE_TEMPLATES)}
+
+
+@functools.lru_cache(maxsize=None)
+def venue_names(provider, seed):
+    """Venue names used in synthetic responses of PROVIDER."""
+    return make_corpus(SYNTHETIC[provider][2], 100, 500, seed=seed)
+
+
+def synthetic_payload(provider, size, start=1, total=None, seed=0, base=0):
+    """A response of PROVIDER holding SIZE records, starting at record START of TOTAL.
+
+    Records are numbered from BASE + START, which gives their identifiers.
+    """
+    (key, builder, _) = SYNTHETIC[provider]
+    sample = load_sample(provider)
+    venues = venue_names(provider, seed)
+    total = total if total is not None else start + size - 1
+    records = []
+    for number in range(base + start, base + start + size):
+        # Each record only depends on its number, whatever page it is on.
+        rng = random.Random(f"{seed}/{provider}/{number}")
+        records.append(builder(rng, sample[key][number % len(sample[key])], number,
+                               venues[rng.randrange(len(venues))]))
+    payload = copy.deepcopy(sample)
+    payload[key] = records
+    if provider == 'ieeexplore':
+        payload['total_records'] = total
+    elif provider == 'springer':
+        payload['result'] = [{'total': str(total), 'start': str(start),
+                              'pageLength': str(size), 'recordsDisplayed': str(size)}]
+    else:
+        payload['resultsFound'] = total
+    return payload
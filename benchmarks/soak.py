@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Run whole plans against fake providers, and check resuming after a kill.
+
+Starts a FakeProviders server (see benchmarks.fake_providers), writes a
+plan searching it through all three providers, and runs `qal-auto` on
+it twice: once uninterrupted, measuring throughput, page latency (as
+served) and peak RSS, and once killed (SIGKILL) KILLS times part way
+through and resumed until complete.  The two results stores must hold
+the same publications, found by the same queries.  For instance,
+
+    PYTHONPATH=src python -m benchmarks.soak --queries 20 --corpus 2000 --latency 0.01 --error-rate 0.01 --kills 3
+
+The report is printed as JSON; the exit status is 1 if the resumed run
+does not match.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import signal
+import shutil
+import resource
+import tempfile
+import subprocess
+import os.path as osp
+
+from argparse import ArgumentParser
+
+import qal
+from qal.results_store import open_results_store, STORE_FORMATS
+from qal.status import StatusLog
+
+from benchmarks.fake_providers import FakeProviders, PROVIDERS, add_fault_arguments, faults_from_arguments
+
+# Fake provider -> qal provider name.
+SITES = {'ieeexplore': 'ieee_xplore',
+         'springer': 'springer',
+         'science_direct': 'sciencedirect'}
+
+
+def make_plan(server, queries, page_size, concurrency):
+    return {'sites': [{'name': SITES[provider],
+                       'key': 'soak',
+                       'enabled': True,
+                       'endpoint': server.endpoint(provider),
+                       'page_size': page_size,
+                       'concurrency': concurrency,
+                       'rate_limit': {'per_second': 100000, 'per_day': 10 ** 12}}
+                      for provider in PROVIDERS],
+            'queries': [{'query_text': f"soak query {i}"} for i in range(queries)]}
+
+
+class Run:
+    """A qal-auto run of the plan in DIRECTORY."""
+
+    def __init__(self, directory, store_format, environment):
+        self.directory = directory
+        self.store_format = store_format
+        self.environment = environment
+        self.results = osp.join(directory, 'results')
+        self.status = osp.join(directory, 'status.json')
+
+    def command(self):
+        return [sys.executable, '-c', 'from qal.autoquery import main; main()',
+                '-p', osp.join(osp.dirname(self.directory), 'plan.json'),
+                '-s', self.status,
+                '-o', self.results,
+                '--store-format', self.store_format]
+
+    def start(self):
+        return subprocess.Popen(self.command(), env=self.environment, cwd=self.directory,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def complete(self):
+        if not osp.exists(self.status):
+            return False
+        log = StatusLog(self.status)
+        status = log.load()
+        log.close()
+        return status.get('incomplete', -1) == 0
+
+    def contents(self):
+        """Identifier -> (source, query) pairs of the publications found."""
+        store = open_results_store(self.results, saviness=0, store_format=self.store_format)
+        contents = {}
+        for identifier in store:
+            item = store.get(identifier)
+            contents[identifier] = json.dumps(item.search_terms_by_source(), sort_keys=True)
+        store.close()
+        return contents
+
+
+def peak_rss():
+    """Peak resident set size of waited-for children, in MiB."""
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxrss / (1024 * 1024)
+    return maxrss / 1024
+
+
+def reference_run(run, server):
+    server.statistics.reset()
+    began = time.perf_counter()
+    process = run.start()
+    returncode = process.wait()
+    elapsed = time.perf_counter() - began
+    statistics = server.statistics.summary()
+    return {'returncode': returncode,
+            'complete': run.complete(),
+            'seconds': elapsed,
+            'pages_per_second': statistics['requests'] / elapsed,
+            'records_per_second': statistics['records'] / elapsed,
+            'peak_rss_mib': peak_rss(),
+            'server': statistics}
+
+
+def killed_run(run, server, kills, kill_after, max_runs, rng):
+    server.statistics.reset()
+    done_kills = 0
+    runs = 0
+    while runs < max_runs:
+        runs += 1
+        process = run.start()
+        if done_kills < kills:
+            try:
+                process.wait(timeout=rng.uniform(*kill_after))
+            except subprocess.TimeoutExpired:
+                process.send_signal(signal.SIGKILL)
+                process.wait()
+                done_kills += 1
+                continue
+        else:
+            process.wait()
+        if process.returncode == 0 and run.complete():
+            break
+    return {'kills': done_kills,
+            'runs': runs,
+            'complete': run.complete(),
+            'server': server.statistics.summary()}
+
+
+def compare(reference, resumed):
+    missing = sorted(set(reference) - set(resumed))
+    extra = sorted(set(resumed) - set(reference))
+    different = sorted(identifier for identifier in set(reference) & set(resumed)
+                       if reference[identifier] != resumed[identifier])
+    return {'publications': len(reference),
+            'identical': not (missing or extra or different),
+            'missing': missing[:10],
+            'extra': extra[:10],
+            'different': different[:10],
+            'counts': [len(missing), len(extra), len(different)]}
+
+
+def main():
+    parser = ArgumentParser(description="Soak test qal-auto against fake providers.")
+    parser.add_argument('--queries', type=int, default=10)
+    parser.add_argument('--page-size', type=int, default=25)
+    parser.add_argument('--concurrency', type=int, default=2,
+                        help="queries run at once per provider")
+    parser.add_argument('--store-format', choices=STORE_FORMATS.keys(), default='journal')
+    parser.add_argument('--kills', type=int, default=3,
+                        help="number of times the second run is killed")
+    parser.add_argument('--kill-after', type=float, nargs=2, default=[0.5, 3.0], metavar=('MIN', 'MAX'),
+                        help="kill the second run after between MIN and MAX seconds")
+    parser.add_argument('--max-runs', type=int, default=50,
+                        help="give up resuming after this many runs")
+    parser.add_argument('--keep', metavar='DIRECTORY',
+                        help="work in (and keep) DIRECTORY")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    server = FakeProviders(corpus=args.corpus, faults=faults_from_arguments(args), seed=args.seed,
+                           page_cap=args.page_cap).start()
+    directory = args.keep or tempfile.mkdtemp(prefix='qal-soak-')
+    os.makedirs(directory, exist_ok=True)
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join([osp.dirname(osp.dirname(qal.__file__)),
+                                                 environment.get('PYTHONPATH', '')])
+    environment['QAL_RATE_LIMIT_DIR'] = osp.join(directory, 'rate-limits')
+
+    try:
+        with open(osp.join(directory, 'plan.json'), 'w') as fd:
+            json.dump(make_plan(server, args.queries, args.page_size, args.concurrency), fd, indent=2)
+        runs = {}
+        for name in ['reference', 'resumed']:
+            os.makedirs(osp.join(directory, name), exist_ok=True)
+            runs[name] = Run(osp.join(directory, name), args.store_format, environment)
+
+        report = {'reference': reference_run(runs['reference'], server),
+                  'resumed': killed_run(runs['resumed'], server, args.kills, args.kill_after, args.max_runs, rng)}
+        report['resume'] = compare(runs['reference'].contents(), runs['resumed'].contents())
+    finally:
+        server.stop()
+        if args.keep is None:
+            shutil.rmtree(directory)
+
+    print(json.dumps(report, indent=2))
+    ok = (report['reference']['complete'] and report['resumed']['complete'] and report['resume']['identical'])
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Micro-benchmarks of the hot paths of `qal`.
+
+Times provider response parsing (`process_results`, on the sample and
+on synthetic pages), venue name sanitizing, adding items to and saving
+results stores of 1k, 10k and 100k publications, and writing status
+files.  Results are printed, and can be written as JSON (`--output`)
+and compared against a saved run (`--compare`), e.g.,
+
+    PYTHONPATH=src python -m benchmarks.suite --output baseline.json
+    PYTHONPATH=src python -m benchmarks.suite --compare baseline.json
+
+When comparing, the exit status is 1 if any benchmark is slower than
+its baseline by more than `--threshold`.
+"""
+
+import os.path as osp
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import platform
+import tempfile
+
+from argparse import ArgumentParser
+
+from qal import autoquery
+from qal.types import Article, Conference
+from qal.status import StatusLog
+from qal.results_store import open_results_store, STORE_FORMATS
+from qal.ieeexplore import IEEEXplore, sanitize_venue as ieee_sanitize_venue
+from qal.springer import SpringerNature, sanitize_venue as springer_sanitize_venue
+from qal.science_direct import ScienceDirect
+from qal.venues import IEEE_VENUES, SPRINGER_VENUES
+
+from benchmarks.venues import make_corpus, IEEE_TEMPLATES, SPRINGER_TEMPLATES
+from benchmarks.payloads import load_sample, synthetic_payload
+
+PROVIDERS = {'ieeexplore': IEEEXplore,
+             'springer': SpringerNature,
+             'science_direct': ScienceDirect}
+
+RECORDS_KEYS = {'ieeexplore': 'articles',
+                'springer': 'records',
+                'science_direct': 'results'}
+
+STORE_SIZES = [1000, 10000, 100000]
+
+
+class Benchmark:
+    """A benchmark NAME, timing RUN (called with what SETUP returns) over ITEMS items."""
+
+    def __init__(self, name, run, setup=None, items=1, teardown=None):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.items = items
+        self.teardown = teardown
+
+    def measure(self, repeat):
+        times = []
+        for _ in range(repeat):
+            state = self.setup() if self.setup is not None else None
+            began = time.perf_counter()
+            self.run(state)
+            times.append(time.perf_counter() - began)
+            if self.teardown is not None:
+                self.teardown(state)
+        return {'best': min(times),
+                'mean': sum(times) / len(times),
+                'per_item': min(times) / self.items,
+                'items': self.items,
+                'repeat': repeat}
+
+
+def process_results_benchmarks(page_size, calls=100):
+    benchmarks = []
+    for (provider, cls) in PROVIDERS.items():
+        for (kind, payload) in [('sample', load_sample(provider)),
+                                (f"page{page_size}", synthetic_payload(provider, page_size, total=10 * page_size))]:
+            def run(api, payload=payload):
+                for _ in range(calls):
+                    api.process_results(payload)
+            benchmarks.append(Benchmark(f"process_results.{provider}.{kind}", run,
+                                        setup=lambda cls=cls: cls('benchmark'),
+                                        items=calls * len(payload[RECORDS_KEYS[provider]])))
+    return benchmarks
+
+
+def sanitize_venue_benchmarks(venues, papers):
+    benchmarks = []
+    for (name, function, normalizer, templates) in [('ieee', ieee_sanitize_venue, IEEE_VENUES, IEEE_TEMPLATES),
+                                                    ('springer', springer_sanitize_venue, SPRINGER_VENUES, SPRINGER_TEMPLATES)]:
+        corpus = make_corpus(templates, venues, papers)
+
+        def run(_, function=function, corpus=corpus):
+            for string in corpus:
+                function(string)
+
+        def run_uncached(_, normalizer=normalizer, corpus=corpus):
+            for string in corpus:
+                normalizer.normalize_uncached(string)
+
+        benchmarks.append(Benchmark(f"sanitize_venue.{name}", run,
+                                    setup=lambda normalizer=normalizer: normalizer.normalize.cache_clear(),
+                                    items=len(corpus)))
+        benchmarks.append(Benchmark(f"sanitize_venue.{name}.uncached", run_uncached, items=len(corpus)))
+    return benchmarks
+
+
+def make_publications(count, seed=0):
+    rng = random.Random(seed)
+    venues = make_corpus(IEEE_TEMPLATES, max(1, count // 50), count, seed=seed)
+    publications = []
+    for i in range(count):
+        title = f"Publication {i} on {rng.choice(venues)}"
+        authors = [f"Author {rng.randint(1, count)}" for _ in range(rng.randint(1, 6))]
+        if rng.random() < 0.5:
+            publications.append(Article(f"10.0000/{i}", title, authors, rng.randint(1990, 2024),
+                                        journal=f"Journal {rng.randint(1, 200)}",
+                                        volume=str(rng.randint(1, 40)), issue=None))
+        else:
+            publications.append(Conference(f"10.0001/{i}", title, authors, rng.randint(1990, 2024),
+                                           book_title=venues[i], conference=IEEE_VENUES(venues[i])))
+    return publications
+
+
+def store_benchmarks(sizes, store_formats):
+    benchmarks = []
+    queries = [{'query_text': f"query {i}"} for i in range(10)]
+    for size in sizes:
+        publications = make_publications(size)
+        label = f"{size // 1000}k"
+        for store_format in store_formats:
+            def setup(store_format=store_format):
+                directory = tempfile.mkdtemp(prefix='qal-bench-')
+                return (directory, open_results_store(osp.join(directory, 'results'), saviness=0,
+                                                      store_format=store_format))
+
+            def teardown(state):
+                (directory, store) = state
+                store.close()
+                shutil.rmtree(directory)
+
+            def add(state, publications=publications):
+                (_, store) = state
+                for (i, publication) in enumerate(publications):
+                    store.add_item(publication, 'benchmark', queries[i % len(queries)])
+
+            def filled(store_format=store_format, publications=publications):
+                state = setup(store_format)
+                add(state, publications)
+                return state
+
+            def save(state):
+                state[1].save()
+
+            benchmarks.append(Benchmark(f"store.{store_format}.add_item.{label}", add,
+                                        setup=setup, teardown=teardown, items=size))
+            benchmarks.append(Benchmark(f"store.{store_format}.save.{label}", save,
+                                        setup=filled, teardown=teardown, items=size))
+    return benchmarks
+
+
+def make_status(sites, queries):
+    entry = {'total': 5000, 'start': 251, 'page_size': 25, 'failed_pages': []}
+    return {'statuses': [[dict(entry) for _ in range(queries)] for _ in range(sites)],
+            'has_results': [[True] * queries for _ in range(sites)],
+            'batches': [[10] * queries for _ in range(sites)],
+            'incomplete': sites * queries,
+            'max_batches': 10}
+
+
+def status_benchmarks(sites, queries, records):
+    status = make_status(sites, queries)
+
+    def setup():
+        directory = tempfile.mkdtemp(prefix='qal-bench-')
+        autoquery.STATUS_FILE = osp.join(directory, 'status.json')
+        autoquery.STATUS_LOG = StatusLog(autoquery.STATUS_FILE, snapshot_every=records + 1)
+        return directory
+
+    def teardown(directory):
+        autoquery.STATUS_LOG.close()
+        shutil.rmtree(directory)
+
+    def write(_):
+        for _ in range(records):
+            autoquery.write_status(status)
+
+    def record(_):
+        for i in range(records):
+            autoquery.record_status(status, i % sites, i % queries)
+
+    return [Benchmark(f"write_status.{sites}x{queries}", write, setup=setup, teardown=teardown, items=records),
+            Benchmark(f"record_status.{sites}x{queries}", record, setup=setup, teardown=teardown, items=records)]
+
+
+def compare(results, baseline, threshold):
+    """Print RESULTS against BASELINE, returning the names of benchmarks slower by more than THRESHOLD.
+
+    Benchmarks are compared on their best time per item.
+    """
+    regressions = []
+    print(f"{'benchmark (us/item)':<48} {'baseline':>12} {'current':>12} {'change':>8}")
+    for (name, result) in results.items():
+        if name not in baseline:
+            print(f"{name:<48} {'-':>12} {result['per_item'] * 1e6:>12.3f} {'new':>8}")
+            continue
+        before = baseline[name]['per_item']
+        change = (result['per_item'] - before) / before if before > 0 else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = ' slower'
+        print(f"{name:<48} {before * 1e6:>12.3f} {result['per_item'] * 1e6:>12.3f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark parsing, sanitizing and storing results.")
+    parser.add_argument('--only', metavar='PREFIX', action='append',
+                        help="only run benchmarks whose names start with PREFIX (may be repeated)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--page-size', type=int, default=200,
+                        help="number of records in synthetic pages")
+    parser.add_argument('--sizes', type=int, nargs='+', default=STORE_SIZES,
+                        help="numbers of publications in benchmarked stores")
+    parser.add_argument('--store-formats', nargs='+', default=['json'], choices=STORE_FORMATS.keys(),
+                        help="results store formats benchmarked")
+    parser.add_argument('--output', '-o', metavar='RESULTS.JSON',
+                        help="write results to RESULTS.JSON")
+    parser.add_argument('--compare', metavar='BASELINE.JSON',
+                        help="compare with the results in BASELINE.JSON")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="slowdown (as a fraction) reported as a regression")
+    args = parser.parse_args()
+
+    logging.getLogger('qal').setLevel(logging.ERROR)
+
+    benchmarks = (process_results_benchmarks(args.page_size)
+                  + sanitize_venue_benchmarks(2000, 50000)
+                  + store_benchmarks(args.sizes, args.store_formats)
+                  + status_benchmarks(4, 25, 200))
+    if args.only:
+        benchmarks = [benchmark for benchmark in benchmarks
+                      if any(benchmark.name.startswith(prefix) for prefix in args.only)]
+
+    results = {}
+    for benchmark in benchmarks:
+        results[benchmark.name] = benchmark.measure(args.repeat)
+        print(f"{benchmark.name:<48} {results[benchmark.name]['best']:>12.6f} s "
+              f"({results[benchmark.name]['per_item'] * 1e6:.2f} us/item)", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump({'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'time': time.time(),
+                       'results': results}, fd, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as fd:
+            baseline = json.load(fd)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) slower than the baseline.", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Compare venue normalization with the per-rule `re.sub` functions it replaced.
+
+Checks that both give the same results on a synthetic corpus of venue
+names, then times the old functions, the compiled passes without
+memoization, and the memoized normalizers.
+"""
+
+import re
+import random
+import timeit
+
+from argparse import ArgumentParser
+
+from qal.venues import IEEE_VENUES, SPRINGER_VENUES
+
+ORDINALS = r"(first|second|third|fourth|fifth|sixth|seventh|eighth|ninth|tenth|eleventh|twelfth|thirteenth|fourteenth|fifteenth|sixteenth|seventeeth|eighteenth|ninteenth|twentieth|twenty|thirtieth|thirty|fourthieth|fourty|fiftieth|fifty|sixtieth|sixty)-?"
+
+
+def legacy_ieee_sanitize_venue(string):
+    string = re.sub(r"[0-9]{4}", "", string)
+    string = re.sub(r"[0-9]{1,2}(nd|th|rd|st)", "", string)
+    string = re.sub(r"Proceedings?\.?( of)?( the)?", "", string)
+    string = re.sub(r"\bs ", "", string)
+    string = re.sub(r"[\[\]]", "", string)
+    string = re.sub(ORDINALS, "", string, flags=re.IGNORECASE)
+    string = re.sub(r"\(.*\)$", "", string)
+    string = re.sub(r"^Annual", "", string)
+    string = re.sub(r"(ACM/IEEE|IEEE/ACM|IEEE|ACM)", "", string)
+    string = re.sub(r"^The ", "", string, flags=re.IGNORECASE)
+    string = re.sub(r"\s+", " ", string).strip()
+    string = string.strip()
+    return string
+
+
+def legacy_springer_sanitize_venue(string):
+    string = re.sub(r'proceedings of the', '', string, flags=re.IGNORECASE)
+    string = re.sub(r"[0-9]{1,2}(nd|th|rd|st)", "", string)
+    string = re.sub(ORDINALS, "", string, flags=re.IGNORECASE)
+    string = re.sub(r'—', '', string)
+    string = re.sub(r'–', '', string)
+    string = re.sub(r'\'\d{2}', '', string)
+    string = re.sub(r'’[0-9]+', '', string)
+    string = re.sub(r'[0-9]{4}', '', string)
+    string = re.sub(r'Part (v|iv|iii|ii|i)', '', string, flags=re.IGNORECASE)
+    string = re.sub(r'proceedings of', '', string, flags=re.IGNORECASE)
+    string = re.sub(r'volume \d+', '', string, flags=re.IGNORECASE)
+    string = re.sub(r'\s[,:]\s', '', string)
+    # The original replacement, '\)', left a stray backslash in the output.
+    string = re.sub(r'\s+\)', ')', string)
+    string = re.sub(r' - ', ' ', string)
+    string = re.sub(r'\s+', ' ', string).strip()
+    return string
+
+
+IEEE_TEMPLATES = ["{year} IEEE/ACM {nth} International Conference on {topic} ({acronym})",
+                  "Proceedings of the {year} {nth} Annual Conference on {topic}",
+                  "{year} {Ordinal} International Symposium on {topic} [{acronym}]",
+                  "Proceedings. {year} IEEE International Workshop on {topic}",
+                  "The {Ordinal}-{ordinal} Annual ACM Symposium on {topic}"]
+
+SPRINGER_TEMPLATES = ["Proceedings of the {nth} International Conference on {topic}",
+                      "{topic} – {acronym} {year}, Part {part}",
+                      "{acronym}’21 : {topic}, Volume {volume}",
+                      "{Ordinal} Workshop on {topic} - {acronym} '{yy}",
+                      "Advances in {topic} (Proceedings of {acronym} {year} )",
+                      "{acronym} {city}, {month} {day}–{last_day}, {year}",
+                      "{topic} ({acronym} {year}—{yy})"]
+
+CITIES = ["Madrid, Spain", "Lincoln, NE, USA", "Kyoto, Japan", "Lisbon, Portugal"]
+
+MONTHS = ["January", "May", "July", "October"]
+
+TOPICS = ["Software Engineering", "Machine Learning", "Computer Vision", "Data Mining",
+          "Programming Languages", "Distributed Systems", "Robotics and Automation",
+          "Information Retrieval", "Human Factors in Computing Systems", "Networks"]
+
+ORDINAL_WORDS = ["First", "Second", "Third", "Fourth", "Twenty", "Thirty"]
+
+
+def make_corpus(templates, venues, papers, seed=0):
+    """A list of PAPERS venue names, drawn from VENUES distinct names (venue names repeat a lot)."""
+    rng = random.Random(seed)
+    names = []
+    for _ in range(venues):
+        names.append(rng.choice(templates).format(year=rng.randint(1990, 2024),
+                                                  yy=rng.randint(10, 99),
+                                                  nth=f"{rng.randint(1, 60)}{rng.choice(['st', 'nd', 'rd', 'th'])}",
+                                                  Ordinal=rng.choice(ORDINAL_WORDS),
+                                                  ordinal=rng.choice(ORDINAL_WORDS).lower(),
+                                                  topic=rng.choice(TOPICS),
+                                                  acronym=''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(4)),
+                                                  part=rng.choice(['I', 'II', 'III', 'IV', 'V']),
+                                                  volume=rng.randint(1, 20),
+                                                  city=rng.choice(CITIES),
+                                                  month=rng.choice(MONTHS),
+                                                  day=rng.randint(1, 14),
+                                                  last_day=rng.randint(15, 31)))
+    return [rng.choice(names) for _ in range(papers)]
+
+
+def time_per_call(function, corpus, repeat):
+    def run():
+        for string in corpus:
+            function(string)
+    return min(timeit.repeat(run, number=1, repeat=repeat)) / len(corpus)
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark venue normalization.")
+    parser.add_argument('--venues', type=int, default=2000,
+                        help="number of distinct venue names")
+    parser.add_argument('--papers', type=int, default=50000,
+                        help="number of (repeated) venue names normalized")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for (name, legacy, normalizer, templates) in [('ieee', legacy_ieee_sanitize_venue, IEEE_VENUES, IEEE_TEMPLATES),
+                                                  ('springer', legacy_springer_sanitize_venue, SPRINGER_VENUES, SPRINGER_TEMPLATES)]:
+        corpus = make_corpus(templates, args.venues, args.papers)
+        mismatches = [string for string in set(corpus) if legacy(string) != normalizer.normalize_uncached(string)]
+        if mismatches:
+            print(f"{name}: {len(mismatches)} names normalized differently, e.g., {mismatches[0]!r}")
+        legacy_time = time_per_call(legacy, corpus, args.repeat)
+        compiled_time = time_per_call(normalizer.normalize_uncached, corpus, args.repeat)
+        normalizer.normalize.cache_clear()
+        memoized_time = time_per_call(normalizer.normalize, corpus, args.repeat)
+        print(f"{name}: legacy {legacy_time * 1e6:8.2f} us/call, "
+              f"compiled {compiled_time * 1e6:8.2f} us/call ({legacy_time / compiled_time:5.1f}x), "
+              f"memoized {memoized_time * 1e6:8.2f} us/call ({legacy_time / memoized_time:5.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -42,7 +42,9 @@ setup(name="qal-swflint",
       packages=find_packages(where="src"),
       package_dir={"": "src"},
       scripts=['bin/qal-query',
-               'bin/qal-auto'],
+               'bin/qal-auto',
+               'bin/qal-queue',
+               'bin/qal-probe'],
       install_requires=[
           "requests",
           "backoff",
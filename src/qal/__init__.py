@@ -25,9 +25,7 @@
 
 import logging
 import os
-from .springer import SpringerNature
-from .science_direct import ScienceDirect
-from .ieeexplore import IEEEXplore
+from importlib import import_module
 __version__ = "1.0.0"
 
 apis = {}
@@ -36,14 +34,109 @@ env_var_names = {}
 
 LOGGER = logging.getLogger('qal')
 
-def register_api(names, env_var, api):
+# Third-party providers are registered through entry points in this group.
+ENTRY_POINT_GROUP = 'qal.providers'
+
+_discovered = False
+
+
+class Provider:
+    """A registered provider, whose module is only imported when it is used.
+
+    API is either the provider class, or its import path, as
+    "module:Class".  Calling a Provider makes an API object, as calling
+    the class would.
+    """
+
+    def __init__(self, names, env_var, api, description=None):
+        self.names = names
+        self.env_var = env_var
+        self.description = description
+        if isinstance(api, str):
+            self.path = api
+            self.api = None
+        else:
+            self.path = f"{api.__module__}:{api.__qualname__}"
+            self.api = api
+
+    def load(self):
+        """The provider class, importing its module if needed."""
+        if self.api is None:
+            LOGGER.debug("Importing provider %s.", self.path)
+            (module, name) = self.path.split(':')
+            self.api = getattr(import_module(module), name)
+        return self.api
+
+    def describe(self):
+        if self.description is None:
+            self.description = self.load()(api_key=None).describe()
+        return self.description
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+    def __repr__(self):
+        return f"<Provider {self.names[0]} ({self.path})>"
+
+
+def register_api(names, env_var, api, description=None):
+    """Register the provider API (a class, or its "module:Class" import path) under NAMES.
+
+    ENV_VAR names the environment variable holding its API key, and
+    DESCRIPTION describes it without importing it.
+    """
     global apis
     global env_var_names
-    LOGGER.info("Registering API: %s", api)
+    provider = Provider(names, env_var, api, description)
+    LOGGER.info("Registering API: %s", provider)
     for name in names:
-        apis[name] = api
+        apis[name] = provider
         env_var_names[name] = env_var
 
+
+def entry_points(group):
+    try:
+        from importlib.metadata import entry_points as all_entry_points
+    except ImportError:
+        return []
+    points = all_entry_points()
+    if hasattr(points, 'select'):
+        return points.select(group=group)
+    return points.get(group, [])
+
+
+def discover_providers():
+    """Register the providers of installed packages' qal.providers entry points, once.
+
+    An entry point's name is the provider's name, and its value the
+    provider class; its API key is read from NAME_API_KEY.  Providers
+    already registered under the name are kept.
+    """
+    global _discovered
+    if _discovered:
+        return
+    _discovered = True
+    for point in entry_points(ENTRY_POINT_GROUP):
+        if point.name in apis:
+            continue
+        register_api([point.name],
+                     f"{point.name.upper().replace('-', '_')}_API_KEY",
+                     point.value)
+
+
+def get_provider(name):
+    """The Provider registered as NAME, or None."""
+    if name not in apis:
+        discover_providers()
+    return apis.get(name)
+
+
+def provider_names():
+    """The names of every provider, including those of entry points."""
+    discover_providers()
+    return list(apis.keys())
+
+
 def get_env_var(name, key_maybe):
     global env_var_names
     if key_maybe:
@@ -60,13 +153,10 @@ def get_env_var_name(name):
 
 
 def make_api(name, api_key):
-    global apis
-    global env_var_names
-    try:
-        api = apis[name]
-        return api(api_key=api_key)
-    except KeyError:
+    provider = get_provider(name)
+    if provider is None:
         return None
+    return provider(api_key=api_key)
 
 
 register_api(['springer',
@@ -75,7 +165,8 @@ register_api(['springer',
               'springer_nature',
               'springer-nature'],
              'SPRINGER_LINK_API_KEY',
-             SpringerNature)
+             'qal.springer:SpringerNature',
+             description='Springer Link')
 
 register_api(['ieee',
               'ieeexplore',
@@ -83,10 +174,12 @@ register_api(['ieee',
               'ieee-xplore',
               'xplore'],
              'IEEE_XPLORE_API_KEY',
-             IEEEXplore)
+             'qal.ieeexplore:IEEEXplore',
+             description='IEEEXplore Library')
 
 register_api(['science-direct',
               'sciencedirect',
               'elsevier'],
              'SCIENCE_DIRECT_API_KEY',
-             ScienceDirect)
+             'qal.science_direct:ScienceDirect',
+             description='Elsevier Science Direct')
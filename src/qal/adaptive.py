@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import threading
+
+LOGGER = logging.getLogger('qal.adaptive')
+
+DEFAULT_TARGET_LATENCY = 5.0
+
+
+class PageSizeController:
+    """Adjust page sizes during a run, increasing additively and decreasing multiplicatively.
+
+    Pages grow by STEP (default a tenth of MAXIMUM) after every full
+    page answered within TARGET_LATENCY seconds, and shrink by the
+    factor DECREASE after a slow page or a failed request (so later
+    retries ask for less), never leaving [MINIMUM, MAXIMUM].  A provider
+    returning fewer records than asked for, before the end of the
+    results, is taken to cap pages at that size.
+
+    One controller may be shared by the API objects of every query of
+    a provider.
+    """
+
+    def __init__(self, maximum, minimum=1, target_latency=DEFAULT_TARGET_LATENCY, step=None, decrease=0.5):
+        self.maximum = maximum
+        self.minimum = min(minimum, maximum)
+        self.target_latency = target_latency
+        self.step = step if step is not None else max(1, maximum // 10)
+        self.decrease = decrease
+        self.page_size = None
+        self.lock = threading.Lock()
+
+    def clamp(self, page_size):
+        return max(self.minimum, min(self.maximum, page_size))
+
+    def current(self, page_size):
+        """The page size to use, starting from PAGE_SIZE if none was chosen yet."""
+        with self.lock:
+            if self.page_size is None:
+                self.page_size = self.clamp(page_size)
+            return self.page_size
+
+    def shrink(self, reason):
+        with self.lock:
+            if self.page_size is None:
+                return
+            page_size = self.clamp(int(self.page_size * self.decrease))
+            if page_size != self.page_size:
+                LOGGER.info("Shrinking pages from %d to %d (%s).", self.page_size, page_size, reason)
+            self.page_size = page_size
+
+    def observe(self, latency, requested, returned, complete):
+        """Adjust the page size after a page of REQUESTED records took LATENCY seconds and gave RETURNED.
+
+        LATENCY may be None when unknown (for cached pages); COMPLETE is
+        whether the page was the last one.
+        """
+        if latency is not None and latency > self.target_latency:
+            self.shrink(f"{latency:.1f} s page")
+            return
+        with self.lock:
+            if self.page_size is None:
+                return
+            if returned < requested and not complete and returned > 0:
+                if returned < self.maximum:
+                    LOGGER.info("Pages appear to be capped at %d records.", returned)
+                    self.maximum = max(self.minimum, returned)
+                    self.page_size = self.clamp(self.page_size)
+            elif returned >= requested and latency is not None and requested >= self.page_size:
+                self.page_size = self.clamp(self.page_size + self.step)
+
+    def failure(self):
+        """Adjust the page size after a failed request."""
+        self.shrink("failed request")
+
+
+def make_controller(api, options):
+    """A PageSizeController for API, configured by OPTIONS (True, or a dictionary of options)."""
+    if not isinstance(options, dict):
+        options = {}
+    maximum = options.get('max', api.max_page_size or api.page_size)
+    return PageSizeController(maximum,
+                              minimum=options.get('min', 1),
+                              target_latency=options.get('target_latency', DEFAULT_TARGET_LATENCY))
@@ -33,50 +33,127 @@ from argparse import ArgumentParser
 
 from . import *
 from .exceptions import *
-from .results_store import ResultsStore
-
-from tqdm import trange, tqdm
+from .results_store import open_results_store, STORE_FORMATS
+from .executor import ResultsWriter, ProviderLane, run_lanes
+from .status import StatusLog, seed_status
+from .digital_library import shutdown_prefetch
+from .venues import load_venue_table
+from .cache import add_cache_arguments, cache_from_arguments
+from .dedup import add_dedup_arguments, dedup_from_arguments
+from .adaptive import make_controller
+from .scheduler import SCHEDULERS, scheduler_from_plan
+from .plan import CompiledPlan, make_api_object
+from .probe import add_probe_arguments, probe_plan, fill_status, estimate, format_estimate
+from .shards import (shard_name, pending_pairs, split_pairs, write_shard_status,
+                     merge_shards, remove_shards, run_workers)
+from .metrics import METRICS, add_metrics_arguments, exporter_from_arguments, print_summary
+from .profiling import phase, in_phase, add_profile_arguments, profiler_from_arguments
+
+from tqdm import tqdm
 
 import json
 import jsonpickle
 
 VERBOSE = 0
 STATUS_FILE = ''
+STATUS_LOG = None
 
 LOGGER = logging.getLogger('qal.autoquery')
 
-def make_api_object(site):
-    name = site['name']
-    api = make_api(name, get_env_var(site['name'], site.get('key')))
-    if 'start' in site.keys():
-        api.start = site['start']
-    if 'page_size' in site.keys():
-        api.page_size = site['page_size']
-    if 'options' in site.keys():
-        api.set_options(site['options'])
-    return api
-
-
+@in_phase('status')
 def write_status(status):
     LOGGER.info("Saving status file %s.", STATUS_FILE)
-    if osp.exists(STATUS_FILE):
-        LOGGER.debug("Retaining backup copy of status file")
-        os.replace(STATUS_FILE, f"{STATUS_FILE}.bak")
-    with open(STATUS_FILE, 'w') as fd:
-        json.dump(status, fd, indent=True)
+    with METRICS.timer('qal_status_write_seconds', kind='snapshot'):
+        STATUS_LOG.snapshot(status)
     LOGGER.debug("Saved status file.")
 
 
-def restore_query_status(status, api, site_id, query_id):
+@in_phase('status')
+def record_status(status, site_id, query_id):
+    LOGGER.debug("Recording status of site %d, query %d.", site_id, query_id)
+    with METRICS.timer('qal_status_write_seconds', kind='record'):
+        STATUS_LOG.record(status, site_id, query_id)
+
+
+def restore_query_status(status, api, site_id, query_id, retry_abandoned=False):
     status_item = status['statuses'][site_id][query_id]
     if len(status_item.keys()) != 0:
         api.start = status_item['start']
         api.page_size = status_item['page_size']
         api.results_total = status_item['total']
+        # Older status files kept only the offsets of failed pages.
+        api.failed_pages = [page if isinstance(page, list) else [page, page + api.page_size]
+                            for page in status_item.get('failed_pages', [])]
+        api.abandoned_pages = status_item.get('abandoned_pages', [])
+        api.page_attempts = {int(offset): attempts
+                             for (offset, attempts) in status_item.get('page_attempts', {}).items()}
+        if retry_abandoned and api.abandoned_pages:
+            LOGGER.info("Retrying %d abandoned pages.", len(api.abandoned_pages))
+            api.retry_abandoned()
 
 
 def max_runs(batches):
-    max(map(max, batches))
+    return max(map(max, batches))
+
+
+def worker_arguments(args, index):
+    """The command line of the worker process running shard INDEX."""
+    arguments = ['--plan-file', args.plan_file,
+                 '--status-file', shard_name(args.status_file, index),
+                 '--output-file', shard_name(args.out_file, index),
+                 '--store-format', 'journal',
+                 '--number-batches', str(args.batches),
+                 '--snapshot-every', str(args.snapshot_every)]
+    arguments += ['--verbose'] * args.verbose
+    if args.retry_abandoned:
+        arguments.append('--retry-abandoned')
+    if args.scheduler is not None:
+        arguments += ['--scheduler', args.scheduler]
+    if args.cache is not None:
+        arguments += ['--cache', args.cache,
+                      '--cache-ttl', str(args.cache_ttl),
+                      '--cache-size', str(args.cache_size)]
+        if args.offline:
+            arguments.append('--offline')
+    if args.metrics is not None:
+        arguments += ['--metrics', shard_name(args.metrics, index),
+                      '--metrics-format', args.metrics_format,
+                      '--metrics-interval', str(args.metrics_interval)]
+    if args.profile is not None:
+        arguments += ['--profile', osp.join(args.profile, f"shard-{index}"),
+                      '--profile-mode', args.profile_mode,
+                      '--profile-interval', str(args.profile_interval)]
+    return arguments
+
+
+def run_shards(args, compiled, status, results):
+    """Run the pairs left in ARGS.WORKERS worker processes, merging their shards into RESULTS and STATUS.
+
+    Shards left by an interrupted run (with any number of workers) are
+    merged first, so the pairs left are split afresh.
+    """
+    merged = merge_shards(status, results, args.status_file, args.out_file)
+    write_status(status)
+    remove_shards(merged)
+    shards = split_pairs(pending_pairs(compiled, status), args.workers)
+    for (index, pairs) in enumerate(shards):
+        # A shard owns the pairs merged into the ones it runs, too.
+        write_shard_status(status, args.status_file, index,
+                           [(site_id, member) for (site_id, query_id) in pairs
+                            for member in compiled.members(site_id, query_id)])
+    LOGGER.info("Running %d pairs in %d workers.", sum(map(len, shards)), len(shards))
+    succeeded = False
+    try:
+        succeeded = run_workers([worker_arguments(args, index) for index in range(len(shards))])
+    finally:
+        merged = merge_shards(status, results, args.status_file, args.out_file)
+        if status['incomplete'] == 0 and hasattr(results, 'compact'):
+            results.compact()
+        results.close()
+        write_status(status)
+        remove_shards(merged)
+        STATUS_LOG.close()
+    return succeeded
 
 
 def main():
@@ -109,107 +186,225 @@ def main():
                         dest='batches',
                         default=-1)
 
+    parser.add_argument('--workers', metavar="N",
+                        help="split the pairs between N worker processes (by default, run them in this process)",
+                        type=int,
+                        dest='workers',
+                        default=0)
+
+    parser.add_argument('--probe',
+                        help="find the number of results of every pair not started yet, before running them",
+                        action='store_true',
+                        dest='probe')
+
+    parser.add_argument('--retry-abandoned',
+                        help="retry the pages given up on by earlier runs",
+                        action='store_true',
+                        dest='retry_abandoned')
+
+    add_probe_arguments(parser)
+    add_cache_arguments(parser)
+    add_dedup_arguments(parser)
+    add_metrics_arguments(parser)
+    add_profile_arguments(parser)
+
+    parser.add_argument('--scheduler', metavar="NAME",
+                        help="how to choose the pairs stepped next (overrides the plan's scheduler key)",
+                        type=str,
+                        choices=SCHEDULERS.keys(),
+                        dest='scheduler',
+                        default=None)
+
+    parser.add_argument('--snapshot-every', metavar="N",
+                        help="write a full status snapshot after N logged steps",
+                        type=int,
+                        dest='snapshot_every',
+                        default=1000)
+
+    parser.add_argument('--store-format', metavar="FORMAT",
+                        help="how the output file is kept (json rewrites it on every save, journal appends changes, sqlite uses a database, indexed loads records lazily)",
+                        type=str,
+                        choices=STORE_FORMATS.keys(),
+                        dest='store_format',
+                        default='json')
+
     args = parser.parse_args()
 
     logging.getLogger('qal').setLevel((6 - args.verbose)*10)
-    
+
+    if args.offline and args.cache is None:
+        parser.error("--offline requires a response cache (--cache).")
+
+    profiler = profiler_from_arguments(args)
+
     global STATUS_FILE
+    global STATUS_LOG
     STATUS_FILE = args.status_file
+    STATUS_LOG = StatusLog(STATUS_FILE, snapshot_every=args.snapshot_every)
 
     plan = {}
-    LOGGER.info("Loading plan file %s.", args.plan_file)
-    with open(args.plan_file, 'r') as fd:
-        plan = json.load(fd)
-
-    status = {}
-    if osp.exists(args.status_file):
+    with phase('plan'):
+        LOGGER.info("Loading plan file %s.", args.plan_file)
+        with open(args.plan_file, 'r') as fd:
+            plan = json.load(fd)
+
+        if 'venue_table' in plan.keys():
+            load_venue_table(plan['venue_table'])
+
+        try:
+            scheduler = scheduler_from_plan(plan, args.scheduler)
+        except ValueError as error:
+            parser.error(str(error))
+        # Priorities are for the scheduler, not query options (nor part of the query's identity).
+        for query in plan['queries']:
+            query.pop('priority', None)
+        compiled = CompiledPlan(plan)
+
+    with phase('status'):
         LOGGER.info("Restoring status.")
-        with open(args.status_file, 'r') as fd:
-            status = json.load(fd)
+        status = STATUS_LOG.load()
         LOGGER.debug("Restored status.")
 
-    results = ResultsStore(args.out_file, saviness=1)
+    # SQLite and indexed stores sync once per page, when checkpointed.
+    saviness = 0 if args.store_format in ('sqlite', 'indexed') else 1
+    cache = cache_from_arguments(args)
+
+    with phase('store_load'):
+        results = open_results_store(args.out_file, saviness=saviness, store_format=args.store_format)
+        results = dedup_from_arguments(results, args)
 
-    num_sites = len(plan['sites'])
     num_queries = len(plan['queries'])
 
     if len(status.keys()) == 0:
-        LOGGER.info("Seeding status structure.")
-        status['statuses'] = []
-        status['has_results'] = []
-        status['incomplete'] = num_sites * num_queries
-        status['batches'] = []
-        status['max_batches'] = 10
-        for j in range(num_sites):
-            row = []
-            has_results = []
-            batches = []
-            for i in range(num_queries):
-                row.append({})
-                if plan['sites'][i]['enabled']:
-                    has_results.append(True)
-                else:
-                    has_results.append(False)
-                    status['incomplete'] -= 1
-                batches.append(10)
-            status['statuses'].append(row)
-            status['has_results'].append(has_results)
-            status['batches'].append(batches)
-        LOGGER.debug("Seeded status structure.")
+        status = seed_status(plan)
+
+    if args.probe:
+        probes = probe_plan(compiled, status, cache, args.probe_threads)
+        fill_status(status, compiled, probes)
+        print(format_estimate(estimate(compiled, probes), plan.get('workers')))
 
+    scheduler.restore(status)
     write_status(status)
 
-    def batch_across():
-        sites_tqdm = tqdm(
-            enumerate(plan['sites']), desc="Sites", total=num_sites, position=1)
-        for site_id, site in sites_tqdm:
-            LOGGER.info(f"Starting for site {site['name']}.")
-            query_tqdm = tqdm(
-                enumerate(plan['queries']), desc="Query", total=num_queries, position=2)
-            if not site['enabled']:
-                continue
-            for query_id, query in query_tqdm:
-                LOGGER.info(f"Starting for query number {query_id}")
-                if status['has_results'][site_id][query_id]:
-                    LOGGER.debug(f"Building API object.")
-                    api = make_api_object(site)
-                    LOGGER.debug("Setting query parameters.")
-                    api.set_query_options(query)
-                    LOGGER.debug("Restoring query status.")
-                    restore_query_status(status, api, site_id, query_id)
-                    results_tqdm = tqdm(
-                        api.batch(), desc=f"Results ({site['name']})", total=api.page_size, position=3)
-                    for result in results_tqdm:
-                        LOGGER.info(f"Processing {result.identifier}.")
-                        results.add_item(result, site['name'], query)
-                    LOGGER.debug("Updating status matrix.")
-                    status['statuses'][site_id][query_id]['total'] = api.results_total
-                    status['statuses'][site_id][query_id]['start'] = api.start
-                    status['statuses'][site_id][query_id]['page_size'] = api.page_size
-                    status['has_results'][site_id][query_id] = api.has_results()
-                    LOGGER.debug("Estimating remaining batch size.")
-                    status['batches'][site_id][query_id] = api.estimate_batches_left()
-                    status['max_batches'] = max_runs(status['batches'])
-                    if not status['has_results'][site_id][query_id]:
-                        status['incomplete'] -= 1
-                    write_status(status)
-
-    if args.batches > 0:
-        for k in trange(args.batches, desc="Batch", position=0):
-            LOGGER.debug(f"Starting Batch {k + 1}.")
-            batch_across()
-            LOGGER.debug(f"Completed Batch {k + 1}.")
-    else:
-        with tqdm(total=status['max_batches'], desc="Batch", position=0) as progress:
-            k = 0
-            while status['incomplete'] > 0:
-                LOGGER.debug(f"Starting Batch {k + 1}.")
-                batch_across()
-                LOGGER.debug(f"Completed Batch {k + 1}.")
-                progress.update(1)
-                LOGGER.debug("Updated progress.")
-                progress.total = status['max_batches']
-                LOGGER.debug(f"Updated estimated batches.")
-                progress.refresh()
-                LOGGER.debug(f"Refreshed.")
-                k += 1
+    if args.workers > 0:
+        try:
+            succeeded = run_shards(args, compiled, status, results)
+        finally:
+            print_summary()
+            if profiler is not None:
+                profiler.stop()
+        if not succeeded:
+            sys.exit(1)
+        return
+
+    # A worker only runs the pairs of its shard.
+    owned = None
+    if 'shard' in status:
+        owned = set(tuple(pair) for pair in status['shard']['pairs'])
+
+    writer = ResultsWriter(results).start()
+
+    def update_status(site_id, query_id, entry, has_results, batches_left, passes):
+        """Record a pair's progress; run by the results writer once its results are stored."""
+        LOGGER.debug("Updating status matrix.")
+        status['statuses'][site_id][query_id] = entry
+        status['has_results'][site_id][query_id] = has_results
+        status['batches'][site_id][query_id] = batches_left
+        status['scheduler']['passes'][site_id][query_id], status['scheduler']['shares'][site_id] = passes
+        status['max_batches'] = max_runs(status['batches'])
+        if not has_results:
+            status['incomplete'] -= 1
+        with METRICS.timer('qal_store_checkpoint_seconds'):
+            results.checkpoint()
+        record_status(status, site_id, query_id)
+
+    def make_step(site_id, site):
+        api_objects = {}
+        # One page size controller per site, shared by its queries.
+        controller = None
+        if site.get('adaptive_page_size'):
+            controller = make_controller(make_api_object(site), site['adaptive_page_size'])
+
+        def get_api_object(query_id):
+            """Build the pair's API object once, restoring it from the status read at startup."""
+            if query_id not in api_objects:
+                LOGGER.debug(f"Building API object.")
+                api = make_api_object(site, cache)
+                LOGGER.debug("Setting query parameters.")
+                api.set_query_options(plan['queries'][query_id])
+                LOGGER.debug("Restoring query status.")
+                restore_query_status(status, api, site_id, query_id, args.retry_abandoned)
+                if controller is not None:
+                    api.set_adaptive(controller)
+                api_objects[query_id] = api
+            return api_objects[query_id]
+
+        def step(query_id):
+            queries = compiled.queries(site_id, query_id)
+            LOGGER.info(f"Starting for site {site['name']}, query number {query_id}")
+            api = get_api_object(query_id)
+            if site.get('parallel_pages', 1) > 1:
+                batch = api.batch_pages(site['parallel_pages'])
+            else:
+                batch = api.batch()
+            for result in batch:
+                LOGGER.info(f"Processing {result.identifier}.")
+                for query in queries:
+                    writer.add_item(result, site['name'], query)
+            LOGGER.debug("Estimating remaining batch size.")
+            has_results = api.has_results()
+            if not has_results and api.abandoned_pages:
+                LOGGER.error("Site %s, query number %d is missing the pages at %s; "
+                             "rerun with --retry-abandoned to fetch them.",
+                             site['name'], query_id, ', '.join(str(offset) for (offset, _) in api.abandoned_pages))
+            batches_left = api.estimate_batches_left()
+            passes = scheduler.stepped(site_id, query_id, batches_left)
+            entry = {'total': api.results_total,
+                     'start': api.start,
+                     'page_size': api.page_size,
+                     'failed_pages': list(api.failed_pages),
+                     'abandoned_pages': list(api.abandoned_pages),
+                     'page_attempts': dict(api.page_attempts)}
+            # A pair missing abandoned pages stays incomplete, so a later run may retry them.
+            for member in compiled.members(site_id, query_id):
+                writer.submit(update_status, site_id, member, dict(entry), not api.complete(), batches_left, passes)
+            return has_results
+        return step
+
+    lanes = []
+    for site_id, site in enumerate(plan['sites']):
+        if not site['enabled']:
+            continue
+        pairs = [query_id for query_id in range(num_queries)
+                 if status['has_results'][site_id][query_id]
+                 and compiled.is_representative(site_id, query_id)
+                 and (owned is None or (site_id, query_id) in owned)]
+        if args.batches > 0:
+            total = args.batches
+        else:
+            total = max([status['batches'][site_id][query_id] for query_id in pairs], default=0)
+        progress = tqdm(desc=f"Batch ({site['name']})", total=total, position=len(lanes))
+        lanes.append(ProviderLane(site['name'], pairs, make_step(site_id, site),
+                                  concurrency=site.get('concurrency', 1),
+                                  progress=progress,
+                                  scheduler=scheduler,
+                                  key=site_id))
+
+    exporter = exporter_from_arguments(args)
+    try:
+        run_lanes(lanes, workers=plan.get('workers'), rounds=args.batches, scheduler=scheduler)
+    finally:
+        writer.close()
+        for lane in lanes:
+            lane.progress.close()
+        if status['incomplete'] == 0 and hasattr(results, 'compact'):
+            results.compact()
+        shutdown_prefetch()
+        results.close()
+        write_status(status)
+        STATUS_LOG.close()
+        if exporter is not None:
+            exporter.stop()
+        print_summary()
+        if profiler is not None:
+            profiler.stop()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+
+LOGGER = logging.getLogger('qal.cache')
+
+DEFAULT_TTL = 7 * 24 * 60 * 60
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL,
+    body BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed);
+"""
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def scrub(value, secrets):
+    """Remove SECRETS from a request parameter dictionary or body."""
+    if isinstance(value, dict):
+        return {key: scrub(item, secrets) for (key, item) in value.items() if item not in secrets}
+    if isinstance(value, str):
+        try:
+            decoded = json.loads(value)
+        except ValueError:
+            decoded = None
+        if isinstance(decoded, dict):
+            return scrub(decoded, secrets)
+        for secret in secrets:
+            value = value.replace(secret, '')
+    return value
+
+
+def request_key(method, url, params, body, secrets=()):
+    """Key a request by its METHOD, URL, PARAMS and BODY, leaving out any of SECRETS (e.g., API keys)."""
+    secrets = [secret for secret in secrets if secret]
+    material = json.dumps([method.upper(), url, scrub(params or {}, secrets), scrub(body, secrets)],
+                          sort_keys=True, default=str)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """An on-disk cache of provider responses, kept in an SQLite database.
+
+    Responses are kept compressed, keyed by request_key.  Entries
+    older than TTL seconds are not used, except in OFFLINE mode, where
+    no requests are made and every cached entry is used.  Once the
+    cache holds more than MAX_SIZE bytes, the least recently used
+    entries are evicted.
+    """
+
+    def __init__(self, file_name, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE, offline=False):
+        self.file_name = file_name
+        self.ttl = ttl
+        self.max_size = max_size
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Access is serialized by self.lock, and lanes share the cache.
+        self.connection = sqlite3.connect(file_name, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        self.size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.connection.commit()
+
+    def get(self, key):
+        """Get the cached response body for KEY, or None."""
+        with self.lock:
+            row = self.connection.execute("SELECT created, body FROM responses WHERE key = ?",
+                                          (key,)).fetchone()
+            now = time.time()
+            if row is None or (not self.offline and self.ttl is not None and row[0] + self.ttl < now):
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+            self.hits += 1
+            return zlib.decompress(row[1])
+
+    def put(self, key, body):
+        """Cache the response BODY (bytes) under KEY, evicting old entries if needed."""
+        compressed = zlib.compress(body)
+        now = time.time()
+        with self.lock:
+            old = self.connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if old is not None:
+                self.size -= old[0]
+            self.connection.execute("INSERT OR REPLACE INTO responses (key, created, accessed, size, body) VALUES (?, ?, ?, ?, ?)",
+                                    (key, now, now, len(compressed), compressed))
+            self.size += len(compressed)
+            if self.max_size is not None and self.size > self.max_size:
+                self.evict()
+            self.connection.commit()
+
+    def evict(self):
+        LOGGER.debug("Evicting cached responses (%d bytes cached).", self.size)
+        rows = self.connection.execute("SELECT key, size FROM responses ORDER BY accessed")
+        evicted = []
+        for (key, size) in rows:
+            if self.size <= self.max_size:
+                break
+            evicted.append((key,))
+            self.size -= size
+        self.connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def get_cache(file_name, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE, offline=False):
+    """Get the response cache kept in FILE_NAME, shared by every API object in the process."""
+    with _caches_lock:
+        cache = _caches.get(file_name)
+        if cache is None:
+            cache = ResponseCache(file_name, ttl, max_size, offline)
+            _caches[file_name] = cache
+        return cache
+
+
+def add_cache_arguments(parser):
+    """Add the response cache options to an argument PARSER."""
+    parser.add_argument('--cache', metavar='CACHE',
+                        help="cache provider responses in CACHE",
+                        type=str,
+                        dest='cache')
+
+    parser.add_argument('--cache-ttl', metavar='SECONDS',
+                        help="how long cached responses are used for",
+                        type=float,
+                        dest='cache_ttl',
+                        default=DEFAULT_TTL)
+
+    parser.add_argument('--cache-size', metavar='MB',
+                        help="maximum size of the response cache",
+                        type=float,
+                        dest='cache_size',
+                        default=DEFAULT_MAX_SIZE / (1024 * 1024))
+
+    parser.add_argument('--offline',
+                        help="answer requests only from the response cache",
+                        dest='offline',
+                        action='store_true',
+                        default=False)
+
+
+def cache_from_arguments(args):
+    """The response cache described by parsed ARGS, or None."""
+    if args.cache is None:
+        return None
+    return get_cache(args.cache,
+                     ttl=args.cache_ttl,
+                     max_size=int(args.cache_size * 1024 * 1024),
+                     offline=args.offline)
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import re
+import json
+import hashlib
+import logging
+import unicodedata
+import os.path as osp
+
+from .types import QUERIES
+
+LOGGER = logging.getLogger('qal.dedup')
+
+DOI_PREFIX = re.compile(r'^(?:https?://(?:dx\.)?doi\.org/|doi:\s*)', re.IGNORECASE)
+
+NON_WORD = re.compile(r'[\W_]+')
+
+DEFAULT_THRESHOLD = 0.8
+
+
+def normalize_doi(identifier):
+    """The lower-case bare DOI in IDENTIFIER, or None if it is not a DOI."""
+    if not isinstance(identifier, str):
+        return None
+    doi = DOI_PREFIX.sub('', identifier.strip()).lower()
+    if doi.startswith('10.') and '/' in doi:
+        return doi
+    return None
+
+
+def normalize_title(title):
+    """TITLE without accents, case, punctuation or repeated spaces."""
+    if not title:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', title)
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return NON_WORD.sub(' ', stripped.casefold()).strip()
+
+
+def shingles(normalized, size=4):
+    """The set of SIZE-character shingles of a NORMALIZED title, ignoring spaces."""
+    text = normalized.replace(' ', '')
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def jaccard(first, second):
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def normalize_year(year):
+    try:
+        return int(year)
+    except (TypeError, ValueError):
+        return None
+
+
+class MinHasher:
+    """MinHash signatures of shingle sets, of NUM_PERM values.
+
+    Signatures use one permutation hashing: each shingle is hashed
+    once, into one of NUM_PERM bins, each bin keeping its smallest
+    value, and empty bins take the value of the next non-empty one.
+    """
+
+    def __init__(self, num_perm=64, seed=b'qal'):
+        self.num_perm = num_perm
+        self.seed = seed
+
+    def signature(self, shingle_set):
+        num_perm = self.num_perm
+        bins = [None] * num_perm
+        for shingle in shingle_set:
+            value = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8, key=self.seed).digest(),
+                                   'little')
+            (value, position) = divmod(value, num_perm)
+            if bins[position] is None or value < bins[position]:
+                bins[position] = value
+        filled = [i for i in range(num_perm) if bins[i] is not None]
+        if not filled:
+            return tuple(bins)
+        signature = list(bins)
+        following = filled[0] + num_perm
+        for i in reversed(range(num_perm)):
+            if bins[i] is None:
+                signature[i] = (bins[following % num_perm], following - i)
+            else:
+                following = i
+        return tuple(signature)
+
+
+class DedupIndex:
+    """An index of publications which finds duplicates without pairwise comparison.
+
+    A publication is a duplicate of an indexed one when their DOIs
+    (ignoring case and resolver prefixes) are the same, when their
+    normalized titles and years are the same, or when the Jaccard
+    similarity of their title shingles is at least THRESHOLD and their
+    years differ by at most one.  Publications with different DOIs are
+    never duplicates, however close their titles (as for editorials,
+    prefaces, and the like).  Similar titles are found by
+    locality-sensitive hashing of MinHash signatures in BANDS bands of
+    ROWS rows, so only publications sharing a band are compared.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, bands=16, rows=4):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self.hasher = MinHasher(bands * rows)
+        self.dois = {}
+        self.titles = {}
+        self.records = {}
+        self.buckets = {}
+        self.last = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, identifier):
+        return identifier in self.records
+
+    def fingerprint(self, item):
+        """ITEM's normalized DOI, title and year, title shingles, and LSH band keys."""
+        if self.last is not None and self.last[0] is item:
+            return self.last[1]
+        doi = normalize_doi(item.identifier)
+        title = normalize_title(item.title)
+        year = normalize_year(item.year)
+        shingle_set = shingles(title) if title else set()
+        keys = []
+        if title:
+            signature = self.hasher.signature(shingle_set)
+            keys = [hash((band, signature[band * self.rows:(band + 1) * self.rows]))
+                    for band in range(self.bands)]
+        fingerprint = (doi, title, year, shingle_set, keys)
+        self.last = (item, fingerprint)
+        return fingerprint
+
+    def find(self, item):
+        """The identifier of an indexed publication ITEM duplicates, or None."""
+        (doi, title, year, shingle_set, keys) = self.fingerprint(item)
+        if doi is not None and doi in self.dois:
+            return self.dois[doi]
+        if not title:
+            return None
+        match = self.titles.get((title, year))
+        if match is not None and not self.conflicts(doi, match):
+            return match
+        candidates = set()
+        for key in keys:
+            candidates.update(self.buckets.get(key, ()))
+        best = (self.threshold, None)
+        for candidate in candidates:
+            (candidate_title, candidate_year, _) = self.records[candidate]
+            if year is not None and candidate_year is not None and abs(year - candidate_year) > 1:
+                continue
+            if self.conflicts(doi, candidate):
+                continue
+            similarity = jaccard(shingle_set, shingles(candidate_title))
+            if similarity >= best[0]:
+                best = (similarity, candidate)
+        return best[1]
+
+    def conflicts(self, doi, identifier):
+        """Whether DOI and the DOI of the indexed publication IDENTIFIER are known to differ."""
+        candidate_doi = self.records[identifier][2]
+        return doi is not None and candidate_doi is not None and doi != candidate_doi
+
+    def add(self, item, canonical=None):
+        """Index ITEM, as a duplicate of CANONICAL if given."""
+        (doi, title, year, _, keys) = self.fingerprint(item)
+        if canonical is not None:
+            if doi is not None:
+                self.dois.setdefault(doi, canonical)
+                (canonical_title, canonical_year, canonical_doi) = self.records[canonical]
+                if canonical_doi is None:
+                    self.records[canonical] = (canonical_title, canonical_year, doi)
+            return
+        identifier = item.identifier
+        self.records[identifier] = (title, year, doi)
+        if doi is not None:
+            self.dois.setdefault(doi, identifier)
+        if title:
+            self.titles.setdefault((title, year), identifier)
+            for key in keys:
+                self.buckets.setdefault(key, []).append(identifier)
+
+
+class DeduplicatingStore:
+    """A results store which merges duplicate publications from different providers.
+
+    Publications found to be duplicates (see DedupIndex) are merged
+    into the first one stored, keeping the search terms of both.  The
+    identifiers of merged publications are kept, one JSON object per
+    line, in STORE.file_name + '.aliases'.  Other methods are those of
+    the wrapped store.
+    """
+
+    def __init__(self, store, index=None):
+        self.store = store
+        self.index = index if index is not None else DedupIndex()
+        self.aliases = {}
+        self.aliases_name = f"{store.file_name}.aliases"
+        if osp.exists(self.aliases_name):
+            with open(self.aliases_name, 'r') as fd:
+                for line in fd:
+                    if line.endswith('\n'):
+                        record = json.loads(line)
+                        self.aliases[record['alias']] = record['identifier']
+        LOGGER.info("Building duplicate index of %s.", store.file_name)
+        for identifier in store:
+            self.index.add(store.get(identifier))
+        self.aliases_file = open(self.aliases_name, 'a')
+
+    def canonical(self, identifier):
+        """The identifier IDENTIFIER was merged into (or itself)."""
+        return self.aliases.get(identifier, identifier)
+
+    def add_item(self, item, source=None, query=None):
+        if item.identifier in self.aliases:
+            item.identifier = self.aliases[item.identifier]
+        elif item.identifier not in self.index:
+            canonical = self.index.find(item)
+            if canonical is None:
+                self.index.add(item)
+            else:
+                LOGGER.debug("Merging %s into %s.", item.identifier, canonical)
+                self.index.add(item, canonical)
+                self.aliases[item.identifier] = canonical
+                self.aliases_file.write(json.dumps({'alias': item.identifier, 'identifier': canonical}))
+                self.aliases_file.write('\n')
+                self.aliases_file.flush()
+                item.identifier = canonical
+                for (known_source, identifier) in sorted(item.search_terms):
+                    self.store.add_item(item, known_source, QUERIES.get(identifier))
+        self.store.add_item(item, source, query)
+
+    def get(self, name):
+        return self.store.get(self.canonical(name))
+
+    def close(self):
+        self.aliases_file.close()
+        self.store.close()
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def __iter__(self):
+        return iter(self.store)
+
+
+def add_dedup_arguments(parser):
+    """Add the duplicate detection options to an argument PARSER."""
+    parser.add_argument('--dedup',
+                        help="merge duplicate publications from different providers",
+                        dest='dedup',
+                        action='store_true',
+                        default=False)
+
+    parser.add_argument('--dedup-threshold', metavar='SIMILARITY',
+                        help="title similarity (0 to 1) above which publications are duplicates",
+                        type=float,
+                        dest='dedup_threshold',
+                        default=DEFAULT_THRESHOLD)
+
+
+def dedup_from_arguments(store, args):
+    """STORE, merging duplicates if parsed ARGS ask for it."""
+    if not args.dedup:
+        return store
+    return DeduplicatingStore(store, DedupIndex(threshold=args.dedup_threshold))
@@ -27,10 +27,20 @@ import requests
 import backoff
 import traceback
 import logging
+import json
+import copy
+import time
+import threading
 
 from math import ceil
+from concurrent.futures import ThreadPoolExecutor
 
 from .exceptions import *
+from .metrics import METRICS
+from .profiling import phase, in_phase
+from .sessions import get_session, DEFAULT_POOL_SIZE, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+from .ratelimit import get_limiter
+from .cache import request_key
 
 from abc import ABCMeta, abstractmethod
 
@@ -38,8 +48,63 @@ from io import StringIO
 
 LOGGER = logging.getLogger('qal.DigitalLibrary')
 
+PREFETCH_WORKERS = 32
+
+_prefetch_pool = None
+_prefetch_futures = set()
+_prefetch_pool_lock = threading.Lock()
+
+
+def get_prefetch_pool():
+    """The thread pool shared by every API object for prefetching pages."""
+    global _prefetch_pool
+    with _prefetch_pool_lock:
+        if _prefetch_pool is None:
+            _prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS,
+                                                thread_name_prefix='qal-prefetch')
+        return _prefetch_pool
+
+
+def submit_prefetch(function, *args):
+    """Run FUNCTION with ARGS on the prefetch pool, tracking it until it is done."""
+    future = get_prefetch_pool().submit(function, *args)
+    with _prefetch_pool_lock:
+        _prefetch_futures.add(future)
+    future.add_done_callback(_forget_prefetch)
+    return future
+
+
+def _forget_prefetch(future):
+    with _prefetch_pool_lock:
+        _prefetch_futures.discard(future)
+
+
+def shutdown_prefetch():
+    """Stop prefetching, dropping any pages not yet requested."""
+    global _prefetch_pool
+    with _prefetch_pool_lock:
+        pending = list(_prefetch_futures)
+        _prefetch_futures.clear()
+        pool, _prefetch_pool = _prefetch_pool, None
+    # Futures are cancelled by hand, shutdown only takes cancel_futures from Python 3.9.
+    for future in pending:
+        future.cancel()
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+
 def backoff_logger(details):
     LOGGER.warning("Backing off {wait:0.1f} seconds after {tries} tries.".format(**details))
+    api = details['args'][0]
+    METRICS.inc('qal_retries_total', provider=api.name, reason='error')
+    if api.adaptive is not None:
+        api.adaptive.failure()
+        api.page_size = api.adaptive.current(api.page_size)
+
+
+def giveup_logger(details):
+    LOGGER.error("Giving up after {tries} tries.".format(**details))
+    METRICS.inc('qal_errors_total', provider=details['args'][0].name)
 
 class DigitalLibrary(metaclass=ABCMeta):
     """A representation of a queryable Digital Library.
@@ -48,6 +113,18 @@ class DigitalLibrary(metaclass=ABCMeta):
     given.
     """
 
+    # Default (requests per second, requests per day) limits, None if not limited.
+    rate_limit = (None, None)
+
+    # The largest page the provider serves, None if unknown.
+    max_page_size = None
+
+    # How many times a request is re-sent after the provider rate limits it (HTTP 429).
+    rate_limit_retries = 5
+
+    # How many times a page fetched by batch_pages is tried before it is given up on.
+    max_page_attempts = 3
+
     def __init__(self,
                  name,
                  description,
@@ -77,6 +154,20 @@ class DigitalLibrary(metaclass=ABCMeta):
         self.start = start
         self.query_option_information = query_option_information
 
+        self.pool_size = DEFAULT_POOL_SIZE
+        self.connect_timeout = DEFAULT_CONNECT_TIMEOUT
+        self.read_timeout = DEFAULT_READ_TIMEOUT
+        (self.requests_per_second, self.requests_per_day) = self.rate_limit
+        self.cache = None
+        self.prefetch = 0
+        self.prefetched = {}
+        self.failed_pages = []
+        self.abandoned_pages = []
+        self.page_attempts = {}
+        self.adaptive = None
+        self.last_latency = None
+        self.last_requested = None
+
         self.results_total = -1
         self.options = {}
         self.query_data = {}
@@ -132,6 +223,46 @@ class DigitalLibrary(metaclass=ABCMeta):
         for key in query_options.keys():
             self.set_query_option(key, query_options[key])
 
+    def set_connection_options(self, pool_size=None, connect_timeout=None, read_timeout=None):
+        """Configure the connection pool size and the connect/read timeouts (in seconds)."""
+        if pool_size is not None:
+            self.pool_size = pool_size
+        if connect_timeout is not None:
+            self.connect_timeout = connect_timeout
+        if read_timeout is not None:
+            self.read_timeout = read_timeout
+
+    def set_rate_limit(self, per_second=None, per_day=None):
+        """Limit requests made with this API key to PER_SECOND per second and PER_DAY per day."""
+        if per_second is not None:
+            self.requests_per_second = per_second
+        if per_day is not None:
+            self.requests_per_day = per_day
+
+    def set_prefetch(self, depth):
+        """Keep up to DEPTH following pages in flight while a page is being consumed."""
+        self.prefetch = depth
+
+    def set_adaptive(self, controller):
+        """Let CONTROLLER, a qal.adaptive.PageSizeController, choose page sizes."""
+        self.adaptive = controller
+
+    def set_cache(self, cache):
+        """Answer requests from (and store responses in) CACHE, a qal.cache.ResponseCache."""
+        self.cache = cache
+
+    @property
+    def rate_limiter(self):
+        """The token bucket shared by every user of this provider and API key."""
+        return get_limiter(self.name, self.api_key,
+                           self.requests_per_second,
+                           self.requests_per_day)
+
+    @property
+    def session(self):
+        """The pooled, keep-alive session shared by all API objects using this endpoint's host."""
+        return get_session(self.api_endpoint, self.pool_size)
+
     def construct_headers(self):
         """Construct a dictionary of headers for the request.  Override if necessary."""
         return {}
@@ -147,18 +278,50 @@ class DigitalLibrary(metaclass=ABCMeta):
     @backoff.on_exception(backoff.expo,
                           requests.exceptions.RequestException,
                           max_tries=10,
-                          on_backoff=backoff_logger)
+                          on_backoff=backoff_logger,
+                          on_giveup=giveup_logger)
+    @in_phase('fetch')
     def make_request(self):
         """Make a request."""
         headers = self.construct_headers()
         params = self.construct_parameters()
         body = self.construct_body()
-        response = requests.request(method=self.request_type,
-                                    url=self.api_endpoint,
-                                    params=params,
-                                    headers=headers,
-                                    data=body)
-        return response.json()
+        key = None
+        if self.cache is not None:
+            key = request_key(self.request_type, self.api_endpoint, params, body, [self.api_key])
+            cached = self.cache.get(key)
+            if cached is not None:
+                LOGGER.debug("Answering request from cache.")
+                METRICS.inc('qal_cache_hits_total', provider=self.name)
+                return json.loads(cached)
+            if self.cache.offline:
+                raise CacheMiss(key)
+        limiter = self.rate_limiter
+        for attempt in range(self.rate_limit_retries + 1):
+            limiter.acquire()
+            began = time.perf_counter()
+            with METRICS.timer('qal_request_seconds', provider=self.name):
+                response = self.session.request(method=self.request_type,
+                                                url=self.api_endpoint,
+                                                params=params,
+                                                headers=headers,
+                                                data=body,
+                                                timeout=(self.connect_timeout, self.read_timeout))
+            (self.last_latency, self.last_requested) = (time.perf_counter() - began, self.page_size)
+            METRICS.inc('qal_requests_total', provider=self.name, status=str(response.status_code))
+            limiter.update(response.headers, response.status_code)
+            if response.status_code != 429:
+                break
+            LOGGER.warning("Rate limited by %s (attempt %d).", self.name, attempt + 1)
+            METRICS.inc('qal_retries_total', provider=self.name, reason='throttled')
+        if response.status_code >= 500:
+            LOGGER.warning("Server error %d from %s.", response.status_code, self.name)
+            response.raise_for_status()
+        with METRICS.timer('qal_decode_seconds', provider=self.name):
+            data = response.json()
+        if key is not None and response.status_code == 200:
+            self.cache.put(key, response.content)
+        return data
 
     @abstractmethod
     def process_results(self, results):
@@ -168,6 +331,18 @@ class DigitalLibrary(metaclass=ABCMeta):
          - If an un-recoverable error occurs, set self.error to true, otherwise, try to recover it."""
         raise NotImplementedError("Must define result processing logic.")
 
+    def parse(self, data):
+        """Process DATA with process_results, recording how long it took and how many results it gave."""
+        start = self.start
+        with phase('parse'), METRICS.timer('qal_process_seconds', provider=self.name):
+            results = self.process_results(data)
+        METRICS.inc('qal_records_total', len(results), provider=self.name)
+        # Only pages this object requested itself (not prefetched or cached ones) are observed.
+        if self.adaptive is not None and self.last_latency is not None and not self.error:
+            self.adaptive.observe(self.last_latency, self.last_requested, self.start - start, not self.has_results())
+        self.last_latency = None
+        return results
+
     def has_results(self):
         """Do we expect to have more results?"""
         if self.error:
@@ -175,14 +350,71 @@ class DigitalLibrary(metaclass=ABCMeta):
         elif self.results_total == -1:
             return True
         else:
-            return self.start < self.results_total
+            return self.start < self.results_total or len(self.failed_pages) > 0
+
+    def complete(self):
+        """Have all results been fetched?  Not while pages given up on are left."""
+        return not self.has_results() and len(self.abandoned_pages) == 0
+
+    def request_at(self, start):
+        """Make a request for the page starting at START, without changing this object."""
+        clone = copy.copy(self)
+        clone.start = start
+        return clone.make_request()
+
+    def fetch_page(self):
+        """Get the page at the current start, from a prefetch if one was made."""
+        future = self.prefetched.pop(self.start, None)
+        if future is not None:
+            LOGGER.debug("Using prefetched page at %d.", self.start)
+            return future.result()
+        return self.make_request()
+
+    def schedule_prefetch(self):
+        """Start requesting the next pages, up to the prefetch depth."""
+        if self.prefetch <= 0 or self.error or self.results_total < 0:
+            return
+        offsets = []
+        for k in range(self.prefetch):
+            offset = self.start + k * self.page_size
+            if offset >= self.results_total:
+                break
+            offsets.append(offset)
+        for offset in list(self.prefetched.keys()):
+            if offset not in offsets:
+                self.prefetched.pop(offset).cancel()
+        for offset in offsets:
+            if offset not in self.prefetched:
+                LOGGER.debug("Prefetching page at %d.", offset)
+                self.prefetched[offset] = submit_prefetch(self.request_at, offset)
+
+    def cancel_prefetch(self):
+        for future in self.prefetched.values():
+            future.cancel()
+        self.prefetched = {}
+
+    def adapt_page_size(self):
+        """Take the page size chosen by the adaptive controller, if any."""
+        if self.adaptive is not None:
+            self.page_size = self.adaptive.current(self.page_size)
 
     def batch(self):
-        """Query batch by batch."""
+        """Query batch by batch.
+
+        Pages left failed by batch_pages (for instance, by a run with
+        more parallel pages) are retried first, one per batch.
+        """
+        self.adapt_page_size()
+        if self.failed_pages and self.results_total >= 0:
+            pages = self.failed_pages[:1]
+            self.failed_pages = self.failed_pages[1:]
+            yield from self.fetch_pages(pages, 1)
+            return
         try:
             if self.has_results():
-                data = self.make_request()
-                results = self.process_results(data)
+                data = self.fetch_page()
+                results = self.parse(data)
+                self.schedule_prefetch()
                 for result in results:
                     yield result
                 else:
@@ -190,6 +422,106 @@ class DigitalLibrary(metaclass=ABCMeta):
         except:
             print(traceback.format_exc())
             self.error = True
+            self.cancel_prefetch()
+
+    def fetch_page_at(self, offset, page_size=None):
+        """Fetch and process the page at OFFSET (of PAGE_SIZE, if given) on a copy of this object.
+
+        Returns the results, the copy's total and its start after
+        processing, or raises if the page could not be fetched (or
+        was empty, unless there are no results at all).
+        """
+        clone = copy.copy(self)
+        clone.start = offset
+        if page_size is not None:
+            clone.page_size = page_size
+        clone.error = False
+        results = clone.parse(clone.make_request())
+        if clone.error or (clone.start == offset and clone.results_total != 0):
+            raise RuntimeError(f"Page at {offset} of {self.name} returned no results.")
+        return (results, clone.results_total, clone.start)
+
+    def probe(self):
+        """Find the total number of results with a request for a single result.
+
+        The request is made on a copy of this object, which is left as
+        it was.
+        """
+        clone = copy.copy(self)
+        clone.page_size = 1
+        clone.error = False
+        clone.adaptive = None
+        clone.parse(clone.make_request())
+        if clone.error or clone.results_total < 0:
+            raise RuntimeError(f"Probing {self.name} gave no total.")
+        return clone.results_total
+
+    def fetch_pages(self, pages, workers=4):
+        """Fetch PAGES, [offset, stop] pairs, on up to WORKERS threads, yielding their results in order.
+
+        Requests are paced by this key's rate limiter, and each page is
+        requested at the current page size, up to its stop.  Pages that
+        fail are added to self.failed_pages, to be retried by a later
+        batch, instead of stopping the query; so is the rest of a page
+        which returned fewer results than it was planned for.  Pages
+        which failed max_page_attempts times are moved to
+        self.abandoned_pages instead.
+        """
+        with ThreadPoolExecutor(max_workers=max(1, workers),
+                                thread_name_prefix=f"qal-{self.name}-pages") as pool:
+            futures = [(offset, stop, pool.submit(self.fetch_page_at, offset, min(self.page_size, stop - offset)))
+                       for (offset, stop) in pages]
+            for (offset, stop, future) in futures:
+                try:
+                    (results, total, end) = future.result()
+                except Exception:
+                    attempts = self.page_attempts.get(offset, 0) + 1
+                    self.page_attempts[offset] = attempts
+                    if attempts < self.max_page_attempts:
+                        LOGGER.warning("Page at %d failed (attempt %d), will retry.", offset, attempts)
+                        self.failed_pages.append([offset, stop])
+                    else:
+                        LOGGER.error("Page at %d failed %d times, giving up:\n%s", offset, attempts, traceback.format_exc())
+                        self.abandoned_pages.append([offset, stop])
+                    continue
+                self.page_attempts.pop(offset, None)
+                self.results_total = total
+                if stop == self.start and end < stop:
+                    # The last page gives the true end of the results fetched.
+                    self.start = end
+                elif end < stop and end < total:
+                    LOGGER.debug("Short page at %d, fetching the rest from %d to %d.", offset, end, stop)
+                    self.failed_pages.append([end, stop])
+                for result in results:
+                    yield result
+        self.failed_pages.sort()
+
+    def retry_abandoned(self):
+        """Retry the pages given up on, with their attempts counted anew."""
+        for (offset, stop) in self.abandoned_pages:
+            self.page_attempts.pop(offset, None)
+            self.failed_pages.append([offset, stop])
+        self.failed_pages.sort()
+        self.abandoned_pages = []
+
+    def batch_pages(self, count, workers=None):
+        """Query up to COUNT pages at once: earlier failed pages first, then the following pages.
+
+        The first page is fetched on its own, as the total number of
+        results is needed to know which pages exist.
+        """
+        if self.results_total < 0:
+            yield from self.batch()
+            return
+        self.adapt_page_size()
+        pages = self.failed_pages[:count]
+        self.failed_pages = self.failed_pages[count:]
+        offset = self.start
+        while len(pages) < count and offset < self.results_total:
+            pages.append([offset, offset + self.page_size])
+            offset += self.page_size
+        self.start = offset
+        yield from self.fetch_pages(pages, workers or count)
 
     def estimate_batches(self):
         """Estimate the total number of batches."""
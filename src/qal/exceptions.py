@@ -28,3 +28,10 @@ class UnknownQueryParameter(Exception):
         self.query_parameter = query_parameter
         self.message = message
         super().__init__(self.message)
+
+
+class CacheMiss(Exception):
+    def __init__(self, key, message="The response is not cached, and requests may not be made."):
+        self.key = key
+        self.message = message
+        super().__init__(self.message)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import threading
+import logging
+
+from collections import Counter
+
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION, FIRST_COMPLETED
+
+from .profiling import phase
+from .scheduler import Scheduler
+
+LOGGER = logging.getLogger('qal.executor')
+
+
+class ResultsWriter:
+    """Serialize every write to a ResultsStore through a single thread.
+
+    Besides results, arbitrary callables may be submitted; they are run
+    in order with the results, so bookkeeping (such as status updates)
+    only happens once the results before it have been stored.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.queue = Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self._run,
+                                       name='qal-results-writer',
+                                       daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None:
+                    return
+                function, args = task
+                if self.error is None:
+                    with phase('store'):
+                        function(*args)
+            except Exception as error:
+                LOGGER.critical("Results writer failed: %s.", error)
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+        """Re-raise a failure from the writer thread, if any."""
+        if self.error is not None:
+            raise self.error
+
+    def submit(self, function, *args):
+        """Run FUNCTION with ARGS on the writer thread, after anything submitted before it."""
+        self.check()
+        self.queue.put((function, args))
+
+    def add_item(self, item, source=None, query=None):
+        self.submit(self.store.add_item, item, source, query)
+
+    def flush(self):
+        """Wait until everything submitted so far has been written."""
+        self.queue.join()
+        self.check()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.check()
+
+
+class ProviderLane:
+    """A worker lane running one provider's queries.
+
+    Each round runs STEP once for every pair that still has results, in
+    order.  STEP is given a pair and returns whether it has more results.
+    With a CONCURRENCY above one, that many pairs of the lane are stepped
+    at the same time, each pair still being stepped once per round.  A
+    SCHEDULER (see qal.scheduler) may instead choose, step by step, which
+    pairs make up a round; KEY identifies the lane to it.
+    """
+
+    def __init__(self, name, pairs, step, concurrency=1, progress=None, scheduler=None, key=None):
+        self.name = name
+        self.pairs = list(pairs)
+        self.step = step
+        self.concurrency = max(1, concurrency)
+        self.progress = progress
+        self.scheduler = scheduler if scheduler is not None else Scheduler()
+        self.key = key if key is not None else name
+        self.active = list(self.pairs)
+        self.pool = None
+        self.rounds = 0
+
+    def finished(self, rounds=-1):
+        """Whether the lane is done, or has run ROUNDS rounds (if not negative)."""
+        return len(self.active) == 0 or (rounds >= 0 and self.rounds >= rounds)
+
+    def run_round(self):
+        """Run one round, of as many steps as there are pairs left."""
+        if self.pool is None and self.concurrency > 1:
+            self.pool = ThreadPoolExecutor(max_workers=self.concurrency,
+                                           thread_name_prefix=f"qal-{self.name}")
+        LOGGER.debug("Starting round %d of lane %s.", self.rounds + 1, self.name)
+        budget = len(self.active)
+        stepped = Counter()
+        taken = 0
+        while self.active and taken < budget:
+            chosen = self.scheduler.select(self.key, self.active,
+                                           min(self.concurrency, budget - taken), stepped)
+            if len(chosen) == 0:
+                break
+            if self.pool is None:
+                more = [self.step(pair) for pair in chosen]
+            else:
+                more = list(self.pool.map(self.step, chosen))
+            for (pair, has_more) in zip(chosen, more):
+                stepped[pair] += 1
+                if not has_more:
+                    self.active.remove(pair)
+            taken += len(chosen)
+        self.rounds += 1
+        if self.progress is not None:
+            self.progress.update(1)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def run(self, rounds=-1, stop=None):
+        """Run ROUNDS rounds (or until done if negative), or until STOP is set."""
+        try:
+            while not self.finished(rounds):
+                if stop is not None and stop.is_set():
+                    LOGGER.info("Stopping lane %s.", self.name)
+                    break
+                self.run_round()
+        finally:
+            self.close()
+        return self.rounds
+
+
+def run_lanes(lanes, workers=None, rounds=-1, scheduler=None):
+    """Run LANES concurrently on at most WORKERS threads (one per lane by default).
+
+    Returns once every lane has finished; an exception in any lane stops
+    the others after their current round and is re-raised.  With fewer
+    workers than lanes and a SCHEDULER which interleaves lanes, lanes
+    take turns running a round instead of each running to completion.
+    """
+    if len(lanes) == 0:
+        return
+    if workers is None or workers < 1:
+        workers = len(lanes)
+    if scheduler is not None and scheduler.interleave and workers < len(lanes):
+        interleave_lanes(lanes, workers, rounds, scheduler)
+        return
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='qal-lane') as pool:
+        futures = [pool.submit(lane.run, rounds, stop) for lane in lanes]
+        try:
+            pending = futures
+            while pending:
+                done, pending = wait(pending, timeout=1, return_when=FIRST_EXCEPTION)
+                for future in done:
+                    if future.exception() is not None:
+                        stop.set()
+        except KeyboardInterrupt:
+            LOGGER.warning("Interrupted, waiting for lanes to finish their current round.")
+            stop.set()
+            raise
+        for future in futures:
+            future.result()
+
+
+def interleave_lanes(lanes, workers, rounds, scheduler):
+    """Run LANES a round at a time on WORKERS threads, the next lane chosen by SCHEDULER."""
+    waiting = [lane for lane in lanes if not lane.finished(rounds)]
+    running = {}
+    error = None
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='qal-lane') as pool:
+        try:
+            while running or (waiting and error is None):
+                while error is None and waiting and len(running) < workers:
+                    lane = scheduler.next_lane(waiting)
+                    waiting.remove(lane)
+                    running[pool.submit(lane.run_round)] = lane
+                done, _ = wait(running, timeout=1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    lane = running.pop(future)
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                    elif not lane.finished(rounds):
+                        waiting.append(lane)
+        except KeyboardInterrupt:
+            LOGGER.warning("Interrupted, waiting for lanes to finish their current round.")
+            wait(running)
+            raise
+        finally:
+            for lane in lanes:
+                lane.close()
+    if error is not None:
+        raise error
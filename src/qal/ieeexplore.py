@@ -24,31 +24,22 @@
 # SOFTWARE.
 
 from .digital_library import DigitalLibrary
+from .venues import IEEE_VENUES
 from .types import Conference, Article
 
-import re
 import logging
 
 LOGGER = logging.getLogger('qal.ieeexplore')
 
 def sanitize_venue(string):
-    # string = re.sub(r"(ACM/)?IEEE(/ACM)?", "", string)
-    string = re.sub(r"[0-9]{4}", "", string)
-    string = re.sub(r"[0-9]{1,2}(nd|th|rd|st)", "", string)
-    string = re.sub(r"Proceedings?\.?( of)?( the)?", "", string)
-    string = re.sub(r"\bs ", "", string)
-    string = re.sub(r"[\[\]]", "", string)
-    string = re.sub(r"(first|second|third|fourth|fifth|sixth|seventh|eighth|ninth|tenth|eleventh|twelfth|thirteenth|fourteenth|fifteenth|sixteenth|seventeeth|eighteenth|ninteenth|twentieth|twenty|thirtieth|thirty|fourthieth|fourty|fiftieth|fifty|sixtieth|sixty)-?", "", string, flags=re.IGNORECASE)
-    string = re.sub(r"\(.*\)$", "", string)
-    string = re.sub(r"^Annual", "", string)
-    string = re.sub(r"(ACM/IEEE|IEEE/ACM|IEEE|ACM)", "", string)
-    string = re.sub(r"^The ", "", string, flags=re.IGNORECASE)
-    string = re.sub(r"\s+", " ", string).strip()
-    string = string.strip()
-    return string
+    return IEEE_VENUES.normalize(string)
 
 
 class IEEEXplore(DigitalLibrary):
+
+    rate_limit = (10, 200)
+    max_page_size = 200
+
     def __init__(self, api_key, max_results=50, start_result=1):
         super().__init__(name='ieee_explore',
                          description="IEEEXplore Library",
@@ -94,16 +85,16 @@ class IEEEXplore(DigitalLibrary):
                 authors = []
                 for author in result['authors']['authors']:
                     authors.append(author['full_name'])
-                    result_item = Conference(identifier,
-                                             result['title'],
-                                             authors,
-                                             result['publication_year'],
-                                             conference=sanitize_venue(
-                                                 result['publication_title']),
-                                             book_title=result['publication_title'],
-                                             abstract=result.get('abstract'),
-                                             pages=None)
-                    results.append(result_item)
+                result_item = Conference(identifier,
+                                         result['title'],
+                                         authors,
+                                         result['publication_year'],
+                                         conference=sanitize_venue(
+                                             result['publication_title']),
+                                         book_title=result['publication_title'],
+                                         abstract=result.get('abstract'),
+                                         pages=None)
+                results.append(result_item)
             elif item_type == 'Journals':
                 authors = []
                 for author in result['authors']['authors']:
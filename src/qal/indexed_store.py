@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import os.path as osp
+import json
+import mmap
+import logging
+
+import jsonpickle
+
+from .types import QUERIES
+from .metrics import METRICS
+from .serialization import encode_store, decode_store
+
+LOGGER = logging.getLogger('qal.indexed_store')
+
+INDEX_HEADER = b'qal-index 1 '
+
+
+def encode_key(identifier):
+    return json.dumps(identifier).encode('utf-8')
+
+
+class IndexedResultsStore:
+    """A results store which only decodes the records it reads or updates.
+
+    Records are appended to FILE_NAME, one per line, each prefixed by
+    its identifier.  A separate identifier index, FILE_NAME.index, maps
+    identifiers to the offset and length of their latest record; it is
+    sorted, and searched in place through a memory map, so opening a
+    store only reads what is needed.  Identifiers added since the index
+    was last written are kept in FILE_NAME.index-tail (and in memory)
+    until the store is closed.  Queries are kept in FILE_NAME.queries.
+
+    Records are synced to disk every SAVINESS items.  Compaction drops
+    superseded records.
+    """
+
+    def __init__(self, file_name, saviness=0):
+        self.file_name = file_name
+        self.saviness = saviness
+        self.num = 0
+        self.index_name = f"{file_name}.index"
+        self.tail_name = f"{file_name}.index-tail"
+        self.queries_name = f"{file_name}.queries"
+        self.recent = {}
+        self.saved_queries = set()
+        self.index_map = None
+        self.index_fd = None
+        self.index_start = 0
+        self.indexed_size = 0
+        if osp.exists(file_name) and not osp.exists(self.index_name):
+            self.convert()
+        self.load_queries()
+        self.load_index()
+        self.records = open(file_name, 'ab')
+        self.tail = open(self.tail_name, 'a')
+        self.queries = open(self.queries_name, 'a')
+        self.recover()
+
+    def convert(self):
+        """Convert a store in the standard format (or an unindexed records file) in place."""
+        with open(self.file_name, 'rb') as fd:
+            first = fd.read(1)
+        if first != b'{':
+            LOGGER.info("Rebuilding index of %s.", self.file_name)
+            return
+        LOGGER.info("Converting %s to an indexed store, keeping a copy in %s.bak.", self.file_name, self.file_name)
+        with open(self.file_name, 'r') as fd:
+            data = decode_store(fd.read())
+        os.replace(self.file_name, f"{self.file_name}.bak")
+        with open(self.file_name, 'wb') as fd:
+            for item in data.values():
+                fd.write(self.encode_record(item))
+        with open(self.queries_name, 'w') as fd:
+            for (identifier, query) in QUERIES.queries.items():
+                fd.write(json.dumps({'id': identifier, 'query': query}))
+                fd.write('\n')
+
+    def load_queries(self):
+        if not osp.exists(self.queries_name):
+            return
+        with open(self.queries_name, 'r') as fd:
+            for line in fd:
+                if line.endswith('\n'):
+                    record = json.loads(line)
+                    QUERIES.update({record['id']: record['query']})
+                    self.saved_queries.add(record['id'])
+
+    def load_index(self):
+        if osp.exists(self.index_name) and osp.getsize(self.index_name) > 0:
+            self.index_fd = open(self.index_name, 'rb')
+            self.index_map = mmap.mmap(self.index_fd.fileno(), 0, access=mmap.ACCESS_READ)
+            header_end = self.index_map.find(b'\n')
+            header = self.index_map[:header_end]
+            if header.startswith(INDEX_HEADER):
+                self.indexed_size = int(header[len(INDEX_HEADER):])
+                self.index_start = header_end + 1
+            else:
+                LOGGER.warning("Index %s is not valid, rebuilding it.", self.index_name)
+                self.close_index()
+        if osp.exists(self.tail_name):
+            with open(self.tail_name, 'r') as fd:
+                for line in fd:
+                    if not line.endswith('\n'):
+                        break
+                    (key, offset, length) = line.rstrip('\n').split('\t')
+                    self.recent[json.loads(key)] = (int(offset), int(length))
+                    self.indexed_size = max(self.indexed_size, int(offset) + int(length))
+
+    def close_index(self):
+        if self.index_map is not None:
+            self.index_map.close()
+            self.index_fd.close()
+        self.index_map = None
+        self.index_fd = None
+        self.index_start = 0
+        self.indexed_size = 0
+
+    def recover(self):
+        """Index records written after the index (or its tail) was last updated."""
+        size = osp.getsize(self.file_name)
+        if size <= self.indexed_size:
+            return
+        LOGGER.info("Indexing %d bytes of unindexed records in %s.", size - self.indexed_size, self.file_name)
+        with open(self.file_name, 'rb') as fd:
+            fd.seek(self.indexed_size)
+            offset = self.indexed_size
+            for line in fd:
+                if not line.endswith(b'\n'):
+                    LOGGER.warning("Dropping incomplete record at the end of %s.", self.file_name)
+                    self.records.truncate(offset)
+                    break
+                key = line[:line.index(b'\t')]
+                self.note(json.loads(key), offset, len(line))
+                offset += len(line)
+        self.sync()
+
+    def lookup(self, identifier):
+        """The (offset, length) of IDENTIFIER's latest record, or None."""
+        location = self.recent.get(identifier)
+        if location is not None or self.index_map is None:
+            return location
+        key = encode_key(identifier)
+        index = self.index_map
+        (low, high) = (self.index_start, len(index))
+        while low < high:
+            middle = (low + high) // 2
+            start = max(low, index.rfind(b'\n', low, middle) + 1)
+            end = index.find(b'\n', start)
+            separator = index.find(b'\t', start, end)
+            candidate = index[start:separator]
+            if candidate == key:
+                (offset, length) = index[separator + 1:end].split(b'\t')
+                return (int(offset), int(length))
+            elif candidate < key:
+                low = end + 1
+            else:
+                high = start
+        return None
+
+    def encode_record(self, item):
+        return encode_key(item.identifier) + b'\t' + jsonpickle.encode(item).encode('utf-8') + b'\n'
+
+    def read(self, location):
+        (offset, length) = location
+        self.records.flush()
+        with open(self.file_name, 'rb') as fd:
+            fd.seek(offset)
+            line = fd.read(length)
+        item = jsonpickle.decode(line[line.index(b'\t') + 1:].decode('utf-8'))
+        return item
+
+    def note(self, identifier, offset, length):
+        self.recent[identifier] = (offset, length)
+        self.tail.write(f"{json.dumps(identifier)}\t{offset}\t{length}\n")
+
+    def write(self, item):
+        for (_, identifier) in item.search_terms:
+            if identifier not in self.saved_queries:
+                self.queries.write(json.dumps({'id': identifier, 'query': QUERIES.get(identifier)}))
+                self.queries.write('\n')
+                self.saved_queries.add(identifier)
+        record = self.encode_record(item)
+        self.records.seek(0, os.SEEK_END)
+        offset = self.records.tell()
+        self.records.write(record)
+        self.note(item.identifier, offset, len(record))
+
+    def __contains__(self, identifier):
+        return self.lookup(identifier) is not None
+
+    def add_item(self, item, source=None, query=None):
+        location = self.lookup(item.identifier)
+        if location is not None:
+            stored = self.read(location)
+        else:
+            stored = item
+        if (source != None) and (query != None):
+            before = len(stored.search_terms)
+            stored.add_search_terms(source, query)
+            changed = len(stored.search_terms) != before
+        else:
+            changed = False
+        if location is None or changed:
+            self.write(stored)
+        if self.saviness > 0:
+            self.num += 1
+            if (self.num % self.saviness) == 0:
+                self.save()
+
+    def get(self, name):
+        location = self.lookup(name)
+        if location is None:
+            return None
+        return self.read(location)
+
+    def sync(self):
+        for fd in [self.records, self.queries, self.tail]:
+            fd.flush()
+            os.fsync(fd.fileno())
+
+    def save(self):
+        LOGGER.debug("Syncing indexed results store.")
+        with METRICS.timer('qal_store_save_seconds', store='indexed'):
+            self.sync()
+
+    def checkpoint(self):
+        self.sync()
+
+    def write_index(self, entries, size):
+        """Write a sorted index of ENTRIES (identifier -> location), covering SIZE bytes of records."""
+        temporary = f"{self.index_name}.tmp"
+        with open(temporary, 'wb') as fd:
+            fd.write(INDEX_HEADER + str(size).encode('utf-8') + b'\n')
+            for (key, (offset, length)) in sorted((encode_key(identifier), location)
+                                                  for (identifier, location) in entries):
+                fd.write(key + f"\t{offset}\t{length}\n".encode('utf-8'))
+            fd.flush()
+            os.fsync(fd.fileno())
+        self.close_index()
+        os.replace(temporary, self.index_name)
+        self.tail.truncate(0)
+        self.recent = {}
+        self.load_index()
+
+    def entries(self):
+        """All (identifier, location) pairs, from the index and its tail."""
+        if self.index_map is not None:
+            index = self.index_map
+            index.seek(self.index_start)
+            for line in iter(index.readline, b''):
+                (key, offset, length) = line.rstrip(b'\n').split(b'\t')
+                identifier = json.loads(key)
+                if identifier not in self.recent:
+                    yield (identifier, (int(offset), int(length)))
+        yield from self.recent.items()
+
+    def merge_index(self):
+        """Fold the index tail into the sorted index."""
+        if len(self.recent) == 0:
+            return
+        LOGGER.debug("Merging %d identifiers into %s.", len(self.recent), self.index_name)
+        self.sync()
+        self.write_index(list(self.entries()), osp.getsize(self.file_name))
+
+    def compact(self):
+        """Rewrite the records file without superseded records."""
+        LOGGER.info("Compacting %s.", self.file_name)
+        self.sync()
+        temporary = f"{self.file_name}.tmp"
+        entries = []
+        with open(self.file_name, 'rb') as source, open(temporary, 'wb') as target:
+            for (identifier, (offset, length)) in sorted(self.entries(), key=lambda entry: entry[1][0]):
+                source.seek(offset)
+                entries.append((identifier, (target.tell(), length)))
+                target.write(source.read(length))
+            target.flush()
+            os.fsync(target.fileno())
+        self.records.close()
+        os.replace(temporary, self.file_name)
+        self.records = open(self.file_name, 'ab')
+        self.write_index(entries, osp.getsize(self.file_name))
+
+    def export(self, file_name):
+        """Write the store, in the standard format, to FILE_NAME."""
+        data = {identifier: self.get(identifier) for identifier in self}
+        with open(file_name, 'w') as fd:
+            fd.write(encode_store(data))
+
+    def close(self):
+        self.merge_index()
+        self.sync()
+        for fd in [self.records, self.queries, self.tail]:
+            fd.close()
+        self.close_index()
+
+    def __len__(self):
+        return sum(1 for _ in self.entries())
+
+    def __iter__(self):
+        return (identifier for (identifier, _) in list(self.entries()))
@@ -33,7 +33,12 @@ from argparse import ArgumentParser
 
 from . import *
 from .exceptions import *
-from .results_store import ResultsStore
+from .results_store import open_results_store, STORE_FORMATS
+from .cache import add_cache_arguments, cache_from_arguments
+from .dedup import add_dedup_arguments, dedup_from_arguments
+from .adaptive import make_controller, DEFAULT_TARGET_LATENCY
+from .profiling import phase, add_profile_arguments, profiler_from_arguments
+from .venues import load_venue_table
 
 import jsonpickle
 
@@ -53,7 +58,7 @@ def main():
     parser.add_argument('--library', '-l', metavar='DIGITAL_LIBRARY',
                         help="select which digital library is used",
                         type=str,
-                        choices=apis.keys(),
+                        choices=provider_names(),
                         dest='library')
 
     parser.add_argument('--describe', '-d',
@@ -101,6 +106,71 @@ def main():
                         dest='batches',
                         default=-1)
 
+    parser.add_argument('--store-format', metavar='FORMAT',
+                        help="how the results file is kept (json rewrites it on every save, journal appends changes, sqlite uses a database, indexed loads records lazily)",
+                        type=str,
+                        choices=STORE_FORMATS.keys(),
+                        dest='store_format',
+                        default='json')
+
+    add_cache_arguments(parser)
+    add_dedup_arguments(parser)
+    add_profile_arguments(parser)
+
+    parser.add_argument('--prefetch', metavar='N',
+                        help="request up to N following pages while a page is processed",
+                        type=int,
+                        dest='prefetch',
+                        default=0)
+
+    parser.add_argument('--adaptive-page-size',
+                        help="adjust the page size to the provider's latency and errors, up to its maximum",
+                        dest='adaptive_page_size',
+                        action='store_true',
+                        default=False)
+
+    parser.add_argument('--target-latency', metavar='SECONDS',
+                        help="with --adaptive-page-size, shrink pages which take longer than this",
+                        type=float,
+                        dest='target_latency',
+                        default=DEFAULT_TARGET_LATENCY)
+
+    parser.add_argument('--parallel-pages', metavar='N',
+                        help="once the number of results is known, fetch N pages at a time",
+                        type=int,
+                        dest='parallel_pages',
+                        default=1)
+
+    parser.add_argument('--venue-table', metavar='TABLE.JSON',
+                        help="map venue names to canonical names using TABLE.JSON",
+                        type=str,
+                        dest='venue_table')
+
+    parser.add_argument('--pool-size', metavar='N',
+                        help="number of pooled connections to keep open",
+                        type=int,
+                        dest='pool_size')
+
+    parser.add_argument('--connect-timeout', metavar='SECONDS',
+                        help="timeout for establishing a connection",
+                        type=float,
+                        dest='connect_timeout')
+
+    parser.add_argument('--read-timeout', metavar='SECONDS',
+                        help="timeout for reading a response",
+                        type=float,
+                        dest='read_timeout')
+
+    parser.add_argument('--rate-limit', metavar='N',
+                        help="maximum requests per second made with this key",
+                        type=float,
+                        dest='rate_limit')
+
+    parser.add_argument('--daily-limit', metavar='N',
+                        help="maximum requests per day made with this key",
+                        type=int,
+                        dest='daily_limit')
+
     parser.add_argument('--verbose', '-v',
                         help="provide verbose logging",
                         default=0,
@@ -111,11 +181,13 @@ def main():
 
     logging.getLogger('qal').setLevel((6 - args.verbose)*10)
 
+    if args.offline and args.cache is None:
+        parser.error("--offline requires a response cache (--cache).")
+
     if args.list_libraries:
         print("Known Libraries:")
-        for key in apis.keys():
-            api = make_api(key, 'x')
-            print(f" - {key}: {api.describe()}")
+        for key in provider_names():
+            print(f" - {key}: {get_provider(key).describe()}")
         sys.exit(0)
 
     if args.library is None:
@@ -134,31 +206,71 @@ def main():
     if not args.output:
         parser.error("A results storage file must be provided.")
 
-    api = make_api(args.library, key)
-    api.start = args.start
-    api.page_size = args.page_size
-
-    if args.options:
-        for option in args.options:
-            (key, value) = option.split('=', 1)
-            api.set_option(key, value)
-
-    query = {}
-    for query_item in args.query:
-        (key, value) = query_item.split('=', 1)
-        query[key] = value
-        api.set_query_option(key, value)
-
-    results_store = ResultsStore(args.output, saviness=1)
+    profiler = profiler_from_arguments(args)
+
+    with phase('plan'):
+        if args.venue_table:
+            load_venue_table(args.venue_table)
+
+        api = make_api(args.library, key)
+        api.start = args.start
+        api.page_size = args.page_size
+        api.set_connection_options(pool_size=args.pool_size,
+                                   connect_timeout=args.connect_timeout,
+                                   read_timeout=args.read_timeout)
+        api.set_rate_limit(per_second=args.rate_limit,
+                           per_day=args.daily_limit)
+        api.set_prefetch(args.prefetch)
+        if args.adaptive_page_size:
+            api.set_adaptive(make_controller(api, {'target_latency': args.target_latency}))
+        cache = cache_from_arguments(args)
+        if cache is not None:
+            api.set_cache(cache)
+
+        if args.options:
+            for option in args.options:
+                (key, value) = option.split('=', 1)
+                api.set_option(key, value)
+
+        query = {}
+        for query_item in args.query:
+            (key, value) = query_item.split('=', 1)
+            query[key] = value
+            api.set_query_option(key, value)
+
+    # SQLite and indexed stores sync once per page, when checkpointed.
+    saviness = 0 if args.store_format in ('sqlite', 'indexed') else 1
+    with phase('store_load'):
+        results_store = open_results_store(args.output, saviness=saviness, store_format=args.store_format)
+        results_store = dedup_from_arguments(results_store, args)
 
     def do_batch():
-        for result in api.batch():
+        if args.parallel_pages > 1:
+            batch = api.batch_pages(args.parallel_pages)
+        else:
+            batch = api.batch()
+        for result in batch:
             print("Processing {result.identifier}")
-            results_store.add_item(result, args.library, query)
-
-    if args.batches > 0:
-        for i in range(args.batches):
-            do_batch()
-    else:
-        while api.has_results():
-            do_batch()
+            with phase('store'):
+                results_store.add_item(result, args.library, query)
+        with phase('store'):
+            results_store.checkpoint()
+
+    try:
+        if args.batches > 0:
+            for i in range(args.batches):
+                do_batch()
+        else:
+            while api.has_results():
+                do_batch()
+        if not api.has_results() and api.abandoned_pages:
+            LOGGER.error("Gave up on the pages at %s.", ', '.join(str(offset) for (offset, _) in api.abandoned_pages))
+        if api.complete() and hasattr(results_store, 'compact'):
+            results_store.compact()
+    finally:
+        # Imported here, so that listing and describing libraries does not import any provider.
+        from .digital_library import shutdown_prefetch
+        shutdown_prefetch()
+        results_store.close()
+        if profiler is not None:
+            profiler.stop()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import sys
+import json
+import time
+import bisect
+import logging
+import threading
+
+from contextlib import contextmanager
+
+LOGGER = logging.getLogger('qal.metrics')
+
+# Upper bounds (seconds) of latency histogram buckets.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_FORMATS = ['prometheus', 'json']
+
+HELP = {'qal_request_seconds': "Time taken by provider HTTP requests.",
+        'qal_decode_seconds': "Time taken to decode provider responses.",
+        'qal_process_seconds': "Time taken by process_results.",
+        'qal_store_save_seconds': "Time taken to save (or sync) the results store.",
+        'qal_store_checkpoint_seconds': "Time taken to checkpoint the results store after a page.",
+        'qal_status_write_seconds': "Time taken to write the status file.",
+        'qal_requests_total': "Provider HTTP requests made, by response status.",
+        'qal_retries_total': "Provider requests retried, by reason.",
+        'qal_errors_total': "Provider requests given up on.",
+        'qal_cache_hits_total': "Provider requests answered from the response cache.",
+        'qal_records_total': "Publications returned by process_results."}
+
+
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def asdict(self):
+        return {'value': self.value}
+
+
+class Histogram:
+    """Counts of observations in cumulative buckets with upper bounds BUCKETS."""
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, fraction):
+        """Estimate the FRACTION quantile, interpolating within its bucket."""
+        if self.count == 0:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for (i, count) in enumerate(self.counts):
+            if seen + count >= rank and count > 0:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def asdict(self):
+        return {'count': self.count,
+                'sum': self.sum,
+                'buckets': dict(zip([str(bound) for bound in self.buckets] + ['+Inf'], self.cumulative())),
+                'p50': self.quantile(0.5),
+                'p99': self.quantile(0.99)}
+
+    def cumulative(self):
+        total = 0
+        cumulative = []
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+
+class MetricsRegistry:
+    """Counters and histograms, by name and labels, shared by every thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.started = time.time()
+
+    def get(self, kind, name, labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.setdefault(key, kind())
+        return metric
+
+    def inc(self, name, amount=1, **labels):
+        metric = self.get(Counter, name, labels)
+        with self.lock:
+            metric.inc(amount)
+
+    def observe(self, name, value, **labels):
+        metric = self.get(Histogram, name, labels)
+        with self.lock:
+            metric.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the time taken by the body of a with statement in histogram NAME."""
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - began, **labels)
+
+    def reset(self):
+        with self.lock:
+            self.metrics = {}
+            self.started = time.time()
+
+    def snapshot(self):
+        """Sorted (name, labels, values, kind) tuples of every metric."""
+        with self.lock:
+            return [(name, dict(labels), metric.asdict(), type(metric).__name__.lower())
+                    for ((name, labels), metric) in sorted(self.metrics.items())]
+
+    def to_json(self):
+        elapsed = time.time() - self.started
+        return json.dumps({'time': time.time(),
+                           'elapsed': elapsed,
+                           'metrics': [{'name': name, 'labels': labels, 'type': kind, **values}
+                                       for (name, labels, values, kind) in self.snapshot()]},
+                          indent=2)
+
+    def to_prometheus(self):
+        """The metrics in the Prometheus text exposition format."""
+        lines = []
+        described = set()
+        for (name, labels, values, kind) in self.snapshot():
+            if name not in described:
+                if name in HELP:
+                    lines.append(f"# HELP {name} {HELP[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+                described.add(name)
+            if kind == 'counter':
+                lines.append(f"{name}{format_labels(labels)} {values['value']}")
+            else:
+                for (bound, count) in values['buckets'].items():
+                    lines.append(f"{name}_bucket{format_labels(dict(labels, le=bound))} {count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {values['sum']}")
+                lines.append(f"{name}_count{format_labels(labels)} {values['count']}")
+        lines.append("# TYPE qal_run_start_time_seconds gauge")
+        lines.append(f"qal_run_start_time_seconds {self.started}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, file_name, metrics_format='prometheus'):
+        """Write the metrics to FILE_NAME (atomically, for textfile collectors)."""
+        text = self.to_prometheus() if metrics_format == 'prometheus' else self.to_json()
+        temporary = f"{file_name}.tmp"
+        with open(temporary, 'w') as fd:
+            fd.write(text)
+        os.replace(temporary, file_name)
+
+    def summary(self):
+        """A human-readable summary of the run so far."""
+        elapsed = max(time.time() - self.started, 1e-9)
+        snapshot = self.snapshot()
+        lines = [f"Run time: {elapsed:.1f} s"]
+        records = {labels.get('provider'): values['value'] for (name, labels, values, _) in snapshot
+                   if name == 'qal_records_total'}
+        for (provider, count) in sorted(records.items()):
+            lines.append(f"  {provider}: {count} records ({count / elapsed:.1f}/s)")
+        for (name, labels, values, kind) in snapshot:
+            if kind == 'counter':
+                if name != 'qal_records_total':
+                    lines.append(f"  {name}{format_labels(labels)}: {values['value']}")
+            elif values['count'] > 0:
+                lines.append(f"  {name}{format_labels(labels)}: {values['count']} in {values['sum']:.2f} s, "
+                             f"p50 {values['p50'] * 1000:.1f} ms, p99 {values['p99'] * 1000:.1f} ms")
+        return '\n'.join(lines)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for (name, value) in zip(labels.keys(), escaped)) + '}'
+
+
+METRICS = MetricsRegistry()
+
+
+class MetricsExporter:
+    """Write METRICS to FILE_NAME every INTERVAL seconds, from a background thread."""
+
+    def __init__(self, file_name, metrics_format='prometheus', interval=15.0, registry=METRICS):
+        self.file_name = file_name
+        self.metrics_format = metrics_format
+        self.interval = interval
+        self.registry = registry
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='qal-metrics', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.export()
+
+    def export(self):
+        try:
+            self.registry.write(self.file_name, self.metrics_format)
+        except OSError as error:
+            LOGGER.warning("Could not write metrics to %s: %s.", self.file_name, error)
+
+    def stop(self):
+        """Stop exporting, after writing the metrics one last time."""
+        self.stopping.set()
+        self.thread.join()
+        self.export()
+
+
+def add_metrics_arguments(parser):
+    """Add the metrics options to an argument PARSER."""
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="periodically write metrics to FILE",
+                        type=str,
+                        dest='metrics')
+
+    parser.add_argument('--metrics-format', metavar='FORMAT',
+                        help="format of the metrics file (prometheus textfile or json)",
+                        type=str,
+                        choices=METRIC_FORMATS,
+                        dest='metrics_format',
+                        default='prometheus')
+
+    parser.add_argument('--metrics-interval', metavar='SECONDS',
+                        help="how often the metrics file is written",
+                        type=float,
+                        dest='metrics_interval',
+                        default=15.0)
+
+
+def exporter_from_arguments(args):
+    """A started MetricsExporter described by parsed ARGS, or None."""
+    if args.metrics is None:
+        return None
+    return MetricsExporter(args.metrics, args.metrics_format, args.metrics_interval).start()
+
+
+def print_summary(file=sys.stderr):
+    print(METRICS.summary(), file=file)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import logging
+
+from . import make_api, get_env_var
+
+LOGGER = logging.getLogger('qal.plan')
+
+
+def make_api_object(site, cache=None):
+    """Build the API object for the plan's SITE, using the response CACHE if given."""
+    name = site['name']
+    api = make_api(name, get_env_var(site['name'], site.get('key')))
+    if 'endpoint' in site.keys():
+        api.api_endpoint = site['endpoint']
+    if 'start' in site.keys():
+        api.start = site['start']
+    if 'page_size' in site.keys():
+        api.page_size = site['page_size']
+    if 'options' in site.keys():
+        api.set_options(site['options'])
+    api.set_connection_options(pool_size=site.get('pool_size'),
+                               connect_timeout=site.get('connect_timeout'),
+                               read_timeout=site.get('read_timeout'))
+    if 'prefetch' in site.keys():
+        api.set_prefetch(site['prefetch'])
+    if cache is not None:
+        api.set_cache(cache)
+    if 'rate_limit' in site.keys():
+        api.set_rate_limit(per_second=site['rate_limit'].get('per_second'),
+                           per_day=site['rate_limit'].get('per_day'))
+    return api
+
+
+def canonical_value(value):
+    """VALUE with runs of whitespace collapsed (for strings)."""
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    return value
+
+
+def canonical_query(api, query):
+    """QUERY (symbolic option names to values) as API's request parameters, as a string.
+
+    Options which are not request parameters (or are unknown) are kept
+    under their symbolic names, prefixed by "@".
+    """
+    parameters = {}
+    for (name, value) in query.items():
+        information = api.query_option_information.get(name)
+        if information and information[0]:
+            parameters[information[2]] = canonical_value(value)
+        else:
+            parameters[f"@{name}"] = canonical_value(value)
+    return json.dumps(parameters, sort_keys=True)
+
+
+class CompiledPlan:
+    """A plan whose queries are merged, per site, when they make the same request.
+
+    For each site, the queries of PLAN are canonicalized (mapped to the
+    provider's request parameters, ignoring key order and whitespace),
+    and queries with the same canonical form are grouped under the
+    first of them, its representative.  Only representatives are run;
+    their results are attributed to every query of their group.
+    """
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.groups = {}
+        self.representatives = {}
+        for (site_id, site) in enumerate(plan['sites']):
+            api = make_api(site['name'], None)
+            seen = {}
+            for (query_id, query) in enumerate(plan['queries']):
+                key = canonical_query(api, query) if api is not None else json.dumps(query, sort_keys=True)
+                representative = seen.setdefault(key, query_id)
+                self.representatives[(site_id, query_id)] = representative
+                self.groups.setdefault((site_id, representative), []).append(query_id)
+        merged = len(self.representatives) - len(self.groups)
+        if merged > 0:
+            LOGGER.info("Merged %d site/query pairs making the same requests.", merged)
+
+    def representative(self, site_id, query_id):
+        """The query run in place of QUERY_ID for SITE_ID."""
+        return self.representatives[(site_id, query_id)]
+
+    def is_representative(self, site_id, query_id):
+        return self.representatives[(site_id, query_id)] == query_id
+
+    def members(self, site_id, query_id):
+        """The queries of the group QUERY_ID represents for SITE_ID (itself included)."""
+        return self.groups.get((site_id, query_id), [])
+
+    def queries(self, site_id, query_id):
+        """The query dictionaries of the group QUERY_ID represents for SITE_ID."""
+        return [self.plan['queries'][member] for member in self.members(site_id, query_id)]
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import time
+import logging
+
+from math import ceil
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+from .plan import CompiledPlan, make_api_object
+from .status import StatusLog, seed_status
+from .cache import add_cache_arguments, cache_from_arguments
+
+LOGGER = logging.getLogger('qal.probe')
+
+DAY = 24 * 60 * 60
+
+
+def probe_pair(api):
+    """Probe API (set up for a query), returning its total and how long the request took."""
+    started = time.monotonic()
+    total = api.probe()
+    return (total, time.monotonic() - started)
+
+
+def probe_plan(compiled, status=None, cache=None, threads=8):
+    """Find the number of results of every pair run by the CompiledPlan COMPILED.
+
+    Pairs STATUS shows were started (or finished) are skipped.  Pairs are
+    probed on up to THREADS threads, as each provider's rate limit
+    allows.  Returns a dictionary from (site, query) to a dictionary of
+    the pair's total (None if the probe failed), the probe's duration,
+    and the pair's start and page size.
+    """
+    plan = compiled.plan
+    apis = {}
+    for (site_id, site) in enumerate(plan['sites']):
+        if not site['enabled']:
+            continue
+        for query_id in range(len(plan['queries'])):
+            if not compiled.is_representative(site_id, query_id):
+                continue
+            if status is not None and (len(status['statuses'][site_id][query_id].keys()) != 0
+                                       or not status['has_results'][site_id][query_id]):
+                continue
+            api = make_api_object(site, cache)
+            api.set_query_options(plan['queries'][query_id])
+            apis[(site_id, query_id)] = api
+
+    def probe(pair):
+        try:
+            return probe_pair(apis[pair])
+        except Exception as error:
+            LOGGER.error("Probing site %d, query %d failed: %s.", pair[0], pair[1], error)
+            return (None, None)
+
+    LOGGER.info("Probing %d pairs.", len(apis))
+    probes = {}
+    with ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix='qal-probe') as pool:
+        for (pair, (total, seconds)) in zip(apis.keys(), pool.map(probe, apis.keys())):
+            probes[pair] = {'total': total,
+                            'seconds': seconds,
+                            'start': apis[pair].start,
+                            'page_size': apis[pair].page_size,
+                            'per_second': apis[pair].requests_per_second,
+                            'per_day': apis[pair].requests_per_day}
+    return probes
+
+
+def fill_status(status, compiled, probes):
+    """Enter the totals of PROBES in STATUS, as if each pair had been started, but not fetched."""
+    for ((site_id, query_id), probe) in probes.items():
+        if probe['total'] is None:
+            continue
+        for member in compiled.members(site_id, query_id):
+            if len(status['statuses'][site_id][member].keys()) != 0:
+                continue
+            status['statuses'][site_id][member] = {'total': probe['total'],
+                                                   'start': probe['start'],
+                                                   'page_size': probe['page_size'],
+                                                   'failed_pages': [],
+                                                   'abandoned_pages': [],
+                                                   'page_attempts': {}}
+            status['batches'][site_id][member] = ceil(probe['total'] / probe['page_size'])
+            if probe['total'] == 0 and status['has_results'][site_id][member]:
+                status['has_results'][site_id][member] = False
+                status['incomplete'] -= 1
+    status['max_batches'] = max(map(max, status['batches']))
+
+
+def estimate(compiled, probes):
+    """Estimate, for each site, the number of results and requests of PROBES, and how long they take.
+
+    Requests are paced by the site's rate limits, and are expected to
+    take as long as the probes did, with as many at a time as the site's
+    concurrency and parallel pages allow.
+    """
+    sites = {}
+    for ((site_id, query_id), probe) in probes.items():
+        site = compiled.plan['sites'][site_id]
+        row = sites.setdefault(site_id, {'name': site['name'], 'pairs': 0, 'failed': 0,
+                                         'results': 0, 'requests': 0, 'seconds': [],
+                                         'per_second': probe['per_second'], 'per_day': probe['per_day'],
+                                         'concurrency': site.get('concurrency', 1) * site.get('parallel_pages', 1)})
+        row['pairs'] += 1
+        if probe['total'] is None:
+            row['failed'] += 1
+            continue
+        row['results'] += probe['total']
+        row['requests'] += ceil(probe['total'] / probe['page_size'])
+        row['seconds'].append(probe['seconds'])
+    for row in sites.values():
+        latency = sum(row['seconds']) / len(row['seconds']) if len(row['seconds']) > 0 else 0
+        time_needed = row['requests'] * latency / max(1, row['concurrency'])
+        if row['per_second']:
+            time_needed = max(time_needed, row['requests'] / row['per_second'])
+        if row['per_day'] and row['requests'] > row['per_day']:
+            time_needed += (ceil(row['requests'] / row['per_day']) - 1) * DAY
+        row['time'] = time_needed
+    return [sites[site_id] for site_id in sorted(sites.keys())]
+
+
+def format_duration(seconds):
+    seconds = int(ceil(seconds))
+    (days, seconds) = divmod(seconds, DAY)
+    (hours, seconds) = divmod(seconds, 3600)
+    (minutes, seconds) = divmod(seconds, 60)
+    duration = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+    if days > 0:
+        duration = f"{days}d {duration}"
+    return duration
+
+
+def format_estimate(rows, workers=None):
+    """A table of the site estimates ROWS, with their total (sites running on WORKERS lanes)."""
+    lines = [f"{'Site':<20} {'Pairs':>7} {'Results':>12} {'Requests':>10} {'Time':>14}"]
+    for row in rows:
+        pairs = f"{row['pairs']}" if row['failed'] == 0 else f"{row['pairs']}*"
+        lines.append(f"{row['name']:<20} {pairs:>7} {row['results']:>12} {row['requests']:>10} {format_duration(row['time']):>14}")
+    times = [row['time'] for row in rows]
+    if workers is None or workers < 1:
+        workers = len(rows)
+    # Sites run at the same time, on up to WORKERS lanes.
+    total_time = max(max(times, default=0), sum(times) / max(1, workers))
+    lines.append(f"{'Total':<20} {sum(row['pairs'] for row in rows):>7} {sum(row['results'] for row in rows):>12} "
+                 f"{sum(row['requests'] for row in rows):>10} {format_duration(total_time):>14}")
+    if any(row['failed'] > 0 for row in rows):
+        lines.append("* Some pairs could not be probed, and are not counted.")
+    return '\n'.join(lines)
+
+
+def add_probe_arguments(parser):
+    """Add the probing options to an argument PARSER."""
+    parser.add_argument('--probe-threads', metavar='N',
+                        help="how many pairs to probe at a time (default 8)",
+                        type=int,
+                        dest='probe_threads',
+                        default=8)
+
+
+def main():
+    parser = ArgumentParser(
+        description="Find the number of results of each query of a plan, and estimate how long running it takes.")
+
+    parser.add_argument('--verbose', '-v',
+                        help="provide verbose logging",
+                        default=0,
+                        action='count',
+                        dest='verbose')
+
+    parser.add_argument('--plan-file', '-p', metavar="PLAN",
+                        type=str,
+                        required=True,
+                        dest='plan_file')
+
+    parser.add_argument('--status-file', '-s', metavar="STATUS",
+                        help="enter the totals in the qal-auto status file STATUS (creating it if needed)",
+                        type=str,
+                        dest='status_file')
+
+    add_probe_arguments(parser)
+    add_cache_arguments(parser)
+
+    args = parser.parse_args()
+
+    logging.getLogger('qal').setLevel((6 - args.verbose)*10)
+
+    if args.offline and args.cache is None:
+        parser.error("--offline requires a response cache (--cache).")
+
+    with open(args.plan_file, 'r') as fd:
+        plan = json.load(fd)
+    for query in plan['queries']:
+        query.pop('priority', None)
+    compiled = CompiledPlan(plan)
+
+    status = None
+    log = None
+    if args.status_file is not None:
+        log = StatusLog(args.status_file)
+        status = log.load()
+        if len(status.keys()) == 0:
+            status = seed_status(plan)
+
+    probes = probe_plan(compiled, status, cache_from_arguments(args), args.probe_threads)
+    print(format_estimate(estimate(compiled, probes), plan.get('workers')))
+
+    if log is not None:
+        fill_status(status, compiled, probes)
+        log.snapshot(status)
+        log.close()
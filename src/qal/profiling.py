@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import functools
+import os.path as osp
+
+from contextlib import contextmanager
+
+LOGGER = logging.getLogger('qal.profiling')
+
+PROFILE_MODES = ['cprofile', 'sample']
+
+# The phases code is attributed to, outside of any other phase.
+OTHER = 'other'
+
+_profiler = None
+
+
+class Profiler:
+    """Profile a run by phase (plan load, store load, fetch, parse, store, status write).
+
+    In cprofile mode, each thread's time in each phase is profiled
+    deterministically with cProfile, and written to DIRECTORY as one
+    pstats file per phase, plus a collapsed-stack file of each phase's
+    functions' own time (in microseconds).  Only threads entering a
+    phase are profiled, the main thread from the start.
+
+    In sample mode, the stacks of every thread are sampled every
+    INTERVAL seconds and written to DIRECTORY/profile.collapsed, each
+    stack prefixed by its thread's phase.  Its overhead is low enough
+    to leave on.
+
+    Collapsed-stack files can be read by flamegraph.pl, speedscope
+    and similar tools.  In both modes, DIRECTORY/phases.json gives the
+    time spent in each phase, summed over threads.
+    """
+
+    def __init__(self, directory, mode='cprofile', interval=0.005):
+        self.directory = directory
+        self.mode = mode
+        self.interval = interval
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.profiles = {}
+        self.phases = {}
+        self.seconds = {}
+        self.samples = {}
+        self.stopping = threading.Event()
+        self.sampler = None
+        self.warned = False
+
+    def stack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def profile(self, name):
+        key = (threading.get_ident(), name)
+        profile = self.profiles.get(key)
+        if profile is None:
+            with self.lock:
+                profile = self.profiles.setdefault(key, cProfile.Profile())
+        return profile
+
+    def resume(self, name):
+        self.phases[threading.get_ident()] = name
+        self.local.began = time.perf_counter()
+        if self.mode == 'cprofile':
+            try:
+                self.profile(name).enable()
+            except ValueError as error:
+                # Newer Pythons allow only one active profiler at a time.
+                if not self.warned:
+                    LOGGER.warning("Cannot profile phase %s in this thread (%s), use sample mode.", name, error)
+                    self.warned = True
+
+    def pause(self, name):
+        elapsed = time.perf_counter() - self.local.began
+        with self.lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + elapsed
+        if self.mode == 'cprofile':
+            self.profile(name).disable()
+        self.phases.pop(threading.get_ident(), None)
+
+    @contextmanager
+    def phase(self, name):
+        """Attribute the body of a with statement, in this thread, to phase NAME."""
+        stack = self.stack()
+        if stack:
+            self.pause(stack[-1])
+        stack.append(name)
+        self.resume(name)
+        try:
+            yield
+        finally:
+            self.pause(name)
+            stack.pop()
+            if stack:
+                self.resume(stack[-1])
+
+    def sample(self):
+        own = threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            for (thread, frame) in sys._current_frames().items():
+                if thread == own:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f"{osp.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}")
+                    frame = frame.f_back
+                names.append(self.phases.get(thread, OTHER))
+                key = ';'.join(reversed(names))
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+    def start(self):
+        global _profiler
+        os.makedirs(self.directory, exist_ok=True)
+        _profiler = self
+        if self.mode == 'sample':
+            self.sampler = threading.Thread(target=self.sample, name='qal-profiler', daemon=True)
+            self.sampler.start()
+        self.stack().append(OTHER)
+        self.resume(OTHER)
+        return self
+
+    def stop(self):
+        """Stop profiling, and write the profiles."""
+        global _profiler
+        stack = self.stack()
+        while stack:
+            self.pause(stack.pop())
+        _profiler = None
+        if self.sampler is not None:
+            self.stopping.set()
+            self.sampler.join()
+        self.write()
+
+    def write(self):
+        with open(osp.join(self.directory, 'phases.json'), 'w') as fd:
+            json.dump(self.seconds, fd, indent=2)
+        collapsed = osp.join(self.directory, 'profile.collapsed')
+        if self.mode == 'sample':
+            with open(collapsed, 'w') as fd:
+                for (stack, count) in sorted(self.samples.items()):
+                    fd.write(f"{stack} {count}\n")
+            LOGGER.info("Wrote %d samples to %s.", sum(self.samples.values()), collapsed)
+            return
+        by_phase = {}
+        for ((_, name), profile) in self.profiles.items():
+            profile.create_stats()
+            if not profile.stats:
+                continue
+            if name in by_phase:
+                by_phase[name].add(profile)
+            else:
+                by_phase[name] = pstats.Stats(profile)
+        with open(collapsed, 'w') as fd:
+            for (name, stats) in sorted(by_phase.items()):
+                stats.dump_stats(osp.join(self.directory, f"{name}.pstats"))
+                for ((file_name, line, function), (_, _, tottime, _, _)) in sorted(stats.stats.items()):
+                    microseconds = int(tottime * 1e6)
+                    if microseconds > 0:
+                        fd.write(f"{name};{osp.basename(file_name)}:{function} {microseconds}\n")
+        LOGGER.info("Wrote profiles of %s to %s.", ', '.join(sorted(by_phase)), self.directory)
+
+
+@contextmanager
+def phase(name):
+    """Attribute the body of a with statement to phase NAME, when profiling."""
+    profiler = _profiler
+    if profiler is None:
+        yield
+    else:
+        with profiler.phase(name):
+            yield
+
+
+def in_phase(name):
+    """Decorate a function to run in phase NAME (see phase)."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return function(*args, **kwargs)
+            with _profiler.phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_profile_arguments(parser):
+    """Add the profiling options to an argument PARSER."""
+    parser.add_argument('--profile', metavar='DIRECTORY',
+                        help="profile the run by phase, writing profiles to DIRECTORY",
+                        type=str,
+                        dest='profile')
+
+    parser.add_argument('--profile-mode', metavar='MODE',
+                        help="cprofile (deterministic, per phase) or sample (low overhead)",
+                        type=str,
+                        choices=PROFILE_MODES,
+                        dest='profile_mode',
+                        default='cprofile')
+
+    parser.add_argument('--profile-interval', metavar='SECONDS',
+                        help="time between samples in sample mode",
+                        type=float,
+                        dest='profile_interval',
+                        default=0.005)
+
+
+def profiler_from_arguments(args):
+    """A started Profiler described by parsed ARGS, or None."""
+    if args.profile is None:
+        return None
+    return Profiler(args.profile, args.profile_mode, args.profile_interval).start()
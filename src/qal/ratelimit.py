@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import os.path as osp
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+LOGGER = logging.getLogger('qal.ratelimit')
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+DEFAULT_RETRY_AFTER = 60
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def default_state_directory():
+    """Directory holding shared bucket state, from QAL_RATE_LIMIT_DIR or the user cache directory."""
+    directory = os.environ.get('QAL_RATE_LIMIT_DIR')
+    if directory:
+        return directory
+    return osp.join(os.environ.get('XDG_CACHE_HOME', osp.expanduser('~/.cache')), 'qal', 'rate-limits')
+
+
+def parse_retry_after(value, now):
+    """Parse a Retry-After header (delta seconds or an HTTP date) into an absolute time."""
+    try:
+        return now + float(value)
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_reset(value, now):
+    """Parse an X-RateLimit-Reset header, either an epoch time or delta seconds."""
+    try:
+        reset = float(value)
+    except ValueError:
+        return None
+    if reset > 1e12:
+        # Milliseconds since the epoch
+        return reset / 1000
+    if reset > 1e9:
+        return reset
+    return now + reset
+
+
+class TokenBucket:
+    """A token bucket allowing PER_SECOND requests per second and PER_DAY requests per (UTC) day.
+
+    Up to BURST tokens (by default, one second's worth) may be saved
+    up.  Limits of None are not enforced.  When STATE_FILE is given,
+    the bucket's state lives in that file and is updated under an
+    exclusive lock, so several processes using the same API key share
+    one bucket.  Otherwise state is kept in memory.
+    """
+
+    def __init__(self, name, per_second=None, per_day=None, burst=None, state_file=None):
+        self.name = name
+        self.per_second = per_second
+        self.per_day = per_day
+        self.burst = burst
+        self.state_file = state_file
+        self.lock = threading.Lock()
+        self.state = None
+
+    def configure(self, per_second=None, per_day=None, burst=None):
+        """Change the limits enforced by this bucket; None leaves a limit unchanged."""
+        if per_second is not None:
+            self.per_second = per_second
+        if per_day is not None:
+            self.per_day = per_day
+        if burst is not None:
+            self.burst = burst
+
+    def capacity(self):
+        if self.burst is not None:
+            return self.burst
+        return max(1.0, self.per_second or 1.0)
+
+    def fresh_state(self, now):
+        return {'tokens': self.capacity(),
+                'updated': now,
+                'day': int(now // SECONDS_PER_DAY),
+                'day_count': 0,
+                'blocked_until': 0,
+                'remaining': None,
+                'reset': None}
+
+    @contextmanager
+    def locked_state(self):
+        """Hold the bucket's lock(s), yielding its state; changes are saved on exit."""
+        with self.lock:
+            now = time.time()
+            if self.state_file is None or fcntl is None:
+                if self.state is None:
+                    self.state = self.fresh_state(now)
+                yield self.state
+                return
+            with open(f"{self.state_file}.lock", 'a') as lock_fd:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX)
+                try:
+                    state = None
+                    if osp.exists(self.state_file):
+                        try:
+                            with open(self.state_file, 'r') as fd:
+                                state = json.load(fd)
+                        except ValueError:
+                            LOGGER.warning("Rate limit state %s is corrupt, resetting it.", self.state_file)
+                    if state is None:
+                        state = self.fresh_state(now)
+                    yield state
+                    temporary = f"{self.state_file}.tmp"
+                    with open(temporary, 'w') as fd:
+                        json.dump(state, fd)
+                    os.replace(temporary, self.state_file)
+                finally:
+                    fcntl.flock(lock_fd, fcntl.LOCK_UN)
+
+    def refill(self, state, now):
+        if self.per_second is not None:
+            elapsed = max(0.0, now - state['updated'])
+            state['tokens'] = min(self.capacity(), state['tokens'] + elapsed * self.per_second)
+        state['updated'] = now
+        day = int(now // SECONDS_PER_DAY)
+        if day != state['day']:
+            state['day'] = day
+            state['day_count'] = 0
+
+    def wait_time(self, state, now):
+        """How long until a request may be made, or 0 to make it now."""
+        if state['blocked_until'] > now:
+            return state['blocked_until'] - now
+        if state['remaining'] is not None and state['remaining'] <= 0 and state['reset'] and state['reset'] > now:
+            return state['reset'] - now
+        if self.per_day is not None and state['day_count'] >= self.per_day:
+            return (state['day'] + 1) * SECONDS_PER_DAY - now
+        if self.per_second is not None and state['tokens'] < 1:
+            return (1 - state['tokens']) / self.per_second
+        return 0
+
+    def acquire(self):
+        """Wait until a request may be made, and take a token for it."""
+        while True:
+            with self.locked_state() as state:
+                now = time.time()
+                self.refill(state, now)
+                wait = self.wait_time(state, now)
+                if wait <= 0:
+                    if self.per_second is not None:
+                        state['tokens'] -= 1
+                    state['day_count'] += 1
+                    if state['remaining'] is not None:
+                        state['remaining'] -= 1
+                    return
+            if wait > 60:
+                LOGGER.warning("Rate limit for %s reached, waiting %0.0f seconds.", self.name, wait)
+            else:
+                LOGGER.debug("Rate limiting %s for %0.2f seconds.", self.name, wait)
+            time.sleep(wait)
+
+    def defer(self, seconds=DEFAULT_RETRY_AFTER):
+        """Block requests for SECONDS, unless the provider has already said when to resume."""
+        with self.locked_state() as state:
+            now = time.time()
+            if state['blocked_until'] <= now:
+                state['blocked_until'] = now + seconds
+
+    def update(self, headers, status_code=None):
+        """Update the bucket from a response's Retry-After and X-RateLimit-* headers."""
+        with self.locked_state() as state:
+            now = time.time()
+            retry_after = headers.get('Retry-After')
+            if retry_after is not None:
+                until = parse_retry_after(retry_after, now)
+                if until is not None:
+                    state['blocked_until'] = max(state['blocked_until'], until)
+            remaining = headers.get('X-RateLimit-Remaining')
+            if remaining is not None:
+                try:
+                    state['remaining'] = int(remaining)
+                except ValueError:
+                    pass
+            reset = headers.get('X-RateLimit-Reset')
+            if reset is not None:
+                state['reset'] = parse_reset(reset, now)
+            if status_code == 429 and state['blocked_until'] <= now:
+                if state['reset'] and state['reset'] > now:
+                    state['blocked_until'] = state['reset']
+                else:
+                    state['blocked_until'] = now + DEFAULT_RETRY_AFTER
+
+
+def get_limiter(name, api_key, per_second=None, per_day=None, directory=None):
+    """Get the token bucket shared by every user of API_KEY with provider NAME.
+
+    The bucket's state is shared with other processes through a file in
+    DIRECTORY (by default, see default_state_directory).  If that
+    directory cannot be used, the bucket is only shared in-process.
+    """
+    digest = hashlib.sha256(str(api_key).encode('utf-8')).hexdigest()[:16]
+    key = (name, digest)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            state_file = None
+            if directory is None:
+                directory = default_state_directory()
+            try:
+                os.makedirs(directory, exist_ok=True)
+                state_file = osp.join(directory, f"{name}-{digest}.json")
+            except OSError as error:
+                LOGGER.warning("Cannot share rate limits through %s (%s), limiting in-process only.", directory, error)
+            limiter = TokenBucket(name, per_second, per_day, state_file=state_file)
+            _limiters[key] = limiter
+        else:
+            limiter.configure(per_second, per_day)
+        return limiter
@@ -28,27 +28,38 @@ import os.path as osp
 import os
 import logging
 
+from .sqlite_store import SQLiteResultsStore
+from .indexed_store import IndexedResultsStore
+from .serialization import encode_store, decode_store
+from .types import QUERIES
+from .metrics import METRICS
+
 LOGGER = logging.getLogger('qal.results_store')
 
 class ResultsStore:
+    store_format = 'json'
+
     def __init__(self, file_name, saviness=0):
         self.file_name = file_name
         self.saviness = saviness
         if osp.exists(self.file_name):
             with open(self.file_name, 'r') as fd:
-                self.data = jsonpickle.decode(fd.read())
+                self.data = decode_store(fd.read())
         else:
             self.data = {}
+        if type(self) is ResultsStore and osp.exists(f"{self.file_name}.journal"):
+            LOGGER.warning("%s has a journal which is not loaded, use the journal store format.", self.file_name)
         self.num = 0
 
     def save(self):
-        if osp.exists(self.file_name):
-            LOGGER.info("Backing up results store to %s.bak.", self.file_name)
-            os.replace(self.file_name, f"{self.file_name}.bak")
-        with open(self.file_name, 'w') as fd:
-            LOGGER.debug("Saving results store.")
-            fd.write(jsonpickle.encode(self.data))
-            LOGGER.debug("Results store saved.")
+        with METRICS.timer('qal_store_save_seconds', store=self.store_format):
+            if osp.exists(self.file_name):
+                LOGGER.info("Backing up results store to %s.bak.", self.file_name)
+                os.replace(self.file_name, f"{self.file_name}.bak")
+            with open(self.file_name, 'w') as fd:
+                LOGGER.debug("Saving results store.")
+                fd.write(encode_store(self.data))
+                LOGGER.debug("Results store saved.")
 
     def add_item(self, item, source=None, query=None):
         if item.identifier not in self.data.keys():
@@ -61,7 +72,114 @@ class ResultsStore:
                 self.save()
 
     def get(self, name):
-        self.data.get(name)
+        return self.data.get(name)
+
+    def checkpoint(self):
+        """Make sure everything added so far is saved."""
+        if self.saviness <= 0 or (self.num % self.saviness) != 0:
+            self.save()
+
+    def close(self):
+        self.checkpoint()
+
+    def export(self, file_name):
+        """Write the store, in the standard format, to FILE_NAME."""
+        with open(file_name, 'w') as fd:
+            fd.write(encode_store(self.data))
 
     def __iter__(self):
         return self.data.__iter__()
+
+
+class JournaledResultsStore(ResultsStore):
+    """A results store which appends changes to a journal instead of rewriting itself.
+
+    The store is kept as a snapshot (FILE_NAME, in the standard format)
+    and a JSON Lines journal (FILE_NAME.journal).  Each new or updated
+    item is appended to the journal as one line, and is synced to disk
+    every SAVINESS items.  Each query is journaled once, before the
+    first item found by it.  On load, the journal is replayed over the
+    snapshot.  Compaction folds the journal into the snapshot.
+    """
+
+    store_format = 'journal'
+
+    def __init__(self, file_name, saviness=0):
+        super().__init__(file_name, saviness)
+        self.journal_name = f"{file_name}.journal"
+        self.journaled_queries = set()
+        self.replay()
+        self.journal = open(self.journal_name, 'a')
+
+    def replay(self):
+        if not osp.exists(self.journal_name):
+            return
+        LOGGER.info("Replaying journal %s.", self.journal_name)
+        count = 0
+        with open(self.journal_name, 'r') as fd:
+            for line in fd:
+                if not line.endswith('\n'):
+                    LOGGER.warning("Ignoring incomplete record at the end of %s.", self.journal_name)
+                    break
+                item = jsonpickle.decode(line)
+                if isinstance(item, dict):
+                    QUERIES.update({item['qal/query']: item['query']})
+                    self.journaled_queries.add(item['qal/query'])
+                else:
+                    self.data[item.identifier] = item.normalize()
+                count += 1
+        LOGGER.debug("Replayed %d journal records.", count)
+
+    def sync(self):
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def save(self):
+        LOGGER.debug("Syncing results journal.")
+        with METRICS.timer('qal_store_save_seconds', store=self.store_format):
+            self.sync()
+
+    def checkpoint(self):
+        self.sync()
+
+    def add_item(self, item, source=None, query=None):
+        if item.identifier not in self.data.keys():
+            self.data[item.identifier] = item
+        if (source != None) and (query != None):
+            self.data[item.identifier].add_search_terms(source, query)
+        for (_, identifier) in self.data[item.identifier].search_terms:
+            if identifier not in self.journaled_queries:
+                self.journal.write(jsonpickle.encode({'qal/query': identifier,
+                                                      'query': QUERIES.get(identifier)}))
+                self.journal.write('\n')
+                self.journaled_queries.add(identifier)
+        self.journal.write(jsonpickle.encode(self.data[item.identifier]))
+        self.journal.write('\n')
+        if self.saviness > 0:
+            self.num += 1
+            if (self.num % self.saviness) == 0:
+                self.save()
+
+    def compact(self):
+        """Write the full store as a snapshot and empty the journal."""
+        LOGGER.info("Compacting results journal into %s.", self.file_name)
+        self.sync()
+        super().save()
+        self.journal.truncate(0)
+        self.journaled_queries = set()
+        self.sync()
+
+    def close(self):
+        self.sync()
+        self.journal.close()
+
+
+STORE_FORMATS = {'json': ResultsStore,
+                 'journal': JournaledResultsStore,
+                 'sqlite': SQLiteResultsStore,
+                 'indexed': IndexedResultsStore}
+
+
+def open_results_store(file_name, saviness=0, store_format='json'):
+    """Open the results store in FILE_NAME, kept in STORE_FORMAT (see STORE_FORMATS)."""
+    return STORE_FORMATS[store_format](file_name, saviness)
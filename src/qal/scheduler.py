@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import threading
+
+LOGGER = logging.getLogger('qal.scheduler')
+
+
+class Scheduler:
+    """Decide which site/query pairs of a lane are stepped next (round-robin).
+
+    Each round steps every pair of a lane which still has results once,
+    in order.  Subclasses instead step, as many times as there are
+    pairs left, the pairs coming first by their KEY, after any pair
+    whose total is not known yet (its first page is its probe).
+
+    Every step advances the pair's pass by one over its priority, and
+    the site's pass by one over its weight.  The passes (and the
+    number of batches left of every pair) are kept in the status
+    structure, so a resumed run picks up in the same order.
+    """
+
+    name = 'round-robin'
+    # Whether pairs are stepped by their KEY rather than once per round in order.
+    sort = False
+    # Whether lanes take turns by their site's pass when there are fewer workers than lanes.
+    interleave = False
+
+    def __init__(self, weights=None, priorities=None):
+        self.weights = weights or []
+        self.priorities = priorities or []
+        self.remaining = {}
+        self.passes = {}
+        self.shares = {}
+        self.lock = threading.Lock()
+
+    def restore(self, status):
+        """Load the scheduling state from STATUS, seeding it there if missing (or for another scheduler)."""
+        state = status.get('scheduler')
+        if state is not None and state.get('name') != self.name:
+            LOGGER.warning("Status file was scheduled by %s, starting %s over.", state.get('name'), self.name)
+            state = None
+        if state is None:
+            state = {'name': self.name,
+                     'passes': [[0.0 for _ in row] for row in status['statuses']],
+                     'shares': [0.0 for _ in status['statuses']]}
+            status['scheduler'] = state
+        for site, row in enumerate(status['statuses']):
+            self.shares[site] = state['shares'][site]
+            for query, entry in enumerate(row):
+                self.passes[(site, query)] = state['passes'][site][query]
+                if len(entry.keys()) != 0:
+                    self.remaining[(site, query)] = status['batches'][site][query]
+
+    def weight(self, site):
+        if site < len(self.weights):
+            return self.weights[site]
+        return 1
+
+    def priority(self, query):
+        if query < len(self.priorities):
+            return self.priorities[query]
+        return 1
+
+    def key(self, site, query):
+        return query
+
+    def select(self, site, active, count, stepped):
+        """Choose up to COUNT of the ACTIVE pairs of SITE to step at the same time.
+
+        STEPPED counts the steps of each pair in the current round.
+        """
+        if not self.sort:
+            return [query for query in active if stepped[query] == 0]
+        with self.lock:
+            probes = [query for query in active
+                      if (site, query) not in self.remaining and stepped[query] == 0]
+            known = sorted((query for query in active if (site, query) in self.remaining),
+                           key=lambda query: (self.key(site, query), query))
+        return (probes + known)[:count]
+
+    def stepped(self, site, query, batches_left):
+        """Account for a step of SITE/QUERY, returning its new pass and its site's."""
+        with self.lock:
+            self.remaining[(site, query)] = batches_left
+            self.passes[(site, query)] = self.passes.get((site, query), 0.0) + 1 / self.priority(query)
+            self.shares[site] = self.shares.get(site, 0.0) + 1 / self.weight(site)
+            return self.passes[(site, query)], self.shares[site]
+
+    def next_lane(self, lanes):
+        """Choose which of LANES (waiting for a worker) runs its next round."""
+        with self.lock:
+            return min(lanes, key=lambda lane: (self.shares.get(lane.key, 0.0), lane.key))
+
+
+class ShortestRemainingScheduler(Scheduler):
+    """Step the pairs with the fewest batches left first, so pairs complete early."""
+
+    name = 'shortest-remaining'
+    sort = True
+
+    def key(self, site, query):
+        return self.remaining[(site, query)]
+
+
+class PriorityScheduler(Scheduler):
+    """Step pairs in proportion to their query's priority (stride scheduling)."""
+
+    name = 'priority'
+    sort = True
+
+    def key(self, site, query):
+        return self.passes[(site, query)]
+
+
+class FairShareScheduler(PriorityScheduler):
+    """Share workers between providers in proportion to their weight.
+
+    Within a lane, pairs are stepped as with PriorityScheduler.  When
+    there are fewer workers than lanes, lanes run one round at a time,
+    the lane with the lowest pass (steps over weight) going next.
+    """
+
+    name = 'fair-share'
+    interleave = True
+
+
+SCHEDULERS = {scheduler.name: scheduler
+              for scheduler in [Scheduler, ShortestRemainingScheduler, PriorityScheduler, FairShareScheduler]}
+
+
+def scheduler_from_plan(plan, name=None):
+    """The scheduler named NAME (or by PLAN's scheduler key), weighted by PLAN's sites and queries."""
+    if name is None:
+        name = plan.get('scheduler', Scheduler.name)
+    if name not in SCHEDULERS:
+        raise ValueError(f"Unknown scheduler {name}, use one of {', '.join(SCHEDULERS.keys())}.")
+    return SCHEDULERS[name]([site.get('weight', 1) for site in plan['sites']],
+                            [query.get('priority', 1) for query in plan['queries']])
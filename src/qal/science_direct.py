@@ -29,13 +29,14 @@ from .types import Article
 import json
 import logging
 
-from time import sleep
-
 LOGGER = logging.getLogger('qal.scienc_direct')
 
 
 class ScienceDirect(DigitalLibrary):
 
+    rate_limit = (2, None)
+    max_page_size = 100
+
     def __init__(self, api_key, max_results=25, start_result=1):
         super().__init__(name="science_direct",
                          description="Elsevier Science Direct",
@@ -55,7 +56,7 @@ class ScienceDirect(DigitalLibrary):
         if 'error-response' in data.keys():
             if data['error-response']['error_code'] == 'RATE_LIMIT_EXCEEDED':
                 LOGGER.error("Rate limit has been exceeded, pausing.")
-                sleep(60)
+                self.rate_limiter.defer()
                 return []
             else:
                 LOGGER.critical("An unknown error has occured: %s.", data['error-response'])
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import jsonpickle
+import logging
+
+from .types import QUERIES
+
+LOGGER = logging.getLogger('qal.serialization')
+
+FORMAT_VERSION = 2
+
+
+def encode_store(data):
+    """Encode a dictionary of publications, with the queries they were found by."""
+    return jsonpickle.encode({'qal/format': FORMAT_VERSION,
+                              'queries': QUERIES.queries,
+                              'publications': data})
+
+
+def decode_store(string):
+    """Decode a results store, registering its queries.
+
+    Stores written before the query registry are a plain dictionary of
+    publications, whose search terms are migrated as they are decoded.
+    """
+    decoded = jsonpickle.decode(string)
+    if isinstance(decoded, dict) and decoded.get('qal/format') == FORMAT_VERSION:
+        QUERIES.update(decoded['queries'])
+        return decoded['publications']
+    LOGGER.info("Migrating results store to format %d.", FORMAT_VERSION)
+    for item in decoded.values():
+        item.normalize()
+    return decoded
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import threading
+import logging
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+
+LOGGER = logging.getLogger('qal.sessions')
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 60.0
+
+_sessions = {}
+_pool_sizes = {}
+_sessions_lock = threading.Lock()
+
+
+def endpoint_host(url):
+    """Return the (scheme, host) pair a session pool is shared by."""
+    parts = urlsplit(url)
+    return (parts.scheme, parts.netloc)
+
+
+def make_session(pool_size=DEFAULT_POOL_SIZE):
+    """Build a keep-alive session with a connection pool of POOL_SIZE connections."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size,
+                          pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate',
+                            'Connection': 'keep-alive'})
+    return session
+
+
+def get_session(url, pool_size=DEFAULT_POOL_SIZE):
+    """Get the shared session for the host serving URL, creating it if needed.
+
+    Sessions are shared per endpoint host, so every API object talking
+    to the same provider reuses the same pool of open connections.  If a
+    larger POOL_SIZE is requested later, the pool is grown to match.
+    """
+    key = endpoint_host(url)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            LOGGER.debug("Creating session pool for %s://%s (size %d).", key[0], key[1], pool_size)
+            session = make_session(pool_size)
+            _sessions[key] = session
+            _pool_sizes[key] = pool_size
+        elif pool_size > _pool_sizes[key]:
+            LOGGER.debug("Growing session pool for %s://%s to %d.", key[0], key[1], pool_size)
+            adapter = HTTPAdapter(pool_connections=pool_size,
+                                  pool_maxsize=pool_size)
+            session.mount(f"{key[0]}://", adapter)
+            _pool_sizes[key] = pool_size
+        return session
+
+
+def close_sessions():
+    """Close all shared sessions, releasing pooled connections."""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _pool_sizes.clear()
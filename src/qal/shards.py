@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import re
+import sys
+import glob
+import logging
+import subprocess
+
+import os.path as osp
+
+from .status import StatusLog
+from .results_store import JournaledResultsStore
+from .types import QUERIES
+
+LOGGER = logging.getLogger('qal.shards')
+
+SHARD_PATTERN = re.compile(r'\.shard-(\d+)$')
+
+
+def shard_name(file_name, index):
+    return f"{file_name}.shard-{index}"
+
+
+def pending_pairs(compiled, status):
+    """The enabled site/query pairs of the CompiledPlan COMPILED which are run and still have results, interleaving sites."""
+    plan = compiled.plan
+    return [(site_id, query_id)
+            for query_id in range(len(plan['queries']))
+            for (site_id, site) in enumerate(plan['sites'])
+            if site['enabled'] and status['has_results'][site_id][query_id]
+            and compiled.is_representative(site_id, query_id)]
+
+
+def split_pairs(pairs, workers):
+    """Split PAIRS between WORKERS shards, dealing them out in turn."""
+    return [pairs[index::workers] for index in range(workers) if len(pairs[index::workers]) > 0]
+
+
+def write_shard_status(status, status_file, index, pairs):
+    """Write the status of shard INDEX, running PAIRS, to STATUS_FILE.shard-INDEX.
+
+    The shard's status is a copy of STATUS, with the pairs it owns (and
+    its starting scheduler shares) kept under the shard key.
+    """
+    shard = dict(status)
+    shard['shard'] = {'index': index,
+                      'pairs': [list(pair) for pair in pairs],
+                      'shares': list(status['scheduler']['shares']) if 'scheduler' in status else []}
+    log = StatusLog(shard_name(status_file, index))
+    log.snapshot(shard)
+    log.close()
+
+
+def shard_files(status_file, out_file):
+    """The (status, results) files of every shard left in place, whatever their number."""
+    shards = []
+    for file_name in sorted(glob.glob(f"{glob.escape(status_file)}.shard-*")):
+        match = SHARD_PATTERN.search(file_name)
+        if match is not None:
+            shards.append((file_name, shard_name(out_file, match.group(1))))
+    return shards
+
+
+def merge_shard_results(results, shard_out):
+    """Add every publication of the shard store SHARD_OUT to RESULTS.
+
+    Publications are added once for each of their search terms, so
+    search terms found by several shards are united as add_item would.
+    """
+    shard = JournaledResultsStore(shard_out)
+    count = 0
+    try:
+        for identifier in shard:
+            item = shard.get(identifier)
+            if len(item.search_terms) == 0:
+                results.add_item(item)
+            for (source, query) in sorted(item.search_terms):
+                results.add_item(item, source, QUERIES.get(query))
+            count += 1
+    finally:
+        shard.close()
+    LOGGER.info("Merged %d publications from %s.", count, shard_out)
+    return count
+
+
+def merge_shard_status(status, shard):
+    """Copy the state of the pairs owned by the shard status SHARD into STATUS."""
+    for (site_id, query_id) in shard['shard']['pairs']:
+        status['statuses'][site_id][query_id] = shard['statuses'][site_id][query_id]
+        status['has_results'][site_id][query_id] = shard['has_results'][site_id][query_id]
+        status['batches'][site_id][query_id] = shard['batches'][site_id][query_id]
+        if 'scheduler' in status and 'scheduler' in shard:
+            status['scheduler']['passes'][site_id][query_id] = shard['scheduler']['passes'][site_id][query_id]
+    if 'scheduler' in status and 'scheduler' in shard:
+        for (site_id, share) in enumerate(shard['scheduler']['shares']):
+            status['scheduler']['shares'][site_id] += share - shard['shard']['shares'][site_id]
+
+
+def merge_shards(status, results, status_file, out_file):
+    """Merge the results and status of every shard into RESULTS and STATUS.
+
+    Returns the merged shards' files, to be removed (by remove_shards)
+    once STATUS has been written.  Merging the same shard again is
+    harmless, so a merge which is interrupted may simply be redone.
+    """
+    merged = []
+    for (shard_status, shard_out) in shard_files(status_file, out_file):
+        shard = StatusLog(shard_status).load()
+        if 'shard' not in shard:
+            LOGGER.warning("Ignoring %s, which is not a shard status file.", shard_status)
+            continue
+        LOGGER.info("Merging shard %s.", shard_status)
+        if osp.exists(shard_out) or osp.exists(f"{shard_out}.journal"):
+            merge_shard_results(results, shard_out)
+        merge_shard_status(status, shard)
+        merged.append((shard_status, shard_out))
+    if len(merged) > 0:
+        results.checkpoint()
+        status['incomplete'] = sum(sum(1 for has_results in row if has_results)
+                                   for row in status['has_results'])
+        status['max_batches'] = max(map(max, status['batches']))
+    return merged
+
+
+def remove_shards(merged):
+    for (shard_status, shard_out) in merged:
+        for file_name in [shard_status, f"{shard_status}.bak", f"{shard_status}.log", f"{shard_status}.tmp",
+                          shard_out, f"{shard_out}.bak", f"{shard_out}.journal"]:
+            if osp.exists(file_name):
+                os.remove(file_name)
+
+
+def start_worker(arguments):
+    """Start a qal-auto worker process with command line ARGUMENTS."""
+    environment = dict(os.environ)
+    # Workers' progress bars would overwrite each other.
+    environment['TQDM_DISABLE'] = '1'
+    return subprocess.Popen([sys.executable, '-c', 'from qal.autoquery import main; main()'] + arguments,
+                            env=environment)
+
+
+def run_workers(commands):
+    """Run a worker process for each of COMMANDS, waiting for all of them.
+
+    Returns whether every worker succeeded.  If interrupted, the workers
+    (which are interrupted too) are waited for before re-raising.
+    """
+    workers = [start_worker(arguments) for arguments in commands]
+    try:
+        codes = [worker.wait() for worker in workers]
+    except KeyboardInterrupt:
+        LOGGER.warning("Interrupted, waiting for workers to stop.")
+        for worker in workers:
+            worker.wait()
+        raise
+    for (index, code) in enumerate(codes):
+        if code != 0:
+            LOGGER.error("Worker %d failed with status %d.", index, code)
+    return all(code == 0 for code in codes)
@@ -24,34 +24,22 @@
 # SOFTWARE.
 
 from .digital_library import DigitalLibrary
+from .venues import SPRINGER_VENUES
 from .types import Article, Conference
 
-import re
 import logging
 
 LOGGER = logging.getLogger('qal.springer')
 
 
 def sanitize_venue(string):
-    string = re.sub(r'proceedings of the', '', string, flags=re.IGNORECASE)
-    string = re.sub(r"[0-9]{1,2}(nd|th|rd|st)", "", string)
-    string = re.sub(r"(first|second|third|fourth|fifth|sixth|seventh|eighth|ninth|tenth|eleventh|twelfth|thirteenth|fourteenth|fifteenth|sixteenth|seventeeth|eighteenth|ninteenth|twentieth|twenty|thirtieth|thirty|fourthieth|fourty|fiftieth|fifty|sixtieth|sixty)-?", "", string, flags=re.IGNORECASE)
-    string = re.sub(r'\u2014', '', string)
-    string = re.sub(r'\u2013', '', string)
-    string = re.sub(r'\'\d{2}', '', string)
-    string = re.sub(r'\u2019[0-9]+', '', string)
-    string = re.sub(r'[0-9]{4}', '', string)
-    string = re.sub(r'Part (v|iv|iii|ii|i)', '', string, flags=re.IGNORECASE)
-    string = re.sub(r'proceedings of', '', string, flags=re.IGNORECASE)
-    string = re.sub(r'volume \d+', '', string, flags=re.IGNORECASE)
-    string = re.sub(r'\s[,:]\s', '', string)
-    string = re.sub(r'\s+\)', '\)', string)
-    string = re.sub(r' - ', ' ', string)
-    string = re.sub(r'\s+', ' ', string).strip()
-    return string
+    return SPRINGER_VENUES.normalize(string)
 
 
 class SpringerNature(DigitalLibrary):
+
+    max_page_size = 100
+
     def __init__(self, api_key, max_results=50, start_result=1):
         super().__init__(name='springer_nature',
                          description='Springer Link',
@@ -93,7 +81,7 @@ class SpringerNature(DigitalLibrary):
                                       issue=result['number'],
                                       abstract=result.get('abstract'),
                                       pages=None)
-                results.append()
+                results.append(result_item)
             elif result_type == 'Chapter ConferencePaper':
                 result_item = Conference(identifier,
                                          title,
@@ -105,4 +93,4 @@ class SpringerNature(DigitalLibrary):
                                          abstract=result.get('abstract'),
                                          pages=None)
                 results.append(result_item)
-        return data['records']
+        return results
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import copy
+import json
+import sqlite3
+import logging
+
+import jsonpickle
+
+from .types import QUERIES, query_id
+from .metrics import METRICS
+from .serialization import encode_store
+
+LOGGER = logging.getLogger('qal.sqlite_store')
+
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS publications (
+    id INTEGER PRIMARY KEY,
+    identifier TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    title TEXT,
+    year TEXT,
+    venue TEXT,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS publications_year ON publications(year);
+CREATE TABLE IF NOT EXISTS authors (
+    publication INTEGER NOT NULL REFERENCES publications(id),
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (publication, position)
+);
+CREATE INDEX IF NOT EXISTS authors_name ON authors(name);
+CREATE TABLE IF NOT EXISTS queries (
+    id TEXT PRIMARY KEY,
+    query TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS search_terms (
+    publication INTEGER NOT NULL REFERENCES publications(id),
+    source TEXT NOT NULL,
+    query TEXT NOT NULL REFERENCES queries(id)
+);
+"""
+
+INDEXES = """
+CREATE UNIQUE INDEX IF NOT EXISTS search_terms_hit ON search_terms(publication, source, query);
+CREATE INDEX IF NOT EXISTS search_terms_source_query ON search_terms(source, query);
+CREATE INDEX IF NOT EXISTS search_terms_query ON search_terms(query);
+"""
+
+
+def encode_query(query):
+    """Encode QUERY so that equal queries have equal encodings."""
+    return json.dumps(query, sort_keys=True)
+
+
+class SQLiteResultsStore:
+    """A results store kept in an SQLite database.
+
+    Publications, their authors, the queries they were found by and
+    their search term hits (source, query identifier) are kept in
+    separate tables, indexed by identifier, author, source and query.
+    Items are written inside a transaction which is committed every
+    SAVINESS items, and whenever the store is checkpointed.
+    """
+
+    def __init__(self, file_name, saviness=0):
+        self.file_name = file_name
+        self.saviness = saviness
+        self.num = 0
+        # Stores are written by a single writer, though not always the thread that opened them.
+        self.connection = sqlite3.connect(file_name, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.migrate()
+        self.connection.executescript(SCHEMA)
+        self.connection.executescript(INDEXES)
+        self.connection.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+        self.connection.commit()
+        QUERIES.update({identifier: json.loads(query)
+                        for (identifier, query) in self.connection.execute("SELECT id, query FROM queries")})
+
+    def migrate(self):
+        """Migrate search terms from query text to registered query identifiers."""
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        exists = self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'search_terms'").fetchone()
+        if version >= SCHEMA_VERSION or exists is None:
+            return
+        LOGGER.info("Migrating %s to schema version %d.", self.file_name, SCHEMA_VERSION)
+        self.connection.executescript(SCHEMA)
+        for (text,) in self.connection.execute("SELECT DISTINCT query FROM search_terms").fetchall():
+            query = json.loads(text)
+            identifier = self.register_query(query)
+            self.connection.execute("UPDATE search_terms SET query = ? WHERE query = ?", (identifier, text))
+        self.connection.execute("DELETE FROM search_terms WHERE rowid NOT IN (SELECT MIN(rowid) FROM search_terms GROUP BY publication, source, query)")
+        self.connection.execute("DROP INDEX IF EXISTS search_terms_publication")
+
+    def register_query(self, query):
+        identifier = QUERIES.register(query)
+        self.connection.execute("INSERT OR IGNORE INTO queries (id, query) VALUES (?, ?)",
+                                (identifier, encode_query(query)))
+        return identifier
+
+    def save(self):
+        LOGGER.debug("Committing results store.")
+        with METRICS.timer('qal_store_save_seconds', store='sqlite'):
+            self.connection.commit()
+
+    def checkpoint(self):
+        self.save()
+
+    def publication_id(self, identifier):
+        row = self.connection.execute("SELECT id FROM publications WHERE identifier = ?",
+                                      (identifier,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def insert_publication(self, item):
+        record = copy.copy(item)
+        record.search_terms = set()
+        cursor = self.connection.execute("INSERT INTO publications (identifier, kind, title, year, venue, record) VALUES (?, ?, ?, ?, ?, ?)",
+                                         (item.identifier,
+                                          type(item).__name__,
+                                          item.title,
+                                          None if item.year is None else str(item.year),
+                                          item.venue(),
+                                          jsonpickle.encode(record)))
+        publication = cursor.lastrowid
+        self.connection.executemany("INSERT INTO authors (publication, position, name) VALUES (?, ?, ?)",
+                                    [(publication, position, name) for (position, name) in enumerate(item.authors or [])])
+        self.insert_search_terms(publication, item.search_terms)
+        return publication
+
+    def insert_search_terms(self, publication, search_terms):
+        for (_, identifier) in search_terms:
+            self.connection.execute("INSERT OR IGNORE INTO queries (id, query) VALUES (?, ?)",
+                                    (identifier, encode_query(QUERIES.get(identifier))))
+        self.connection.executemany("INSERT OR IGNORE INTO search_terms (publication, source, query) VALUES (?, ?, ?)",
+                                    [(publication, source, identifier) for (source, identifier) in search_terms])
+
+    def add_item(self, item, source=None, query=None):
+        publication = self.publication_id(item.identifier)
+        if publication is None:
+            publication = self.insert_publication(item)
+        if (source != None) and (query != None):
+            self.connection.execute("INSERT OR IGNORE INTO search_terms (publication, source, query) VALUES (?, ?, ?)",
+                                    (publication, source, self.register_query(query)))
+        if self.saviness > 0:
+            self.num += 1
+            if (self.num % self.saviness) == 0:
+                self.save()
+
+    def get(self, name):
+        row = self.connection.execute("SELECT id, record FROM publications WHERE identifier = ?",
+                                      (name,)).fetchone()
+        if row is None:
+            return None
+        item = jsonpickle.decode(row[1])
+        item.search_terms = set(self.connection.execute("SELECT source, query FROM search_terms WHERE publication = ?",
+                                                        (row[0],)))
+        return item
+
+    def hits(self, source=None, query=None):
+        """Identifiers of the publications found in SOURCE by QUERY (either may be None to match any)."""
+        sql = "SELECT DISTINCT p.identifier FROM search_terms s JOIN publications p ON p.id = s.publication"
+        conditions = []
+        parameters = []
+        if source is not None:
+            conditions.append("s.source = ?")
+            parameters.append(source)
+        if query is not None:
+            conditions.append("s.query = ?")
+            parameters.append(query_id(query))
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return [row[0] for row in self.connection.execute(sql, parameters)]
+
+    def import_store(self, store):
+        """Copy every item of another results STORE into this one, in a single transaction."""
+        for identifier in store:
+            item = store.get(identifier)
+            publication = self.publication_id(identifier)
+            if publication is None:
+                self.insert_publication(item)
+            else:
+                self.insert_search_terms(publication, item.search_terms)
+        self.save()
+
+    def export(self, file_name):
+        """Write the store, in the standard format, to FILE_NAME."""
+        data = {identifier: self.get(identifier) for identifier in self}
+        with open(file_name, 'w') as fd:
+            fd.write(encode_store(data))
+
+    def close(self):
+        self.save()
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM publications").fetchone()[0]
+
+    def __iter__(self):
+        return (row[0] for row in self.connection.execute("SELECT identifier FROM publications ORDER BY id"))
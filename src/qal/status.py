@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import os.path as osp
+import json
+import logging
+
+LOGGER = logging.getLogger('qal.status')
+
+
+def seed_status(plan):
+    """A fresh status structure for PLAN, with nothing run yet."""
+    LOGGER.info("Seeding status structure.")
+    num_sites = len(plan['sites'])
+    num_queries = len(plan['queries'])
+    status = {}
+    status['statuses'] = []
+    status['has_results'] = []
+    status['incomplete'] = num_sites * num_queries
+    status['batches'] = []
+    status['max_batches'] = 10
+    for j in range(num_sites):
+        row = []
+        has_results = []
+        batches = []
+        for i in range(num_queries):
+            row.append({})
+            if plan['sites'][j]['enabled']:
+                has_results.append(True)
+            else:
+                has_results.append(False)
+                status['incomplete'] -= 1
+            batches.append(10)
+        status['statuses'].append(row)
+        status['has_results'].append(has_results)
+        status['batches'].append(batches)
+    LOGGER.debug("Seeded status structure.")
+    return status
+
+
+class StatusLog:
+    """Checkpoint a qal-auto status structure as a snapshot plus a log of changes.
+
+    The snapshot (FILE_NAME) holds the whole status structure, and the
+    log (FILE_NAME.log) holds one JSON line per site/query step, giving
+    the new values of everything that step changed.  Log records are
+    absolute values, so replaying them over a snapshot they are already
+    part of is harmless.  After SNAPSHOT_EVERY records, a new snapshot
+    is written and the log emptied.
+    """
+
+    def __init__(self, file_name, snapshot_every=1000):
+        self.file_name = file_name
+        self.log_name = f"{file_name}.log"
+        self.snapshot_every = snapshot_every
+        self.records = 0
+        self.log = None
+
+    def load(self):
+        """Load the status structure, replaying the log over the latest snapshot."""
+        status = {}
+        for file_name in [self.file_name, f"{self.file_name}.bak"]:
+            if osp.exists(file_name):
+                LOGGER.debug("Loading status snapshot %s.", file_name)
+                with open(file_name, 'r') as fd:
+                    status = json.load(fd)
+                break
+        if len(status.keys()) != 0 and osp.exists(self.log_name):
+            LOGGER.debug("Replaying status log %s.", self.log_name)
+            with open(self.log_name, 'r') as fd:
+                for line in fd:
+                    if not line.endswith('\n'):
+                        LOGGER.warning("Ignoring incomplete record at the end of %s.", self.log_name)
+                        break
+                    self.apply(status, json.loads(line))
+                    self.records += 1
+        return status
+
+    @staticmethod
+    def apply(status, record):
+        site_id = record['site']
+        query_id = record['query']
+        status['statuses'][site_id][query_id] = record['status']
+        status['has_results'][site_id][query_id] = record['has_results']
+        status['batches'][site_id][query_id] = record['batches']
+        status['incomplete'] = record['incomplete']
+        status['max_batches'] = record['max_batches']
+        if 'passes' in record:
+            status['scheduler']['passes'][site_id][query_id], status['scheduler']['shares'][site_id] = record['passes']
+
+    def snapshot(self, status):
+        """Write the whole status structure, then empty the log."""
+        temporary = f"{self.file_name}.tmp"
+        with open(temporary, 'w') as fd:
+            json.dump(status, fd, indent=True)
+            fd.flush()
+            os.fsync(fd.fileno())
+        if osp.exists(self.file_name):
+            LOGGER.debug("Retaining backup copy of status file")
+            os.replace(self.file_name, f"{self.file_name}.bak")
+        os.replace(temporary, self.file_name)
+        if self.log is not None:
+            self.log.close()
+        self.log = open(self.log_name, 'w')
+        self.records = 0
+
+    def record(self, status, site_id, query_id):
+        """Log the current state of the SITE_ID/QUERY_ID pair (and the status totals)."""
+        if self.log is None:
+            self.log = open(self.log_name, 'a')
+        record = {'site': site_id,
+                  'query': query_id,
+                  'status': status['statuses'][site_id][query_id],
+                  'has_results': status['has_results'][site_id][query_id],
+                  'batches': status['batches'][site_id][query_id],
+                  'incomplete': status['incomplete'],
+                  'max_batches': status['max_batches']}
+        if 'scheduler' in status:
+            record['passes'] = [status['scheduler']['passes'][site_id][query_id],
+                                status['scheduler']['shares'][site_id]]
+        self.log.write(json.dumps(record))
+        self.log.write('\n')
+        self.log.flush()
+        os.fsync(self.log.fileno())
+        self.records += 1
+        if self.records >= self.snapshot_every:
+            LOGGER.info("Writing status snapshot %s.", self.file_name)
+            self.snapshot(status)
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
@@ -23,29 +23,132 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import json
+import hashlib
+import threading
+
 from abc import ABCMeta, abstractmethod
+from sys import intern
+
+_interned = {}
+
+
+def query_id(query):
+    """A stable identifier for QUERY: equal queries get the same identifier, in any process."""
+    encoded = json.dumps(query, sort_keys=True)
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()[:16]
+
+
+class QueryRegistry:
+    """The queries publications were found by, each kept once under a stable identifier."""
+
+    def __init__(self):
+        self.queries = {}
+        self.lock = threading.Lock()
+
+    def register(self, query):
+        """Register QUERY, returning its identifier."""
+        identifier = query_id(query)
+        if identifier not in self.queries:
+            with self.lock:
+                self.queries.setdefault(identifier, query)
+        return intern(identifier)
+
+    def get(self, identifier):
+        return self.queries.get(identifier)
+
+    def update(self, queries):
+        """Add QUERIES, a dictionary of identifiers to queries (e.g., as saved in a results store)."""
+        with self.lock:
+            self.queries.update(queries)
+
+
+QUERIES = QueryRegistry()
+
+
+def intern_value(value):
+    """Return a shared copy of VALUE, so repeated authors, venues and years are only stored once."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return intern(value)
+    try:
+        return _interned.setdefault(value, value)
+    except TypeError:
+        return value
 
 
 class Publication(metaclass=ABCMeta):
+    __slots__ = ('search_terms', 'identifier', 'title', 'authors', 'year')
+
+    # Attributes whose values are interned.
+    interned = ('year',)
+
     def __init__(self, identifier, title, authors, year):
-        self.search_terms = {}
+        self.search_terms = set()
         self.identifier = identifier
         self.title = title
-        self.authors = authors
-        self.year = year
+        self.authors = [intern_value(author) for author in authors]
+        self.year = intern_value(year)
+
+    def __getstate__(self):
+        return {name: getattr(self, name, None)
+                for cls in type(self).__mro__
+                for name in getattr(cls, '__slots__', ())}
+
+    def __setstate__(self, state):
+        interned = set(name for cls in type(self).__mro__ for name in getattr(cls, 'interned', ()))
+        for (name, value) in state.items():
+            if name in interned:
+                value = intern_value(value)
+            elif name == 'authors' and value is not None:
+                value = [intern_value(author) for author in value]
+            elif name == 'search_terms':
+                value = self.migrate_search_terms(value)
+            setattr(self, name, value)
+
+    def normalize(self):
+        """Intern values and migrate search terms of a publication restored without __setstate__.
+
+        jsonpickle restores publications saved before __slots__ were
+        used attribute by attribute, bypassing __setstate__.
+        """
+        self.__setstate__(self.__getstate__())
+        return self
+
+    @staticmethod
+    def migrate_search_terms(search_terms):
+        """Convert search terms to a set of (source, query identifier) pairs.
+
+        Stores written before the query registry kept a dictionary from
+        source to a list of (possibly repeated) query dictionaries.
+        """
+        if isinstance(search_terms, dict):
+            return set((intern(source), QUERIES.register(query))
+                       for (source, queries) in search_terms.items()
+                       for query in queries)
+        return set((intern(source), intern(identifier)) for (source, identifier) in search_terms or ())
 
     def add_search_terms(self, source, search_terms):
-        if source in self.search_terms.keys():
-            self.search_terms[source].append(search_terms)
-        else:
-            self.search_terms[source] = [search_terms]
+        self.search_terms.add((intern(source), QUERIES.register(search_terms)))
+
+    def merge_search_terms(self, other):
+        """Add the search terms of publication OTHER to this one's."""
+        self.search_terms.update(other.search_terms)
+
+    def search_terms_by_source(self):
+        """Search terms as a dictionary from source to the list of queries that found this publication."""
+        by_source = {}
+        for (source, identifier) in sorted(self.search_terms):
+            by_source.setdefault(source, []).append(QUERIES.get(identifier))
+        return by_source
 
     def asdict(self):
         return {'identifier': self.identifier,
                 'title': self.title,
                 'authors': self.authors,
                 'year': self.year,
-                'search_terms': self.search_terms}
+                'search_terms': self.search_terms_by_source()}
 
     @abstractmethod
     def venue(self):
@@ -53,10 +156,14 @@ class Publication(metaclass=ABCMeta):
 
 
 class Article(Publication):
+    __slots__ = ('journal', 'volume', 'issue', 'abstract', 'pages')
+
+    interned = ('journal', 'volume')
+
     def __init__(self, identifier, title, authors, year, journal, volume, issue, abstract=None, pages=None):
         super().__init__(identifier, title, authors, year)
-        self.journal = journal
-        self.volume = volume
+        self.journal = intern_value(journal)
+        self.volume = intern_value(volume)
         self.issue = issue
         self.abstract = abstract
         self.pages = pages
@@ -75,10 +182,14 @@ class Article(Publication):
 
 
 class Conference(Publication):
+    __slots__ = ('book_title', 'conference', 'abstract', 'pages')
+
+    interned = ('book_title', 'conference')
+
     def __init__(self, identifier, title, authors, year, book_title, conference, abstract=None, pages=None):
         super().__init__(identifier, title, authors, year)
-        self.book_title = book_title
-        self.conference = conference
+        self.book_title = intern_value(book_title)
+        self.conference = intern_value(conference)
         self.abstract = abstract
         self.pages = pages
 
@@ -98,6 +209,8 @@ class Conference(Publication):
 
 
 class Book(Publication):
+    __slots__ = ('abstract',)
+
     def __init__(self, identifier, title, authors, year, abstract=None):
         super().__init__(identifier, title, authors, year)
         self.abstract = abstract
@@ -108,12 +221,17 @@ class Book(Publication):
     def asdict(self):
         d = super().asdict()
         d['abstract'] = self.abstract
+        return d
 
 
 class BookChapter(Publication):
+    __slots__ = ('book_title', 'abstract', 'pages')
+
+    interned = ('book_title',)
+
     def __init__(self, identifier, title, authors, year, book_title, abstract=None, pages=None):
         super().__init__(identifier, title, authors, year)
-        self.book_title = book_title
+        self.book_title = intern_value(book_title)
         self.abstract = abstract
         self.pages = pages
 
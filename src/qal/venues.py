@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import re
+import json
+import logging
+
+from functools import lru_cache
+
+LOGGER = logging.getLogger('qal.venues')
+
+DEFAULT_CACHE_SIZE = 16384
+
+
+def first_letter_alternation(words):
+    """An alternation matching WORDS, grouped by first letter.
+
+    Within each group, words keep their relative order, so the same
+    word is preferred as by a plain alternation, but at most one group
+    is tried at each position.
+    """
+    groups = {}
+    for word in words:
+        groups.setdefault(word[0], []).append(word[1:])
+    return '(?:' + '|'.join(f"{letter}(?:{'|'.join(rests)})" for (letter, rests) in groups.items()) + ')'
+
+
+ORDINAL_WORDS = first_letter_alternation(["first", "second", "third", "fourth", "fifth", "sixth", "seventh",
+                                          "eighth", "ninth", "tenth", "eleventh", "twelfth", "thirteenth",
+                                          "fourteenth", "fifteenth", "sixteenth", "seventeeth", "eighteenth",
+                                          "ninteenth", "twentieth", "twenty", "thirtieth", "thirty",
+                                          "fourthieth", "fourty", "fiftieth", "fifty", "sixtieth", "sixty"]) + "-?"
+
+_normalizers = []
+_table = {}
+
+
+class VenueNormalizer:
+    """Normalize venue names by a series of regular expression passes.
+
+    PASSES is a list of (patterns, replacement) pairs, applied in
+    order.  The patterns of a pass are joined into a single alternation
+    (patterns needing flags use scoped inline flags, e.g. "(?i:...)"),
+    and compiled once, so each pass scans the string once.  Patterns in
+    one pass must not depend on each other's substitutions.  Finally,
+    runs of whitespace are collapsed and the result stripped.
+
+    Results are memoized in an LRU cache of CACHE_SIZE entries, and may
+    be mapped to a canonical name by a venue table (see
+    load_venue_table).
+    """
+
+    def __init__(self, name, passes, cache_size=DEFAULT_CACHE_SIZE):
+        self.name = name
+        self.passes = [(re.compile('|'.join(f"(?:{pattern})" for pattern in patterns)), replacement)
+                       for (patterns, replacement) in passes]
+        self.whitespace = re.compile(r"\s+")
+        self.normalize = lru_cache(maxsize=cache_size)(self.normalize_uncached)
+        _normalizers.append(self)
+
+    def normalize_uncached(self, string):
+        canonical = _table.get(string)
+        if canonical is not None:
+            return canonical
+        for (regex, replacement) in self.passes:
+            string = regex.sub(replacement, string)
+        string = self.whitespace.sub(" ", string).strip()
+        return _table.get(string, string)
+
+    def __call__(self, string):
+        return self.normalize(string)
+
+
+def load_venue_table(file_name):
+    """Load a venue-canonicalization table, a JSON object mapping venue names to canonical names.
+
+    Names are looked up both before and after normalization.
+    """
+    LOGGER.info("Loading venue table %s.", file_name)
+    with open(file_name, 'r') as fd:
+        table = json.load(fd)
+    _table.update(table)
+    for normalizer in _normalizers:
+        normalizer.normalize.cache_clear()
+
+
+IEEE_VENUES = VenueNormalizer('ieee', [
+    ([r"[0-9]{4}",
+      r"[0-9]{1,2}(nd|th|rd|st)"], ""),
+    ([r"Proceedings?\.?( of)?( the)?"], ""),
+    ([r"\bs ",
+      r"[\[\]]"], ""),
+    ([f"(?i:{ORDINAL_WORDS})"], ""),
+    ([r"\(.*\)$",
+      r"^Annual"], ""),
+    ([r"(ACM/IEEE|IEEE/ACM|IEEE|ACM)"], ""),
+    ([r"(?i:^The )"], "")])
+
+SPRINGER_VENUES = VenueNormalizer('springer', [
+    ([r"(?i:proceedings of the)"], ""),
+    ([r"[0-9]{1,2}(nd|th|rd|st)"], ""),
+    ([f"(?i:{ORDINAL_WORDS})"], ""),
+    (["\u2014",
+      "\u2013"], ""),
+    ([r"'\d{2}"], ""),
+    ([r"\u2019[0-9]+"], ""),
+    ([r"[0-9]{4}"], ""),
+    ([r"(?i:Part (v|iv|iii|ii|i))"], ""),
+    ([r"(?i:proceedings of)"], ""),
+    ([r"(?i:volume \d+)"], ""),
+    ([r"\s[,:]\s"], ""),
+    ([r"\s+\)"], ")"),
+    ([r" - "], " ")])
+
+if os.environ.get('QAL_VENUE_TABLE'):
+    load_venue_table(os.environ['QAL_VENUE_TABLE'])
@@ -0,0 +1,567 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is a part of `qal`.
+#
+# Copyright (c) 2021, University of Nebraska Board of Regents.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+import threading
+
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+import jsonpickle
+
+from .results_store import open_results_store, STORE_FORMATS
+from .cache import add_cache_arguments, cache_from_arguments
+from .dedup import add_dedup_arguments, dedup_from_arguments
+from .metrics import print_summary
+from .plan import CompiledPlan, make_api_object
+
+LOGGER = logging.getLogger('qal.work_queue')
+
+DEFAULT_LEASE = 300
+DEFAULT_ATTEMPTS = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    site INTEGER NOT NULL,
+    query INTEGER NOT NULL,
+    start INTEGER,
+    stop INTEGER,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    total INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS items_state ON items(state, site);
+CREATE TABLE IF NOT EXISTS results (
+    item INTEGER NOT NULL REFERENCES items(id),
+    position INTEGER NOT NULL,
+    record TEXT NOT NULL,
+    PRIMARY KEY (item, position)
+);
+"""
+
+
+class WorkQueue:
+    """A queue of pages to fetch for a plan, shared by workers on several machines.
+
+    The queue is an SQLite database, which may be kept on a network
+    filesystem (so it uses a rollback journal rather than WAL), or be
+    served by `qal-queue serve`.  Each item is a page of a site/query
+    pair: its START offset (None for the provider's first page) and,
+    for pages found after the first, the STOP offset of the next page.
+
+    A worker leases an item for LEASE seconds, renewing the lease while
+    it works on it.  Items whose lease expires go back to the queue.
+    Completing an item stores its results and, for a pair's first page,
+    adds the pair's following pages once its total is known (or, for a
+    page shorter than expected, the rest of the page).  Failed items
+    are retried, up to MAX_ATTEMPTS times.
+    """
+
+    def __init__(self, file_name, lease=DEFAULT_LEASE, max_attempts=DEFAULT_ATTEMPTS):
+        self.file_name = file_name
+        self.lease_seconds = lease
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        # Transactions are explicit, access is serialized by self.lock.
+        self.connection = sqlite3.connect(file_name, timeout=60, isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def initialize(self, plan):
+        """Queue the first page of every enabled site/query pair of PLAN which is run (see CompiledPlan), once."""
+        compiled = CompiledPlan(plan)
+        encoded = json.dumps(plan, sort_keys=True)
+        with self.transaction() as connection:
+            row = connection.execute("SELECT value FROM meta WHERE key = 'plan'").fetchone()
+            if row is not None:
+                if row[0] != encoded:
+                    raise ValueError(f"{self.file_name} was initialized with another plan.")
+                return False
+            connection.execute("INSERT INTO meta (key, value) VALUES ('plan', ?)", (encoded,))
+            connection.executemany("INSERT INTO items (site, query) VALUES (?, ?)",
+                                   [(site_id, query_id)
+                                    for query_id in range(len(plan['queries']))
+                                    for (site_id, site) in enumerate(plan['sites'])
+                                    if site['enabled'] and compiled.is_representative(site_id, query_id)])
+        return True
+
+    def plan(self):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = 'plan'").fetchone()
+        if row is None:
+            raise ValueError(f"{self.file_name} has not been initialized.")
+        return json.loads(row[0])
+
+    def lease(self, owner, sites=None):
+        """Lease the next available item (of SITES, if given) to OWNER, or return None."""
+        now = time.time()
+        condition = "(state = 'pending' OR (state = 'leased' AND expires < ?))"
+        parameters = [now]
+        if sites is not None:
+            condition += f" AND site IN ({', '.join('?' for _ in sites)})"
+            parameters += list(sites)
+        with self.transaction() as connection:
+            row = connection.execute(f"SELECT id, site, query, start, stop, attempts FROM items WHERE {condition} ORDER BY id LIMIT 1",
+                                     parameters).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE items SET state = 'leased', owner = ?, expires = ? WHERE id = ?",
+                               (owner, now + self.lease_seconds, row[0]))
+        return dict(zip(['id', 'site', 'query', 'start', 'stop', 'attempts'], row))
+
+    def renew(self, owner, items):
+        """Extend OWNER's leases on ITEMS, returning how many are still held."""
+        if len(items) == 0:
+            return 0
+        with self.transaction() as connection:
+            cursor = connection.execute(f"UPDATE items SET expires = ? WHERE owner = ? AND state = 'leased' AND id IN ({', '.join('?' for _ in items)})",
+                                        [time.time() + self.lease_seconds, owner] + list(items))
+            return cursor.rowcount
+
+    def complete(self, item, owner, total, records, following):
+        """Store the RECORDS of ITEM and queue the FOLLOWING [start, stop] pages of its pair.
+
+        An item is only completed once, even if its lease expired and
+        another worker fetched it too.
+        """
+        with self.transaction() as connection:
+            row = connection.execute("SELECT site, query, state, owner FROM items WHERE id = ?", (item,)).fetchone()
+            if row is None or row[2] == 'done':
+                return False
+            if row[2] != 'leased' or row[3] != owner:
+                LOGGER.warning("Completing item %d, though %s lost its lease.", item, owner)
+            connection.executemany("INSERT OR REPLACE INTO results (item, position, record) VALUES (?, ?, ?)",
+                                   [(item, position, record) for (position, record) in enumerate(records)])
+            connection.execute("UPDATE items SET state = 'done', owner = ?, expires = NULL, total = ?, error = NULL WHERE id = ?",
+                               (owner, total, item))
+            connection.executemany("INSERT INTO items (site, query, start, stop) VALUES (?, ?, ?, ?)",
+                                   [(row[0], row[1], start, stop) for (start, stop) in following])
+        return True
+
+    def fail(self, item, owner, error):
+        """Return ITEM to the queue after it failed with ERROR, unless it failed too often."""
+        with self.transaction() as connection:
+            connection.execute("UPDATE items SET attempts = attempts + 1, owner = NULL, expires = NULL, error = ?, "
+                               "state = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END "
+                               "WHERE id = ? AND state = 'leased' AND owner = ?",
+                               (error, self.max_attempts, item, owner))
+
+    def counts(self, sites=None):
+        """The number of items in each state (of SITES, if given), counting expired leases as pending."""
+        condition = ""
+        parameters = [time.time()]
+        if sites is not None:
+            condition = f"WHERE site IN ({', '.join('?' for _ in sites)})"
+            parameters += list(sites)
+        with self.lock:
+            rows = self.connection.execute("SELECT CASE WHEN state = 'leased' AND expires < ? THEN 'pending' ELSE state END AS current, COUNT(*) "
+                                           f"FROM items {condition} GROUP BY current", parameters).fetchall()
+        return dict(rows)
+
+    def results(self, after=0, limit=1000):
+        """Up to LIMIT stored results after AFTER, as [row, site, query, record] lists."""
+        with self.lock:
+            rows = self.connection.execute("SELECT results.rowid, items.site, items.query, results.record "
+                                           "FROM results JOIN items ON items.id = results.item "
+                                           "WHERE results.rowid > ? ORDER BY results.rowid LIMIT ?",
+                                           (after, limit)).fetchall()
+        return [list(row) for row in rows]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+# Methods a QueueServer serves.
+METHODS = ('plan', 'lease', 'renew', 'complete', 'fail', 'counts', 'results')
+
+
+class QueueHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        method = self.path.strip('/')
+        try:
+            if method not in METHODS:
+                self.send_error(404)
+                return
+            arguments = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            body = json.dumps({'result': getattr(self.server.queue, method)(**arguments)})
+            status = 200
+        except ValueError as error:
+            body = json.dumps({'error': str(error)})
+            status = 400
+        encoded = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        LOGGER.debug(format, *args)
+
+
+class QueueServer(ThreadingHTTPServer):
+    """Serve a WorkQueue over HTTP, for workers which do not share a filesystem with it."""
+
+    daemon_threads = True
+
+    def __init__(self, queue, address=('127.0.0.1', 8765)):
+        self.queue = queue
+        super().__init__(address, QueueHandler)
+
+
+class RemoteWorkQueue:
+    """A WorkQueue served by a QueueServer at URL."""
+
+    def __init__(self, url, timeout=60):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def call(self, method, **arguments):
+        response = self.session.post(f"{self.url}/{method}", json=arguments, timeout=self.timeout)
+        if response.status_code == 400:
+            raise ValueError(response.json()['error'])
+        response.raise_for_status()
+        return response.json()['result']
+
+    def plan(self):
+        return self.call('plan')
+
+    def lease(self, owner, sites=None):
+        return self.call('lease', owner=owner, sites=sites)
+
+    def renew(self, owner, items):
+        return self.call('renew', owner=owner, items=items)
+
+    def complete(self, item, owner, total, records, following):
+        return self.call('complete', item=item, owner=owner, total=total, records=records, following=following)
+
+    def fail(self, item, owner, error):
+        return self.call('fail', item=item, owner=owner, error=error)
+
+    def counts(self, sites=None):
+        return self.call('counts', sites=sites)
+
+    def results(self, after=0, limit=1000):
+        return self.call('results', after=after, limit=limit)
+
+    def close(self):
+        self.session.close()
+
+
+def open_queue(name, lease=DEFAULT_LEASE, max_attempts=DEFAULT_ATTEMPTS):
+    """Open the work queue NAME, an SQLite file or the URL of a QueueServer."""
+    if name.startswith('http://') or name.startswith('https://'):
+        return RemoteWorkQueue(name)
+    return WorkQueue(name, lease=lease, max_attempts=max_attempts)
+
+
+def following_pages(item, start, total, next_start):
+    """The [start, stop] pages to queue after fetching ITEM's page at START, which ended at NEXT_START."""
+    if item['stop'] is None:
+        step = next_start - start
+        if step <= 0:
+            return []
+        return [[offset, offset + step] for offset in range(next_start, total, step)]
+    if next_start < item['stop'] and next_start < total:
+        return [[next_start, item['stop']]]
+    return []
+
+
+class Worker:
+    """Lease and fetch pages from QUEUE until none are left, on CONCURRENCY threads.
+
+    Only pages of SITES (site indices, all by default) are leased.  The
+    worker's leases are renewed every third of LEASE seconds.
+    """
+
+    def __init__(self, queue, owner=None, sites=None, concurrency=1, cache=None, lease=DEFAULT_LEASE, poll=5):
+        self.queue = queue
+        self.owner = owner or f"{socket.gethostname()}-{os.getpid()}"
+        self.plan = queue.plan()
+        self.sites = sites
+        self.concurrency = max(1, concurrency)
+        self.cache = cache
+        self.lease = lease
+        self.poll = poll
+        self.held = set()
+        self.apis = {}
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.pages = 0
+
+    def api(self, site_id, query_id):
+        with self.lock:
+            if (site_id, query_id) not in self.apis:
+                api = make_api_object(self.plan['sites'][site_id], self.cache)
+                api.set_query_options(self.plan['queries'][query_id])
+                self.apis[(site_id, query_id)] = api
+            return self.apis[(site_id, query_id)]
+
+    def process(self, item):
+        api = self.api(item['site'], item['query'])
+        start = item['start'] if item['start'] is not None else api.start
+        LOGGER.info("Fetching page at %d of site %d, query %d.", start, item['site'], item['query'])
+        (results, total, next_start) = api.fetch_page_at(start)
+        records = [jsonpickle.encode(result) for result in results]
+        self.queue.complete(item['id'], self.owner, total, records,
+                            following_pages(item, start, total, next_start))
+
+    def heartbeat(self):
+        while not self.done.wait(self.lease / 3):
+            with self.lock:
+                held = list(self.held)
+            if len(held) > 0:
+                LOGGER.debug("Renewing %d leases.", len(held))
+                self.queue.renew(self.owner, held)
+
+    def work(self):
+        while True:
+            item = self.queue.lease(self.owner, self.sites)
+            if item is None:
+                counts = self.queue.counts(self.sites)
+                if counts.get('pending', 0) + counts.get('leased', 0) == 0:
+                    return
+                # Pages leased by others may come back, or be followed by more pages.
+                time.sleep(self.poll)
+                continue
+            with self.lock:
+                self.held.add(item['id'])
+            try:
+                self.process(item)
+                with self.lock:
+                    self.pages += 1
+            except Exception as error:
+                LOGGER.error("Page %d failed: %s.", item['id'], error)
+                self.queue.fail(item['id'], self.owner, str(error))
+            finally:
+                with self.lock:
+                    self.held.discard(item['id'])
+
+    def run(self):
+        heartbeat = threading.Thread(target=self.heartbeat, name='qal-heartbeat', daemon=True)
+        heartbeat.start()
+        threads = [threading.Thread(target=self.work, name=f"qal-worker-{k}")
+                   for k in range(self.concurrency)]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            self.done.set()
+            heartbeat.join()
+        return self.pages
+
+
+def collect(queue, results):
+    """Add every result stored in QUEUE to the results store RESULTS, as qal-auto would have."""
+    plan = queue.plan()
+    compiled = CompiledPlan(plan)
+    count = 0
+    after = 0
+    while True:
+        rows = queue.results(after)
+        if len(rows) == 0:
+            break
+        for (row, site_id, query_id, record) in rows:
+            item = jsonpickle.decode(record)
+            for query in compiled.queries(site_id, query_id):
+                results.add_item(item, plan['sites'][site_id]['name'], query)
+            count += 1
+            after = row
+        results.checkpoint()
+    return count
+
+
+def main():
+    parser = ArgumentParser(
+        description="Share the pages of a qal-auto plan between workers on several machines.")
+
+    parser.add_argument('--verbose', '-v',
+                        help="provide verbose logging",
+                        default=0,
+                        action='count',
+                        dest='verbose')
+
+    parser.add_argument('--lease', metavar='SECONDS',
+                        help="how long a worker holds a page before it goes back to the queue",
+                        type=float,
+                        dest='lease',
+                        default=DEFAULT_LEASE)
+
+    parser.add_argument('--max-attempts', metavar='N',
+                        help="how many times a page is tried before giving up on it",
+                        type=int,
+                        dest='max_attempts',
+                        default=DEFAULT_ATTEMPTS)
+
+    parser.add_argument('command',
+                        choices=['init', 'work', 'serve', 'collect', 'status'],
+                        help="init queues a plan's pairs, work fetches pages, serve shares the queue over HTTP, collect writes the results, status counts pages")
+
+    parser.add_argument('queue', metavar='QUEUE',
+                        help="the queue, an SQLite file (or, for work, collect and status, the URL of qal-queue serve)")
+
+    parser.add_argument('--plan-file', '-p', metavar='PLAN',
+                        help="the plan to queue (for init)",
+                        type=str,
+                        dest='plan_file')
+
+    parser.add_argument('--site', metavar='NAME',
+                        help="only fetch pages of the site NAME (for work, may be repeated)",
+                        action='append',
+                        dest='sites')
+
+    parser.add_argument('--concurrency', metavar='N',
+                        help="how many pages to fetch at a time (for work)",
+                        type=int,
+                        dest='concurrency',
+                        default=1)
+
+    parser.add_argument('--address', metavar='HOST:PORT',
+                        help="where to serve the queue (for serve)",
+                        type=str,
+                        dest='address',
+                        default='127.0.0.1:8765')
+
+    parser.add_argument('--output-file', '-o', metavar='OUT',
+                        help="the results store to write (for collect)",
+                        type=str,
+                        dest='out_file')
+
+    parser.add_argument('--store-format', metavar='FORMAT',
+                        help="how the output file is kept (for collect)",
+                        type=str,
+                        choices=STORE_FORMATS.keys(),
+                        dest='store_format',
+                        default='json')
+
+    add_cache_arguments(parser)
+    add_dedup_arguments(parser)
+
+    args = parser.parse_args()
+
+    logging.getLogger('qal').setLevel((6 - args.verbose)*10)
+
+    if args.command == 'init':
+        if args.plan_file is None:
+            parser.error("init requires a plan file (--plan-file).")
+        with open(args.plan_file, 'r') as fd:
+            plan = json.load(fd)
+        # Priorities are for the qal-auto scheduler, not query options.
+        for query in plan['queries']:
+            query.pop('priority', None)
+        queue = WorkQueue(args.queue, lease=args.lease, max_attempts=args.max_attempts)
+        try:
+            if queue.initialize(plan):
+                print(f"Queued {sum(queue.counts().values())} pairs.")
+            else:
+                print("The plan was already queued.")
+        except ValueError as error:
+            parser.error(str(error))
+        finally:
+            queue.close()
+        return
+
+    if args.command == 'serve':
+        queue = WorkQueue(args.queue, lease=args.lease, max_attempts=args.max_attempts)
+        (host, port) = args.address.rsplit(':', 1)
+        server = QueueServer(queue, (host, int(port)))
+        LOGGER.warning("Serving %s at http://%s:%d.", args.queue, *server.server_address[:2])
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            queue.close()
+        return
+
+    queue = open_queue(args.queue, lease=args.lease, max_attempts=args.max_attempts)
+    try:
+        if args.command == 'status':
+            for (state, count) in sorted(queue.counts().items()):
+                print(f"{state}: {count}")
+        elif args.command == 'work':
+            if args.offline and args.cache is None:
+                parser.error("--offline requires a response cache (--cache).")
+            sites = None
+            if args.sites is not None:
+                names = [site['name'] for site in queue.plan()['sites']]
+                unknown = [name for name in args.sites if name not in names]
+                if len(unknown) > 0:
+                    parser.error(f"The plan has no site {', '.join(unknown)}.")
+                sites = [site_id for (site_id, name) in enumerate(names) if name in args.sites]
+            worker = Worker(queue, sites=sites, concurrency=args.concurrency,
+                            cache=cache_from_arguments(args), lease=args.lease)
+            pages = worker.run()
+            print(f"Fetched {pages} pages.")
+            print_summary()
+        elif args.command == 'collect':
+            if args.out_file is None:
+                parser.error("collect requires an output file (--output-file).")
+            counts = queue.counts()
+            if counts.get('pending', 0) + counts.get('leased', 0) + counts.get('failed', 0) > 0:
+                LOGGER.warning("Collecting an unfinished queue: %s.", counts)
+            saviness = 0 if args.store_format in ('sqlite', 'indexed') else 1000
+            results = open_results_store(args.out_file, saviness=saviness, store_format=args.store_format)
+            results = dedup_from_arguments(results, args)
+            try:
+                print(f"Collected {collect(queue, results)} results.")
+                if hasattr(results, 'compact'):
+                    results.compact()
+            finally:
+                results.close()
+    finally:
+        queue.close()